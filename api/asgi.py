@@ -0,0 +1,251 @@
+"""
+ASGI entry point for the County Health API
+Serves /county_data, /county_data/batch and /county_data/stats with the same
+validation, lookups, caches and bodies as the Flask app in county_data.py.
+Cached answers are sent straight from the event loop; everything that can
+block (loading the data, SQLite queries, serialization) runs on a bounded
+thread pool, so slow lookups never stall other connections.
+
+Run under any ASGI server, e.g. uvicorn api.asgi:app
+"""
+
+import asyncio
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import api.county_data as county_data
+from api.backends import POOL_SIZE
+from api.county_data import (CACHE_CONTROL, NDJSON_MIMETYPE, batch_results, cache_stats,
+                             county_data_etag, county_data_records, county_data_result,
+                             get_db, json_body, parse_batch_request, parse_county_data_request,
+                             parse_json_body, query_data, response_cache_key, stream_batch_results,
+                             wants_stream)
+
+# Threads running blocking work. Each lookup holds one pooled snapshot
+# connection while it runs, so the default matches the pool size; streams
+# read from their own connection between chunks.
+THREADS = int(os.environ.get('COUNTY_DATA_THREADS', POOL_SIZE))
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='county_data')
+
+# Streamed responses hand the event loop this many records per chunk
+STREAM_CHUNK_RECORDS = 500
+
+async def run_blocking(func, *args):
+    """Run func(*args) on the bounded thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+async def read_body(receive):
+    """Collect the request body from http.request messages"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+def request_headers(scope):
+    """Lower-cased header names mapped to decoded values"""
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+def is_json(headers):
+    """Match Flask's request.is_json on the Content-Type header"""
+    mimetype = headers.get('content-type', '').split(';')[0].strip().lower()
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against an ETag, weakly as Flask does"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+def jsonify_body(obj):
+    """Serialize obj as Flask's jsonify does outside debug mode (compact)"""
+    return (county_data.app.json.dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')
+
+async def send_response(send, status, body=b'', content_type='application/json', headers=()):
+    """Send a complete response"""
+    response_headers = [(b'content-length', str(len(body)).encode('latin-1'))]
+    if content_type:
+        response_headers.append((b'content-type', content_type.encode('latin-1')))
+    response_headers.extend((name.encode('latin-1'), value.encode('latin-1')) for name, value in headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_error(send, error, status):
+    """Send an error from the shared validators: a dict as JSON, text as is"""
+    if isinstance(error, str):
+        await send_response(send, status, error.encode('utf-8'), 'text/html; charset=utf-8')
+    else:
+        await send_response(send, status, jsonify_body(error))
+
+def next_chunk(records):
+    """Encode up to STREAM_CHUNK_RECORDS records as NDJSON"""
+    return b''.join(json_body(record) for record in itertools.islice(records, STREAM_CHUNK_RECORDS))
+
+async def send_stream(send, records):
+    """Stream records as NDJSON, reading and encoding each chunk on the thread pool"""
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', NDJSON_MIMETYPE.encode('latin-1'))]})
+    try:
+        while True:
+            chunk = await run_blocking(next_chunk, records)
+            if not chunk:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # Closes the stream's connection when the client goes away mid-stream
+        records.close()
+
+async def read_request_data(scope, receive, send, headers):
+    """Return the query string or JSON body as a dict, or None once an error was sent"""
+    if scope['method'] == 'GET':
+        # Decoded as Werkzeug decodes request.args: blanks kept, bad UTF-8 replaced
+        query = scope.get('query_string', b'').decode('utf-8', 'replace')
+        return query_data(parse_qsl(query, keep_blank_values=True, errors='replace'))
+    if not is_json(headers):
+        await send_response(send, 400, jsonify_body({"error": "Content-Type must be application/json"}))
+        return None
+    data, error = parse_json_body(await read_body(receive))
+    if error:
+        await send_error(send, *error)
+        return None
+    return data
+
+async def county_data_endpoint(scope, receive, send, headers):
+    data = await read_request_data(scope, receive, send, headers)
+    if data is None:
+        return
+
+    lookup, error = parse_county_data_request(data)
+    if error:
+        await send_error(send, *error)
+        return
+    zip_code, measure_name, typed, mode = lookup
+
+    accept = parse_accept_header(headers.get('accept'), MIMEAccept)
+    if wants_stream(data, accept) and not mode:
+        records, error = await run_blocking(county_data_records, zip_code, measure_name, typed)
+        if error:
+            await send_error(send, *error)
+        else:
+            await send_stream(send, records)
+        return
+
+    # The first request loads the data, which must not happen on the loop
+    db = county_data._db or await run_blocking(get_db)
+    etag = county_data_etag(db.dataset_version, zip_code, measure_name, typed, mode)
+    response_headers = [('etag', f'"{etag}"'), ('cache-control', CACHE_CONTROL), ('vary', 'Accept')]
+    if etag_matches(headers.get('if-none-match'), etag):
+        await send_response(send, 304, content_type=None, headers=response_headers)
+        return
+
+    key = response_cache_key(zip_code, measure_name, typed, mode)
+    result = county_data.response_cache.get(key, count_miss=False)
+    if result is None:
+        result = await run_blocking(county_data_result, zip_code, measure_name, typed, mode)
+    body, status = result
+    await send_response(send, status, body, headers=response_headers)
+
+def batch_body(zip_keys, measure_names, typed):
+    """Serialized /county_data/batch results"""
+    db = get_db()
+    county_infos = db.counties_for_zips([key for key, valid in zip_keys.items() if valid])
+    return json_body({"results": batch_results(db, zip_keys, measure_names, county_infos, typed)})
+
+def batch_records(zip_keys, measure_names, typed):
+    """Streamed /county_data/batch records"""
+    db = get_db()
+    county_infos = db.counties_for_zips([key for key, valid in zip_keys.items() if valid])
+    return stream_batch_results(db, zip_keys, measure_names, county_infos, typed)
+
+async def batch_endpoint(scope, receive, send, headers):
+    data = await read_request_data(scope, receive, send, headers)
+    if data is None:
+        return
+
+    batch, error = parse_batch_request(data)
+    if error:
+        await send_error(send, *error)
+        return
+
+    if wants_stream(data, parse_accept_header(headers.get('accept'), MIMEAccept)):
+        await send_stream(send, await run_blocking(batch_records, *batch))
+    else:
+        await send_response(send, 200, await run_blocking(batch_body, *batch))
+
+async def stats_endpoint(scope, receive, send, headers):
+    await send_response(send, 200, jsonify_body(cache_stats()))
+
+# path: (endpoint, allowed methods)
+ROUTES = {
+    '/county_data': (county_data_endpoint, ('GET', 'POST')),
+    '/county_data/batch': (batch_endpoint, ('POST',)),
+    '/county_data/stats': (stats_endpoint, ('GET',)),
+}
+
+async def lifespan(receive, send):
+    """Load the data at startup so the first request does not pay for it"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await run_blocking(get_db)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI 3 application"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    route = ROUTES.get(scope['path'])
+    if route is None:
+        await send_response(send, 404, jsonify_body({"error": "Not found"}))
+        return
+    endpoint, methods = route
+    if scope['method'] not in methods:
+        await send_response(send, 405, jsonify_body({"error": "Method not allowed"}),
+                            headers=[('allow', ', '.join(methods))])
+        return
+
+    started = False
+
+    async def tracked_send(message):
+        nonlocal started
+        started = started or message['type'] == 'http.response.start'
+        await send(message)
+
+    try:
+        await endpoint(scope, receive, tracked_send, request_headers(scope))
+    except Exception as e:
+        if started:
+            # Too late for a 500: re-raise so the server aborts the response
+            # and the client sees it cut short rather than a second start
+            raise
+        await send_response(send, 500, jsonify_body({"error": str(e)}))
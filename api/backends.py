@@ -0,0 +1,815 @@
+"""
+Storage backends for the County Health API
+Every backend answers the same lookups; county_data.py picks one with the
+COUNTY_DATA_BACKEND environment variable ("sqlite", "sqlite_pool", "memory"
+or "sharded").
+"""
+
+import math
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from contextlib import closing, nullcontext
+from urllib.request import pathname2url
+
+from api.cache import LRUCache
+from api.columns import is_numeric_column, number_from_column, numeric_column
+from api.measure_index import MEASURE_ROWS_SQL, MeasureIndex
+from api.rankings import MeasureRanking
+from api.serialization import Fragment, encode_rows
+from api.zip_index import IS_FIPS_SQL, ZipIndex, fips_codes, fips_key
+
+ZIP_SQL = """
+    SELECT county, state_abbreviation, county_code
+    FROM zip_counties
+    WHERE zip = ?
+    ORDER BY county, state_abbreviation, county_code
+    LIMIT 1
+"""
+
+# A county's rows for a measure by integer FIPS code. {codes} holds a
+# placeholder per text form of the code (see zip_index.fips_codes), each
+# a probe of the (fipscode, measure_name) index.
+HEALTH_SQL = """
+    SELECT *
+    FROM county_health_rankings
+    WHERE fipscode IN ({codes})
+    AND measure_name = ?
+"""
+
+# A county by integer FIPS code, named as its health rows are (see
+# county_data.build_fips_tables)
+FIPS_COUNTY_SQL = """
+    SELECT county, state
+    FROM fips_counties
+    WHERE fips = ?
+"""
+
+# Every zip with any part in a county, by integer FIPS code
+ZIPS_FOR_FIPS_SQL = """
+    SELECT DISTINCT zip
+    FROM zip_counties
+    WHERE fips = ?
+    ORDER BY zip
+"""
+
+# Every county a zip spans, heaviest share of its population first
+WEIGHTED_ZIP_SQL = """
+    SELECT county, state_abbreviation, county_code, COALESCE(zip_pop_in_county, 0)
+    FROM zip_counties
+    WHERE zip = ?
+    ORDER BY 4 DESC, county, state_abbreviation, county_code
+"""
+
+# The untyped rows (as a JSON array) and time series record of the most
+# populous counties, pre-encoded by api/load_data.py per (integer FIPS code,
+# measure_name). Every other answer is built from the rows on request and
+# kept in the response caches.
+FRAGMENTS_TABLE = 'health_fragments'
+
+PREBUILT_FRAGMENT_SQL = f"""
+    SELECT {{column}}
+    FROM {FRAGMENTS_TABLE}
+    WHERE fips = ?
+    AND measure_name = ?
+"""
+
+# The dataset version a snapshot was built from, written by api/load_data.py
+SNAPSHOT_VERSION_SQL = "SELECT value FROM snapshot_meta WHERE key = 'dataset_version'"
+
+# The ZipIndex of zip_county, serialized into the snapshot by api/load_data.py
+ZIP_INDEX_TABLE = 'zip_index'
+
+# A state's health rows, by its FIPS code (the county code less its last
+# three digits). {ranges} holds a BETWEEN per text width of the state's
+# codes (see state_code_ranges), each a range of the (fipscode, measure_name) index.
+STATE_HEALTH_SQL = f"""
+    SELECT *
+    FROM county_health_rankings
+    WHERE ({{ranges}})
+    AND {IS_FIPS_SQL.format(column='fipscode')}
+    AND CAST(fipscode AS INTEGER) / 1000 = ?
+"""
+
+# Most memory ShardedMemoryBackend spends on loaded state shards
+SHARD_CACHE_BYTES = int(float(os.environ.get('COUNTY_DATA_SHARD_CACHE_MB', 64)) * 1024 * 1024)
+
+# Most connections PooledSQLiteBackend opens to one snapshot
+POOL_SIZE = int(os.environ.get('COUNTY_DATA_POOL_SIZE', 8))
+
+# Seconds a lookup waits for a pooled connection before giving up
+POOL_TIMEOUT = float(os.environ.get('COUNTY_DATA_POOL_TIMEOUT', 30))
+
+# Keep each statement well under SQLite's bound-parameter limit
+MAX_SQL_PARAMS = 900
+
+def read_only_uri(conn):
+    """Return (URI, mmap_size) to reopen conn's database file read-only, or (None, 0) in memory"""
+    path = next((file for _, name, file in conn.execute("PRAGMA database_list") if name == 'main'), '')
+    if not path:
+        return None, 0
+    return f"file:{pathname2url(path)}?mode=ro&immutable=1", conn.execute("PRAGMA mmap_size").fetchone()[0]
+
+class SnapshotReplaced(Exception):
+    """The snapshot file now holds another dataset version than the backend loaded"""
+
+def snapshot_version(conn):
+    """The dataset version of a snapshot connection, or None for other databases"""
+    try:
+        row = conn.execute(SNAPSHOT_VERSION_SQL).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def connect_read_only(uri, mmap_size, dataset_version=None):
+    """Open another read-only connection to a database file.
+
+    The file is reopened by path, which api/load_data.update_snapshot may
+    have pointed at a new snapshot since. Given the dataset_version the
+    backend loaded, a connection reading any other raises SnapshotReplaced.
+    """
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+    if dataset_version is not None and snapshot_version(conn) != dataset_version:
+        conn.close()
+        raise SnapshotReplaced(f"The snapshot no longer holds dataset version {dataset_version}")
+    return conn
+
+def chunked(items, size):
+    """Yield successive lists of at most size items"""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def read_measure_index(conn, measure_name):
+    """Query a measure's MeasureIndex from county_health_rankings"""
+    return MeasureIndex.from_cursor(conn.execute(MEASURE_ROWS_SQL, (measure_name,)))
+
+def state_code_ranges(state_fips):
+    """[(low, high)] text bounds of every code fips_key reads as a county of a state, one per width"""
+    low, high = str(state_fips * 1000), str(state_fips * 1000 + 999)
+    return [(low.zfill(width), high.zfill(width)) for width in range(len(low), 6)]
+
+def read_fips_counties(conn):
+    """{integer FIPS code: (county, state)} of every county in the health rows"""
+    return {fips: (county, state) for fips, county, state in conn.execute("SELECT * FROM fips_counties")}
+
+def county_fips(county_info):
+    """The integer FIPS code of a (county, state, county_code, ...) tuple, or None"""
+    return fips_key(county_info[2])
+
+def counties_fips(county_infos):
+    """The integer FIPS codes of (county, state, county_code, ...) tuples that have one"""
+    return [fips for fips in map(county_fips, county_infos) if fips is not None]
+
+def weighted_aggregates(weighted_counties, rows):
+    """Population-weight raw_value across a zip's counties, per year_span.
+
+    weighted_counties is [(county, state, county_code, weight)] and rows
+    the health rows of those counties for one measure, matched to them by
+    FIPS code. Rows without a numeric raw_value are skipped. When the
+    contributing counties carry no weight at all, the plain mean is used.
+
+    Sums are exactly rounded (math.fsum), so the result does not depend on
+    the order backends hand the rows over in.
+    """
+    weights = {fips_key(county_code): weight for _, _, county_code, weight in weighted_counties}
+    groups = {}
+    for row in rows:
+        value = row['raw_value']
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        weight = weights[fips_key(row['fipscode'])]
+        weighted, county_weights, values = groups.setdefault(row['year_span'], ([], [], []))
+        weighted.append(weight * value)
+        county_weights.append(weight)
+        values.append(value)
+    aggregates = []
+    # NULL year spans first, as SQLite orders them
+    for year_span in sorted(groups, key=lambda year_span: (year_span is not None, year_span or '')):
+        weighted, county_weights, values = groups[year_span]
+        total_weight = math.fsum(county_weights)
+        aggregates.append({
+            'year_span': year_span,
+            'raw_value': (math.fsum(weighted) / total_weight if total_weight > 0
+                          else math.fsum(values) / len(values)),
+            'weight': total_weight,
+            'n_counties': len(values),
+        })
+    return aggregates
+
+class Backend:
+    """Read-only lookup interface shared by every storage backend"""
+
+    name = None
+
+    # Identifies the loaded data; set by county_data.load_backend
+    dataset_version = None
+
+    # Whether lookups keep reading the connection the backend was built from
+    owns_connection = False
+
+    # MeasureIndex per measure_name, filled in by measure_index()
+    _measure_indexes = None
+
+    # MeasureRanking per measure_name, filled in by measure_ranking()
+    _measure_rankings = None
+
+    def county_for_zip(self, zip_code):
+        """Return (county, state, county_code) for a zip code, or None.
+
+        Zips that span several counties resolve to the first county in
+        (county, state, county_code) order, the same for every backend.
+        """
+        raise NotImplementedError
+
+    def health_rows(self, fips, measure_name):
+        """Return the health rows for a county, by integer FIPS code, and measure as a list of dicts.
+
+        Counties are matched on their code alone; the rows may name them
+        differently from release to release.
+        """
+        raise NotImplementedError
+
+    def county_for_fips(self, fips):
+        """Return (county, state, fipscode) for an integer FIPS code, named as its health rows are, or None"""
+        raise NotImplementedError
+
+    def zips_for_fips(self, fips):
+        """Return the zip codes with any part in the county with an integer FIPS code"""
+        raise NotImplementedError
+
+    def weighted_counties_for_zip(self, zip_code):
+        """Return [(county, state, county_code, weight)] for every county of a zip.
+
+        weight is the county's share of the zip population (zip_pop_in_county,
+        0.0 when unknown); the heaviest county comes first.
+        """
+        raise NotImplementedError
+
+    def zip_aggregates(self, zip_code, measure_name, weighted_counties=None, rows=None):
+        """Return the population-weighted aggregates for a zip and measure.
+
+        They are computed from the rows, which callers that already fetched
+        them can pass in.
+        """
+        if weighted_counties is None:
+            weighted_counties = self.weighted_counties_for_zip(zip_code)
+        if rows is None:
+            rows = self.iter_health_rows_for_counties(counties_fips(weighted_counties), [measure_name])
+        return weighted_aggregates(weighted_counties, rows)
+
+    def counties_for_zips(self, zip_codes):
+        """Return {zip: (county, state, county_code)} for the zips that resolve"""
+        result = {}
+        for zip_code in zip_codes:
+            county_info = self.county_for_zip(zip_code)
+            if county_info:
+                result[zip_code] = county_info
+        return result
+
+    def iter_health_rows_for_counties(self, counties, measure_names):
+        """Yield the health rows for every combination of integer FIPS code and measure, one dict at a time"""
+        # A county listed twice for a zip gives its rows once, as the SQL IN lists do
+        for fips in dict.fromkeys(counties):
+            for measure_name in measure_names:
+                yield from self.health_rows(fips, measure_name)
+
+    def health_rows_for_counties(self, counties, measure_names):
+        """Return {(fips, measure_name): rows} for every combination"""
+        result = {
+            (fips, measure_name): []
+            for fips in counties
+            for measure_name in measure_names
+        }
+        for row in self.iter_health_rows_for_counties(counties, measure_names):
+            result[(fips_key(row['fipscode']), row['measure_name'])].append(row)
+        return result
+
+    def health_fragments_for_counties(self, counties, measure_names, typed=False):
+        """Return {(fips, measure_name): rows encoded as a Fragment, or None}"""
+        return {key: encode_rows(rows, typed) if rows else None
+                for key, rows in self.health_rows_for_counties(counties, measure_names).items()}
+
+    def prebuilt_rows(self, fips, measure_name, typed=False):
+        """Return a county's rows for a measure as a prebuilt Fragment, or None"""
+        return None
+
+    def prebuilt_series(self, fips, measure_name, typed=False):
+        """Return a county's time series record for a measure as a prebuilt Fragment, or None"""
+        return None
+
+    def measure_index(self, measure_name):
+        """The MeasureIndex of every county's rows for a measure, built on first use"""
+        indexes = self._measure_indexes
+        if indexes is None:
+            indexes = self._measure_indexes = {}
+        index = indexes.get(measure_name)
+        if index is None:
+            index = indexes[measure_name] = self.read_measure_index(measure_name)
+        return index
+
+    def read_measure_index(self, measure_name):
+        """Build the MeasureIndex of a measure from the loaded data"""
+        raise NotImplementedError
+
+    def measure_ranking(self, measure_name):
+        """The MeasureRanking of a measure's rows, computed from its MeasureIndex on first use"""
+        rankings = self._measure_rankings
+        if rankings is None:
+            rankings = self._measure_rankings = {}
+        ranking = rankings.get(measure_name)
+        if ranking is None:
+            ranking = rankings[measure_name] = MeasureRanking(self.measure_index(measure_name))
+        return ranking
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Build the backend from a loaded SQLite database"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the backend"""
+
+    def after_fork(self):
+        """Replace per-process resources in a freshly forked worker.
+
+        Loaded data is inherited as is. SQLite connections must not be
+        used across fork(), so backends holding one open their own, and
+        raise SnapshotReplaced if the snapshot changed since it was loaded.
+        """
+
+class SQLiteBackend(Backend):
+    """Backend that queries a SQLite connection (snapshot or in-memory)"""
+
+    name = 'sqlite'
+    owns_connection = True
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._uri, self._mmap_size = read_only_uri(conn)
+        self._tables = None
+        self._zip_index = None
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Serve lookups straight from the loaded connection"""
+        return cls(conn)
+
+    def close(self):
+        self.conn.close()
+
+    def after_fork(self):
+        # An in-memory database is copied with the process, so it stays usable
+        if self._uri:
+            self.conn = connect_read_only(self._uri, self._mmap_size, self.dataset_version)
+
+    def connection(self):
+        """Context manager lending a connection for one lookup"""
+        return nullcontext(self.conn)
+
+    def stream_connection(self):
+        """Context manager lending a connection a generator may hold across yields"""
+        return nullcontext(self.conn)
+
+    def has_table(self, name):
+        """Check whether the database has a table, e.g. one only snapshots carry"""
+        if self._tables is None:
+            with self.connection() as conn:
+                self._tables = frozenset(name for name, in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        return name in self._tables
+
+    def zip_index(self):
+        """The snapshot's ZipIndex, loaded on first use, or None without one"""
+        if self._zip_index is None and self.has_table(ZIP_INDEX_TABLE):
+            with self.connection() as conn:
+                self._zip_index = ZipIndex.from_row(conn.execute(f"SELECT * FROM {ZIP_INDEX_TABLE}").fetchone())
+        return self._zip_index
+
+    def county_for_zip(self, zip_code):
+        zip_index = self.zip_index()
+        if zip_index is not None:
+            return zip_index.county_for_zip(zip_code)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(ZIP_SQL, (zip_code,))
+            return cursor.fetchone()
+
+    def health_rows(self, fips, measure_name):
+        codes = fips_codes(fips)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(HEALTH_SQL.format(codes=','.join('?' * len(codes))), codes + [measure_name])
+
+            # Get column names
+            columns = [description[0] for description in cursor.description]
+
+            # Fetch all rows and convert to list of dicts
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def county_for_fips(self, fips):
+        with self.connection() as conn:
+            row = conn.execute(FIPS_COUNTY_SQL, (fips,)).fetchone()
+        return row + (f"{fips:05d}",) if row else None
+
+    def zips_for_fips(self, fips):
+        zip_index = self.zip_index()
+        if zip_index is not None:
+            return zip_index.zips_for_fips(fips)
+        with self.connection() as conn:
+            return [zip_code for zip_code, in conn.execute(ZIPS_FOR_FIPS_SQL, (fips,))]
+
+    def weighted_counties_for_zip(self, zip_code):
+        zip_index = self.zip_index()
+        if zip_index is not None:
+            return zip_index.weighted_counties_for_zip(zip_code)
+        with self.connection() as conn:
+            return [(county, state, county_code, float(weight))
+                    for county, state, county_code, weight in conn.execute(WEIGHTED_ZIP_SQL, (zip_code,))]
+
+    def prebuilt_fragment(self, column, fips, measure_name, typed):
+        """Read a column of FRAGMENTS_TABLE as a Fragment; only untyped answers are prebuilt"""
+        if typed or not self.has_table(FRAGMENTS_TABLE):
+            return None
+        with self.connection() as conn:
+            row = conn.execute(PREBUILT_FRAGMENT_SQL.format(column=column), (fips, measure_name)).fetchone()
+        return Fragment(row[0]) if row else None
+
+    def prebuilt_rows(self, fips, measure_name, typed=False):
+        return self.prebuilt_fragment('rows', fips, measure_name, typed)
+
+    def prebuilt_series(self, fips, measure_name, typed=False):
+        return self.prebuilt_fragment('series', fips, measure_name, typed)
+
+    def read_measure_index(self, measure_name):
+        with self.connection() as conn:
+            return read_measure_index(conn, measure_name)
+
+    def health_fragments_for_counties(self, counties, measure_names, typed=False):
+        if typed or not self.has_table(FRAGMENTS_TABLE):
+            return super().health_fragments_for_counties(counties, measure_names, typed)
+        counties = set(counties)
+        measure_names = list(measure_names)
+        result = {
+            (fips, measure_name): None
+            for fips in counties
+            for measure_name in measure_names
+        }
+        if not measure_names:
+            return result
+        with self.connection() as conn:
+            for chunk in chunked(counties, MAX_SQL_PARAMS - len(measure_names)):
+                cursor = conn.execute(f"""
+                    SELECT fips, measure_name, rows
+                    FROM {FRAGMENTS_TABLE}
+                    WHERE fips IN ({','.join('?' * len(chunk))})
+                    AND measure_name IN ({','.join('?' * len(measure_names))})
+                """, chunk + measure_names)
+                for fips, measure_name, fragment in cursor:
+                    result[(fips, measure_name)] = Fragment(fragment)
+        # Counties outside the prebuilt set are encoded from their rows
+        missing = counties.difference(fips for (fips, _), fragment in result.items() if fragment is not None)
+        if missing:
+            result.update(super().health_fragments_for_counties(missing, measure_names))
+        return result
+
+    def counties_for_zips(self, zip_codes):
+        if self.zip_index() is not None:
+            return super().counties_for_zips(zip_codes)
+        result = {}
+        with self.connection() as conn:
+            for chunk in chunked(set(zip_codes), MAX_SQL_PARAMS):
+                cursor = conn.execute(f"""
+                    SELECT zip, county, state_abbreviation, county_code
+                    FROM zip_counties
+                    WHERE zip IN ({','.join('?' * len(chunk))})
+                    ORDER BY zip, county, state_abbreviation, county_code
+                """, chunk)
+                # Keep the first county per zip, as ZIP_SQL does
+                for zip_code, county, state, county_code in cursor:
+                    result.setdefault(zip_code, (county, state, county_code))
+        return result
+
+    def iter_health_rows_for_counties(self, counties, measure_names):
+        # Rows are read from the cursor as they are consumed, so callers that
+        # stream them never hold the whole result in memory
+        measure_names = list(measure_names)
+        if not measure_names:
+            return
+        codes = [code for fips in set(counties) for code in fips_codes(fips)]
+        # The connection stays lent across yields, until the generator
+        # finishes or is closed, so it never comes from a pool
+        with self.stream_connection() as conn:
+            for chunk in chunked(codes, MAX_SQL_PARAMS - len(measure_names)):
+                # Both IN lists are probes of the (fipscode, measure_name) index
+                cursor = conn.execute(f"""
+                    SELECT *
+                    FROM county_health_rankings
+                    WHERE fipscode IN ({','.join('?' * len(chunk))})
+                    AND measure_name IN ({','.join('?' * len(measure_names))})
+                """, chunk + measure_names)
+                columns = [description[0] for description in cursor.description]
+                for row in cursor:
+                    yield dict(zip(columns, row))
+
+class PooledSQLiteBackend(SQLiteBackend):
+    """SQLiteBackend lending each lookup its own read-only snapshot connection.
+
+    One sqlite3 connection serializes every statement run on it, so
+    concurrent requests queue behind each other. The pool opens up to
+    size connections to the same file (mode=ro, immutable=1) on demand
+    and hands them out most-recently-used first. Databases without a
+    file, such as the in-memory CSV fallback, get a pool of one.
+
+    Streams read at the pace of their client, so they never hold a pooled
+    connection: each opens its own, or shares self.conn in memory.
+
+    Once the snapshot file is replaced (see connect_read_only), no more
+    connections are opened: lookups and streams make do with the ones
+    already reading the old file until the reload swaps in a new backend.
+    """
+
+    name = 'sqlite_pool'
+
+    def __init__(self, conn, size=None):
+        super().__init__(conn)
+        self.size = size or POOL_SIZE
+        self._reset_pool()
+
+    def _reset_pool(self):
+        """Start over with self.conn as the only connection"""
+        self._replaced = False
+        self._connections = [self.conn]
+        self._idle = queue.LifoQueue()
+        self._idle.put(self.conn)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+
+    def after_fork(self):
+        # The inherited connections (and the pool's lock) belong to the parent
+        super().after_fork()
+        self._reset_pool()
+
+    def connection(self):
+        return PooledConnection(self)
+
+    def stream_connection(self):
+        if self._uri and not self._replaced:
+            try:
+                return closing(connect_read_only(self._uri, self._mmap_size, self.dataset_version))
+            except SnapshotReplaced:
+                self._replaced = True
+        # sqlite3 serializes statements on one connection across threads
+        return nullcontext(self.conn)
+
+    def acquire(self):
+        """Take an idle connection, opening one while the pool is below size.
+
+        Raises TimeoutError when none is returned within POOL_TIMEOUT seconds.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._uri and not self._replaced and len(self._connections) < self.size:
+                try:
+                    conn = connect_read_only(self._uri, self._mmap_size, self.dataset_version)
+                except SnapshotReplaced:
+                    self._replaced = True
+                else:
+                    self._connections.append(conn)
+                    return conn
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection was free within {POOL_TIMEOUT:g} seconds") from None
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+class PooledConnection:
+    """Context manager holding one connection of a PooledSQLiteBackend"""
+
+    __slots__ = ('pool', 'conn')
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        self.conn = self.pool.acquire()
+        return self.conn
+
+    def __exit__(self, *exc_info):
+        self.pool.release(self.conn)
+
+class HealthColumns:
+    """Health rows stored column by column, grouped by (integer FIPS code, measure_name).
+
+    Rows are sorted by group, so each group is a (start, stop) slice.
+    Rows whose fipscode is not a FIPS code are grouped under -1, which no
+    lookup asks for; they are kept for the measure indexes.
+    Numeric columns are packed float64 arrays (NumPy when installed);
+    text columns hold interned strings, so the hundreds of thousands of
+    rows share one copy of each value.
+    """
+
+    __slots__ = ('columns', 'data', 'numeric', 'groups')
+
+    def __init__(self, columns=(), data=None, numeric=frozenset(), groups=None):
+        self.columns = columns
+        self.data = data or {}
+        self.numeric = numeric
+        self.groups = groups or {}
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """Build the store from rows given as sequences in columns order"""
+        intern = sys.intern
+        columns = tuple(columns)
+        fipscode_index = columns.index('fipscode')
+        measure_index = columns.index('measure_name')
+
+        keys = []
+        for row in rows:
+            fips = fips_key(row[fipscode_index])
+            keys.append((-1 if fips is None else fips, intern(row[measure_index])))
+        # Stable sort, so rows keep table order within a group as in SQLite,
+        # whose index puts a code written two ways ("1001", "01001") in text order
+        order = sorted(range(len(rows)), key=lambda index: (keys[index], rows[index][fipscode_index] or ''))
+
+        groups = {}
+        for position, index in enumerate(order):
+            key = keys[index]
+            start, _ = groups.get(key, (position, None))
+            groups[key] = (start, position + 1)
+
+        data, numeric = {}, set()
+        for column_index, name in enumerate(columns):
+            values = [rows[index][column_index] for index in order]
+            if is_numeric_column(values):
+                data[name] = numeric_column(values)
+                numeric.add(name)
+            else:
+                data[name] = [intern(value) if isinstance(value, str) else value for value in values]
+        return cls(columns, data, frozenset(numeric), groups)
+
+    def row(self, index):
+        """Rebuild one health row as a dict, in table column order"""
+        data = self.data
+        numeric = self.numeric
+        return {
+            name: number_from_column(data[name][index]) if name in numeric else data[name][index]
+            for name in self.columns
+        }
+
+    def rows(self, fips, measure_name):
+        """Return a group's rows as a list of dicts"""
+        bounds = self.groups.get((fips, measure_name))
+        if bounds is None:
+            return []
+        return [self.row(index) for index in range(*bounds)]
+
+    def nbytes(self):
+        """Rough bytes held: column storage plus group keys and bounds"""
+        total = 0
+        for name, values in self.data.items():
+            # A list holds 8-byte pointers to shared (interned) values
+            total += values.itemsize * len(values) if name in self.numeric else 8 * len(values) + 56
+        return total + 200 * len(self.groups)
+
+class MemoryBackend(Backend):
+    """Pure-Python engine: every lookup is a dict probe or a binary search.
+
+    Zips are looked up in a ZipIndex, counties by FIPS code in a dict and
+    health rows in a HealthColumns holding the whole table.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self.zip_index = ZipIndex.from_rows(())
+        self.fips_counties = {}
+        self.health = HealthColumns()
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Build the engine from the tables of a loaded SQLite database"""
+        backend = cls()
+        backend.zip_index = ZipIndex.from_connection(conn)
+        backend.fips_counties = read_fips_counties(conn)
+        cursor = conn.execute("SELECT * FROM county_health_rankings")
+        columns = [description[0] for description in cursor.description]
+        backend.health = HealthColumns.from_rows(columns, cursor.fetchall())
+        return backend
+
+    def county_for_zip(self, zip_code):
+        return self.zip_index.county_for_zip(zip_code)
+
+    def county_for_fips(self, fips):
+        county_info = self.fips_counties.get(fips)
+        return county_info + (f"{fips:05d}",) if county_info else None
+
+    def zips_for_fips(self, fips):
+        return self.zip_index.zips_for_fips(fips)
+
+    def weighted_counties_for_zip(self, zip_code):
+        return self.zip_index.weighted_counties_for_zip(zip_code)
+
+    def health_rows(self, fips, measure_name):
+        return self.health.rows(fips, measure_name)
+
+    def read_measure_index(self, measure_name):
+        health = self.health
+        rows = [tuple(health.row(position).values())
+                for (_, name), bounds in health.groups.items() if name == measure_name
+                for position in range(*bounds)]
+        return MeasureIndex.from_rows(health.columns, rows)
+
+class ShardedMemoryBackend(MemoryBackend):
+    """Memory engine that loads health data one state at a time.
+
+    Only the zip index and FIPS counties are read at startup. The first
+    lookup in a state (by its FIPS code) reads that state's rows from
+    county_health_rankings, a range of its index, into a HealthColumns,
+    kept in an LRU capped at SHARD_CACHE_BYTES.
+    """
+
+    name = 'sharded'
+    owns_connection = True
+
+    def __init__(self, conn, max_bytes=None):
+        super().__init__()
+        self.conn = conn
+        self._uri, self._mmap_size = read_only_uri(conn)
+        self.shards = LRUCache(sys.maxsize, max_bytes=SHARD_CACHE_BYTES if max_bytes is None else max_bytes,
+                               sizeof=HealthColumns.nbytes)
+        self._tables = frozenset(name for name, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Read the zip index; health shards wait until a lookup needs them"""
+        backend = cls(conn)
+        if ZIP_INDEX_TABLE in backend._tables:
+            backend.zip_index = ZipIndex.from_row(conn.execute(f"SELECT * FROM {ZIP_INDEX_TABLE}").fetchone())
+        else:
+            backend.zip_index = ZipIndex.from_connection(conn)
+        backend.fips_counties = read_fips_counties(conn)
+        return backend
+
+    def close(self):
+        self.conn.close()
+
+    def after_fork(self):
+        # Shards loaded before the fork stay shared with the parent
+        if self._uri:
+            self.conn = connect_read_only(self._uri, self._mmap_size, self.dataset_version)
+        self._lock = threading.Lock()
+
+    def read_shard(self, state_fips):
+        """Read one state's health rows from the database"""
+        ranges = state_code_ranges(state_fips)
+        sql = STATE_HEALTH_SQL.format(ranges=' OR '.join(['fipscode BETWEEN ? AND ?'] * len(ranges)))
+        with self._lock:
+            cursor = self.conn.execute(sql, [code for bounds in ranges for code in bounds] + [state_fips])
+            return HealthColumns.from_rows([description[0] for description in cursor.description],
+                                           cursor.fetchall())
+
+    def shard(self, state_fips):
+        """The HealthColumns of a state, by FIPS code, read on first use"""
+        shard = self.shards.get(state_fips)
+        if shard is None:
+            generation = self.shards.generation
+            shard = self.read_shard(state_fips)
+            self.shards.set(state_fips, shard, generation)
+        return shard
+
+    def health_rows(self, fips, measure_name):
+        return self.shard(fips // 1000).rows(fips, measure_name)
+
+    def read_measure_index(self, measure_name):
+        # Every state's rows are needed, so read them apart from the shards
+        with self._lock:
+            return read_measure_index(self.conn, measure_name)
+
+BACKENDS = {
+    SQLiteBackend.name: SQLiteBackend,
+    PooledSQLiteBackend.name: PooledSQLiteBackend,
+    MemoryBackend.name: MemoryBackend,
+    ShardedMemoryBackend.name: ShardedMemoryBackend,
+}
+
+def as_backend(db):
+    """Wrap a bare sqlite3 connection so callers can pass either"""
+    if isinstance(db, sqlite3.Connection):
+        return SQLiteBackend(db)
+    return db
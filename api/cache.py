@@ -0,0 +1,98 @@
+"""
+Bounded LRU cache for serialized API responses
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional per-entry TTL.
+
+    Every clear() bumps the cache generation. Callers read the generation
+    before computing a value and pass it to set(), so a value computed from
+    data that was reloaded in the meantime is never stored.
+
+    With max_bytes, entries are also evicted while the sizes sizeof()
+    reports for them add up to more, though the newest entry is always kept.
+    """
+
+    def __init__(self, max_size, ttl=None, max_bytes=None, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, count_miss=True):
+        """Return the cached value for key, or None.
+
+        A caller that probes before falling back to code which looks the
+        key up again passes count_miss=False, so the miss is counted once.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += count_miss
+                return None
+            value, expires_at = entry[:2]
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += count_miss
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            size = self.sizeof(value) if self.max_bytes is not None else 0
+            self._entries[key] = (value, expires_at, size)
+            self.bytes += size
+            while len(self._entries) > self.max_size or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Drop an entry; the caller holds the lock"""
+        self.bytes -= self._entries.pop(key)[2]
+
+    def clear(self):
+        """Drop every entry and start a new generation"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        """Return the cache counters as a dict"""
+        with self._lock:
+            stats = {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+            if self.max_bytes is not None:
+                stats.update(bytes=self.bytes, max_bytes=self.max_bytes)
+            return stats
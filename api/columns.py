@@ -0,0 +1,39 @@
+"""
+Column storage helpers for the County Health API
+Numeric columns are packed float64 arrays (NumPy when installed,
+array('d') otherwise) with NaN standing in for NULL.
+"""
+
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:  # Optional: numeric columns fall back to array('d')
+    numpy = None
+
+def is_numeric_column(values):
+    """Check whether a column holds only numbers and NULLs (and some numbers)"""
+    found = False
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, str):
+            return False
+        found = True
+    return found
+
+def numeric_column(values):
+    """Pack numbers into a float64 column, with NaN standing in for NULL"""
+    values = [math.nan if value is None else float(value) for value in values]
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64)
+    return array('d', values)
+
+def number_from_column(value):
+    """Turn a float64 column value back into the int, float or None SQLite returns"""
+    value = float(value)
+    if math.isnan(value):
+        return None
+    # NUMERIC columns hand back whole numbers as integers
+    return int(value) if value.is_integer() else value
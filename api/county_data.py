@@ -3,13 +3,100 @@ County Data API Endpoint
 Created with assistance from Codeium AI
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import sqlite3
 import os
+import base64
 import csv
+import io
+import itertools
+import json
+import hashlib
+import sys
+import threading
+import time
+from urllib.request import pathname2url
+
+# Allow running as a script (python api/county_data.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import instrumentation
+from api.backends import BACKENDS, as_backend, counties_fips, county_fips, snapshot_version
+from api.cache import LRUCache
+from api.instrumentation import stage
+from api.measure_index import row_key
+from api.rankings import NATIONAL
+from api.schema import TABLE_INDEXES, UPSERT_KEYS, csv_columns, file_sha256, parse_numbers
+from api.time_series import encode_series
+from api.serialization import Fragment, dumps, encode, render_row, render_value
+from api.zip_index import IS_FIPS_SQL, fips_key
 
 app = Flask(__name__)
 
+# Directory containing zip_county.csv and county_health_rankings.csv
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.environ.get('COUNTY_DATA_DIR', BASE_DIR)
+
+# Prebuilt snapshot written by api/load_data.py. When present it is opened
+# read-only instead of parsing the CSV files at cold start.
+SNAPSHOT_NAME = 'county_data.snapshot.sqlite'
+SNAPSHOT_FORMAT_VERSION = 16
+SNAPSHOT_MMAP_SIZE = 256 * 1024 * 1024
+
+# Source CSV files, which together determine the dataset version
+SOURCE_FILES = ('zip_county.csv', 'county_health_rankings.csv')
+
+# Storage backend serving the lookups: "sqlite", "sqlite_pool", "memory" or "sharded".
+# The pool gives concurrent requests their own snapshot connections.
+DEFAULT_BACKEND = 'sqlite_pool'
+
+# Streamed responses are newline-delimited JSON, one record per line
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Exports from /measures/<measure_name> as CSV, one row per line after a header
+CSV_MIMETYPE = 'text/csv'
+MEASURE_OUTPUTS = ('json', 'ndjson', 'csv')
+
+# Rows per JSON page of /measures/<measure_name> by default and at most.
+# CSV and NDJSON exports stream every matching row unless given a limit.
+MEASURE_PAGE_SIZE = 1000
+MEASURE_MAX_PAGE_SIZE = int(os.environ.get('COUNTY_DATA_MEASURE_MAX_PAGE', 10000))
+
+# Rows rendered and sent at a time by streamed exports
+EXPORT_CHUNK_ROWS = 1000
+
+# Counties listed by /measures/<measure_name>/rankings by default
+RANKING_SIZE = 10
+
+# Largest number of distinct zips accepted by /county_data/batch
+BATCH_MAX_ZIPS = int(os.environ.get('COUNTY_DATA_BATCH_MAX_ZIPS', 5000))
+
+# Serialized responses keyed on (zip, measure_name), plus a second level keyed
+# on (FIPS code, measure_name) shared by every zip in a county. Both are
+# cleared whenever the data is reloaded.
+CACHE_SIZE = int(os.environ.get('COUNTY_DATA_CACHE_SIZE', 10000))
+CACHE_TTL = float(os.environ['COUNTY_DATA_CACHE_TTL']) if os.environ.get('COUNTY_DATA_CACHE_TTL') else None
+response_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+county_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+
+# Cache-Control for /county_data answers. They only change when the dataset
+# does, and the ETag carries the dataset version, so browsers and CDNs may keep
+# them and revalidate with If-None-Match.
+CACHE_CONTROL = os.environ.get('COUNTY_DATA_CACHE_CONTROL',
+                               'public, max-age=3600, s-maxage=86400, stale-while-revalidate=600')
+
+# Process-wide backend, built on first use and shared by every request.
+# sqlite3 is compiled in serialized mode, so even a single connection can
+# safely be used from several request threads at once.
+_db = None
+_db_lock = threading.Lock()
+
+# Serializes incremental refreshes (see refresh_db)
+_refresh_lock = threading.Lock()
+
+# Seconds between checks for changed CSV files when run as a server; unset disables
+REFRESH_INTERVAL = float(os.environ['COUNTY_DATA_REFRESH_INTERVAL']) if os.environ.get('COUNTY_DATA_REFRESH_INTERVAL') else None
+
 VALID_MEASURES = {
     "Violent crime rate",
     "Unemployment", 
@@ -25,8 +112,64 @@ VALID_MEASURES = {
     "Daily fine particulate matter"
 }
 
-def load_csv_data(cursor, csv_path, table_name):
-    """Load data from CSV file into SQLite table"""
+# Optional clustered layouts that store rows in lookup-key order. A table
+# with a primary key becomes a WITHOUT ROWID table, so the table itself is
+# the covering index; otherwise rows are inserted sorted by order_by.
+CLUSTERED_LAYOUTS = {
+    'zip_county': {
+        'primary_key': 'zip, county_code',
+        'indexes': [],
+    },
+    'county_health_rankings': {
+        'order_by': 'fipscode, measure_name',
+        'indexes': TABLE_INDEXES['county_health_rankings'],
+    },
+}
+
+# Prefix marking a /county_data lookup by FIPS code rather than zip; it
+# keeps the two apart in the response cache and ETags
+FIPS_PREFIX = 'fips:'
+
+# fips_counties names every county as its health rows do, keyed by integer
+# FIPS code; where the rows give a code several names the first county name
+# wins. The zip_counties view reads zip_county through it, so a county named
+# differently in the two files, or a county_code that lost its leading
+# zero, still finds its health rows. Rows whose code does not join keep
+# zip_county's names. State and national rows (codes ending in 000) are left out.
+FIPS_TABLES_SQL = [
+    "DROP VIEW IF EXISTS zip_counties",
+    "DROP TABLE IF EXISTS fips_counties",
+    "CREATE TABLE fips_counties (fips INTEGER PRIMARY KEY, county TEXT, state TEXT)",
+    f"""
+    INSERT INTO fips_counties
+    SELECT CAST(fipscode AS INTEGER) AS fips, MIN(county), state
+    FROM county_health_rankings
+    WHERE {IS_FIPS_SQL.format(column='fipscode')}
+    AND CAST(fipscode AS INTEGER) % 1000 != 0
+    GROUP BY fips
+    """,
+    f"""
+    CREATE VIEW zip_counties AS
+    SELECT z.zip AS zip,
+           COALESCE(f.county, z.county) AS county,
+           COALESCE(f.state, z.state_abbreviation) AS state_abbreviation,
+           z.county_code AS county_code,
+           z.zip_pop_in_county AS zip_pop_in_county,
+           CASE WHEN {IS_FIPS_SQL.format(column='z.county_code')}
+                THEN CAST(z.county_code AS INTEGER) END AS fips
+    FROM zip_county AS z
+    LEFT JOIN fips_counties AS f
+    ON f.fips = CASE WHEN {IS_FIPS_SQL.format(column='z.county_code')}
+                     THEN CAST(z.county_code AS INTEGER) END
+    """,
+]
+
+def load_csv_data(cursor, csv_path, table_name, indexed=True, clustered=False, typed=True, into=None):
+    """Load data from CSV file into SQLite table (or into another table with table_name's schema)"""
+    layout = CLUSTERED_LAYOUTS.get(table_name) if clustered and not into else None
+    # A clustered table is filled from a staging copy in key order
+    load_table = into or (f"{table_name}_staging" if layout else table_name)
+    
     with open(csv_path, 'r', encoding='utf-8') as csvfile:
         # Skip BOM if present
         first_char = csvfile.read(1)
@@ -36,130 +179,1117 @@ def load_csv_data(cursor, csv_path, table_name):
         csv_reader = csv.reader(csvfile)
         headers = [header.lower() for header in next(csv_reader)]
         
-        # Create table dynamically based on headers
-        columns = [f"{header} TEXT" for header in headers]
-        create_table_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
+        # Create table dynamically based on headers and the declared schema
+        columns, numeric_columns, keep_text = csv_columns(table_name, headers, typed)
+        create_table_sql = f"CREATE TABLE IF NOT EXISTS {load_table} ({', '.join(columns)})"
         cursor.execute(create_table_sql)
         
         # Insert data in batches
         batch_size = 1000
         rows = []
-        placeholders = ','.join(['?' for _ in headers])
-        insert_sql = f"INSERT INTO {table_name} VALUES ({placeholders})"
+        placeholders = ','.join(['?' for _ in columns])
+        insert_sql = f"INSERT INTO {load_table} VALUES ({placeholders})"
         
         for row in csv_reader:
-            rows.append(row)
+            rows.append(parse_numbers(row, numeric_columns, keep_text))
             if len(rows) >= batch_size:
                 cursor.executemany(insert_sql, rows)
                 rows = []
         
         if rows:
             cursor.executemany(insert_sql, rows)
+    
+    indexes = TABLE_INDEXES.get(table_name, [])
+    if layout:
+        if 'primary_key' in layout:
+            cursor.execute(f"CREATE TABLE {table_name} ({', '.join(columns)}, "
+                           f"PRIMARY KEY ({layout['primary_key']})) WITHOUT ROWID")
+            order_by = layout['primary_key']
+        else:
+            cursor.execute(f"CREATE TABLE {table_name} ({', '.join(columns)})")
+            order_by = layout['order_by']
+        cursor.execute(f"INSERT INTO {table_name} SELECT * FROM {load_table} ORDER BY {order_by}")
+        cursor.execute(f"DROP TABLE {load_table}")
+        indexes = layout['indexes']
+    
+    # Indexes are built after the bulk insert, which is much faster than
+    # maintaining them row by row
+    if indexed and not into:
+        for index_name, index_columns in indexes:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({index_columns})")
+
+def build_fips_tables(cursor):
+    """(Re)build fips_counties and the zip_counties view from the loaded tables"""
+    for sql in FIPS_TABLES_SQL:
+        cursor.execute(sql)
+
+def dataset_version_for(sources):
+    """Return the dataset version for {source file: sha256}"""
+    # The dataset version changes whenever a source file or the format does
+    version_input = json.dumps({'format_version': SNAPSHOT_FORMAT_VERSION, 'sources': sources},
+                               sort_keys=True)
+    return hashlib.sha256(version_input.encode('utf-8')).hexdigest()[:16]
 
-def init_db():
-    """Initialize in-memory database with data from CSV files"""
-    conn = sqlite3.connect(':memory:')
+def compute_dataset_version(data_dir=None):
+    """Return (dataset_version, {source file: sha256}) for the CSV files"""
+    base_dir = data_dir or DATA_DIR
+    sources = {name: file_sha256(os.path.join(base_dir, name)) for name in SOURCE_FILES}
+    return dataset_version_for(sources), sources
+
+def read_dataset_version(conn, data_dir=None):
+    """Return the dataset version of a loaded database"""
+    version = snapshot_version(conn)
+    if version:
+        return version
+    # Loaded from the CSV files: hash them the same way the snapshot build does
+    return compute_dataset_version(data_dir)[0]
+
+def get_snapshot_path(data_dir=None):
+    """Return the snapshot location, honouring COUNTY_DATA_SNAPSHOT"""
+    return os.environ.get('COUNTY_DATA_SNAPSHOT') or os.path.join(data_dir or DATA_DIR, SNAPSHOT_NAME)
+
+def read_snapshot_manifest(snapshot_path):
+    """Read the JSON manifest stored next to a snapshot"""
+    try:
+        with open(snapshot_path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"Snapshot manifest not found for {snapshot_path}")
+
+def open_snapshot(snapshot_path, verify=None):
+    """Open a prebuilt snapshot read-only, checking it against its manifest"""
+    if verify is None:
+        verify = os.environ.get('COUNTY_DATA_VERIFY_SNAPSHOT') == '1'
+    
+    manifest = read_snapshot_manifest(snapshot_path)
+    if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version: {manifest.get('format_version')}")
+    if os.path.getsize(snapshot_path) != manifest.get('size'):
+        raise ValueError("Snapshot size does not match its manifest")
+    # Hashing the whole file costs cold-start time, so it is opt-in
+    if verify and file_sha256(snapshot_path) != manifest.get('sha256'):
+        raise ValueError("Snapshot checksum does not match its manifest")
+    
+    # immutable=1 skips file locking and change detection entirely
+    uri = f"file:{pathname2url(os.path.abspath(snapshot_path))}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {SNAPSHOT_MMAP_SIZE}")
+    return conn
+
+def load_csv_db(data_dir=None, indexed=True, clustered=False, typed=True):
+    """Build an in-memory database from the CSV files"""
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
     cursor = conn.cursor()
     
     # Get the directory containing the CSV files
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    base_dir = data_dir or DATA_DIR
     
     # Load zip_county data
     zip_csv = os.path.join(base_dir, 'zip_county.csv')
-    load_csv_data(cursor, zip_csv, 'zip_county')
+    load_csv_data(cursor, zip_csv, 'zip_county', indexed, clustered, typed)
     
     # Load health rankings data
     health_csv = os.path.join(base_dir, 'county_health_rankings.csv')
-    load_csv_data(cursor, health_csv, 'county_health_rankings')
+    load_csv_data(cursor, health_csv, 'county_health_rankings', indexed, clustered, typed)
+    build_fips_tables(cursor)
     
     conn.commit()
     return conn
 
-def get_county_from_zip(zip_code, conn):
+def init_db(data_dir=None):
+    """Open the snapshot if one was built, otherwise load the CSV files"""
+    snapshot_path = get_snapshot_path(data_dir)
+    if os.path.exists(snapshot_path):
+        try:
+            return open_snapshot(snapshot_path)
+        except (ValueError, sqlite3.Error) as e:
+            app.logger.warning("Ignoring snapshot %s: %s", snapshot_path, e)
+    return load_csv_db(data_dir)
+
+def load_backend(data_dir=None, backend_name=None):
+    """Load the data into the storage backend named by COUNTY_DATA_BACKEND"""
+    backend_name = backend_name or os.environ.get('COUNTY_DATA_BACKEND', DEFAULT_BACKEND)
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend_name}")
+    
+    conn = init_db(data_dir)
+    backend = BACKENDS[backend_name].from_connection(conn)
+    backend.dataset_version = read_dataset_version(conn, data_dir)
+    # The memory engine copies everything out of SQLite while loading
+    if not backend.owns_connection:
+        conn.close()
+    return backend
+
+def get_db():
+    """Return the shared backend, building it on first use"""
+    global _db
+    db = _db
+    if db is None:
+        with _db_lock:
+            # Another thread may have built it while we waited
+            if _db is None:
+                _db = load_backend()
+            db = _db
+    return db
+
+def reload_db(data_dir=None):
+    """Rebuild the shared backend and swap it in"""
+    global _db
+    # Build outside the lock so requests keep using the old backend meanwhile.
+    # The old one is not closed here: in-flight requests may still hold it,
+    # and it is released once the last reference goes away.
+    db = load_backend(data_dir)
+    with _db_lock:
+        _db = db
+    invalidate_caches()
+    return db
+
+def refresh_db(data_dir=None):
+    """Pick up changed CSV files without a full rebuild; return True if the data changed.
+
+    With a snapshot, only the changed files are diffed into a copy of it
+    (see api/load_data.update_snapshot), which then replaces the old one.
+    Without a snapshot the CSV files are reloaded if their hashes changed.
+    Either way the new backend is swapped in while in-flight requests
+    finish on the old one.
+    """
+    # Imported here: load_data imports this module
+    from api.load_data import update_snapshot
+    
+    data_dir = data_dir or DATA_DIR
+    with _refresh_lock:
+        snapshot_path = get_snapshot_path(data_dir)
+        if os.path.exists(snapshot_path):
+            changed = update_snapshot(data_dir, snapshot_path)[1]
+        else:
+            changed = compute_dataset_version(data_dir)[0] != get_db().dataset_version
+        if changed:
+            reload_db(data_dir)
+        return bool(changed)
+
+def start_refresh_watcher(interval, data_dir=None):
+    """Call refresh_db every interval seconds from a daemon thread"""
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                if refresh_db(data_dir):
+                    app.logger.info("Reloaded changed data")
+            except Exception as e:
+                app.logger.error("Data refresh failed: %s", e)
+    
+    thread = threading.Thread(target=watch, name='county-data-refresh', daemon=True)
+    thread.start()
+    return thread
+
+def invalidate_caches():
+    """Drop every cached response"""
+    response_cache.clear()
+    county_cache.clear()
+
+def get_county_from_zip(zip_code, db):
     """Get county information from zip code"""
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT county, state_abbreviation, county_code FROM zip_county WHERE zip = ?", 
-        (zip_code,)
-    )
-    return cursor.fetchone()
-
-def get_health_data(county, state, measure_name, conn):
-    """Get health data for a specific county and measure"""
-    cursor = conn.cursor()
+    return as_backend(db).county_for_zip(zip_code)
+
+def fips_place(fipscode):
+    """The place a /county_data lookup by FIPS code answers for"""
+    return FIPS_PREFIX + fipscode
+
+def get_county(place, db):
+    """Get county information for a zip code or a fips_place"""
+    if place.startswith(FIPS_PREFIX):
+        return as_backend(db).county_for_fips(fips_key(place[len(FIPS_PREFIX):]))
+    return get_county_from_zip(place, db)
+
+def place_name(place):
+    """Describe a zip code or fips_place in an error message"""
+    if place.startswith(FIPS_PREFIX):
+        return f"FIPS code {place[len(FIPS_PREFIX):]}"
+    return f"zip code {place}"
+
+def get_health_data(fips, measure_name, db):
+    """Get health data for a county, by integer FIPS code, and measure; none without a code"""
+    if fips is None:
+        return []
+    return as_backend(db).health_rows(fips, measure_name)
+
+def is_valid_zip(zip_code):
+    """Check that a zip code is a 5-digit string"""
+    return isinstance(zip_code, str) and len(zip_code) == 5 and zip_code.isdigit()
+
+def is_valid_fips(fipscode):
+    """Check that a county FIPS code is a 5-digit string"""
+    return is_valid_zip(fipscode)
+
+def request_flag(data, name):
+    """Read a boolean option from a JSON body or query string"""
+    return isinstance(data, dict) and data.get(name) in (True, 'true', '1')
+
+def wants_stream(data, accept_mimetypes=None):
+    """Check whether the client asked for a streamed NDJSON response"""
+    if request_flag(data, 'stream'):
+        return True
+    if accept_mimetypes is None:
+        accept_mimetypes = request.accept_mimetypes
+    return accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def ndjson_response(records):
+    """Stream records as NDJSON, encoding each one only when it is sent"""
+    return Response((json_body(record) for record in records),
+                    mimetype=NDJSON_MIMETYPE)
+
+def query_data(pairs):
+    """A query string's (name, value) pairs as a dict, keeping each name's first value as Flask's to_dict does"""
+    data = {}
+    for name, value in pairs:
+        data.setdefault(name, value)
+    return data
+
+def parse_json_body(body):
+    """Decode a JSON request body; returns (data, None), or (None, (error, 400)) if it is not JSON"""
+    try:
+        return json.loads(body), None
+    except ValueError:
+        return None, ({"error": "Request body must be valid JSON"}, 400)
+
+def parse_county_data_request(data):
+    """Validate a /county_data query string or JSON body.
+
+    Returns ((place, measure_name, typed, mode), None) for a valid
+    request, else (None, (error, status)) where error is a dict to send
+    as JSON, or plain text for the teapot. place is the zip code, or the
+    fips_place of a lookup by county FIPS code.
+    """
+    if not isinstance(data, dict):
+        return None, ({"error": "Request body must be a JSON object"}, 400)
+
+    # Check for teapot easter egg
+    if data.get('coffee') == 'teapot':
+        return None, ("I'm a teapot", 418)
+
+    # Validate required fields
+    zip_code = data.get('zip')
+    fipscode = data.get('fips')
+    measure_name = data.get('measure_name')
+
+    # fips=... looks a county up by FIPS code instead of by zip
+    if zip_code and fipscode:
+        return None, ({"error": "Give either zip or fips, not both"}, 400)
+    if fipscode and measure_name:
+        if not is_valid_fips(fipscode):
+            return None, ({"error": "Invalid fips code format"}, 400)
+        place = fips_place(fipscode)
+    elif not zip_code or not measure_name:
+        return None, ({"error": "Both zip and measure_name are required"}, 400)
+    # Validate zip code format
+    elif not is_valid_zip(zip_code):
+        return None, ({"error": "Invalid zip code format"}, 400)
+    else:
+        place = zip_code
+
+    # Validate measure name
+    if measure_name not in VALID_MEASURES:
+        return None, ({"error": "Invalid measure_name"}, 400)
+
+    # typed=true returns numbers as JSON numbers and missing values as null
+    typed = request_flag(data, 'typed')
+    # all_counties=true answers for every county of the zip, with weights;
+    # aggregate_only=true leaves out the rows
+    mode = None
+    if request_flag(data, 'aggregate_only'):
+        mode = 'aggregate_only'
+    elif request_flag(data, 'all_counties'):
+        mode = 'all_counties'
+    if mode and fipscode:
+        return None, ({"error": f"fips cannot be combined with {mode}"}, 400)
+    # include_rank=true adds each row's national and state rank;
+    # series=true returns the rows as one time series record
+    for option in ('include_rank', 'series'):
+        if request_flag(data, option):
+            if mode:
+                return None, ({"error": f"{option} cannot be combined with {mode}"}, 400)
+            mode = option
+
+    return (place, measure_name, typed, mode), None
+
+@app.before_request
+def start_timing():
+    instrumentation.start_request()
+
+@app.after_request
+def finish_timing(response):
+    """Attach the stage timings when COUNTY_DATA_TIMING is on"""
+    timing = instrumentation.finish_request(request.endpoint or 'not_found')
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+@app.route('/county_data', methods=['GET', 'POST'])
+def county_data():
+    try:
+        if request.method == 'GET':
+            # Cacheable form: /county_data?zip=...&measure_name=...
+            data = query_data(request.args.items(multi=True))
+        else:
+            # Check content type
+            if not request.is_json:
+                return jsonify({"error": "Content-Type must be application/json"}), 400
+            
+            data, error = parse_json_body(request.get_data())
+            if error:
+                return jsonify(error[0]), error[1]
+
+        lookup, error = parse_county_data_request(data)
+        if error:
+            message, status = error
+            return (message, status) if isinstance(message, str) else (jsonify(message), status)
+        place, measure_name, typed, mode = lookup
+
+        if wants_stream(data) and not mode:
+            return stream_county_data(place, measure_name, typed)
+
+        # Answer revalidations from the ETag alone, without a lookup
+        with stage('init_db'):
+            db = get_db()
+        etag = county_data_etag(db.dataset_version, place, measure_name, typed, mode)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            body, status = county_data_result(place, measure_name, typed, mode)
+            response = Response(body, status, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.vary.add('Accept')
+        return response
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def county_data_etag(dataset_version, place, measure_name, typed=False, mode=None):
+    """ETag for a lookup: the dataset version plus a digest of the request key"""
+    key = f"{place}|{measure_name}|{'typed' if typed else 'text'}"
+    if mode:
+        key += f"|{mode}"
+
+    key_digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return f"{dataset_version}-{key_digest}"
+
+def json_body(obj):
+    """Serialize obj (sorted keys, compact, fragments spliced in) to response bytes"""
+    return encode(obj) + b'\n'
+
+def response_cache_key(place, measure_name, typed=False, mode=None):
+    """Key of a /county_data answer in response_cache"""
+    if mode:
+        return (place, measure_name, typed, mode)
+    return (place, measure_name, typed)
+
+def county_data_result(place, measure_name, typed=False, mode=None):
+    """Return the serialized (body, status) for a validated /county_data request"""
+    if mode == 'include_rank':
+        return ranked_county_data_body(place, measure_name, typed)
+    if mode == 'series':
+        return series_county_data_body(place, measure_name, typed)
+    if mode:
+        return weighted_county_data_body(place, measure_name, typed,
+                                         include_rows=mode == 'all_counties')
+    return county_data_body(place, measure_name, typed)
+
+def county_data_body(place, measure_name, typed=False):
+    """Return the serialized (body, status) for one lookup, using the caches"""
+    key = response_cache_key(place, measure_name, typed)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    # Read the generations before get_db() so nothing computed from a
+    # backend that is being swapped out can land in the fresh caches
+    generation = response_cache.generation
+    county_generation = county_cache.generation
     
-    # Get all matching records
-    cursor.execute("""
-        SELECT *
-        FROM county_health_rankings
-        WHERE county = ? 
-        AND state = ?
-        AND measure_name = ?
-    """, (county, state, measure_name))
+    # Shared backend, built once per process
+    with stage('init_db'):
+        db = get_db()
     
-    # Get column names
-    columns = [description[0] for description in cursor.description]
+    # Get county info from the zip or FIPS code
+    with stage('get_county_from_zip'):
+        county_info = get_county(place, db)
+    if not county_info:
+        result = (json_body({"error": f"No county found for {place_name(place)}"}), 404)
+        response_cache.set(key, result, generation)
+        return result
     
-    # Fetch all rows and convert to list of dicts
-    rows = cursor.fetchall()
-    result = []
-    for row in rows:
-        result.append(dict(zip(columns, row)))
+    county, state, _ = county_info
+    fips = county_fips(county_info)
     
+    # Many zips share a county, so the health lookup is cached on its own.
+    # Rows are found by FIPS code; the names are only for the 404 message.
+    county_key = (fips, county, state, measure_name, typed)
+    result = county_cache.get(county_key)
+    if result is None:
+        # Snapshots carry the untyped rows of the most populous counties pre-encoded
+        with stage('get_health_data'):
+            fragment = db.prebuilt_rows(fips, measure_name, typed) if fips is not None else None
+            results = get_health_data(fips, measure_name, db) if fragment is None else None
+        if fragment is not None:
+            result = (json_body(fragment), 200)
+        elif results:
+            with stage('serialization'):
+                result = (json_body([render_row(row, typed) for row in results]), 200)
+        else:
+            result = (json_body({"error": f"No data found for {county}, {state} with measure {measure_name}"}), 404)
+        county_cache.set(county_key, result, county_generation)
+    
+    response_cache.set(key, result, generation)
     return result
 
-@app.route('/county_data', methods=['POST'])
-def county_data():
+def ranked_county_data_body(place, measure_name, typed=False):
+    """Return the serialized (body, status) for one lookup, each row with its rank.
+
+    Ranks are looked up in the measure's MeasureRanking; rows that are not
+    ranked get a null rank.
+    """
+    key = response_cache_key(place, measure_name, typed, 'include_rank')
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation
+    with stage('init_db'):
+        db = get_db()
+
+    with stage('get_county_from_zip'):
+        county_info = get_county(place, db)
+    if not county_info:
+        result = (json_body({"error": f"No county found for {place_name(place)}"}), 404)
+        response_cache.set(key, result, generation)
+        return result
+
+    county, state, _ = county_info
+    with stage('get_health_data'):
+        rows = get_health_data(county_fips(county_info), measure_name, db)
+        ranking = db.measure_ranking(measure_name) if rows else None
+    if not rows:
+        result = (json_body({"error": f"No data found for {county}, {state} with measure {measure_name}"}), 404)
+    else:
+        with stage('serialization'):
+            ranked = []
+            for row in rows:
+                position = ranking.index.find(row_key(row['fipscode'], row['year_span'], row['data_release_year']))
+                ranked_row = render_row(row, typed)
+                ranked_row['rank'] = render_standing(ranking.standing(position) if position is not None else None,
+                                                     typed)
+                ranked.append(ranked_row)
+            result = (json_body(ranked), 200)
+    response_cache.set(key, result, generation)
+    return result
+
+def series_county_data_body(place, measure_name, typed=False):
+    """Return the serialized (body, status) of a lookup's time series record, using the caches"""
+    key = response_cache_key(place, measure_name, typed, 'series')
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation
+    county_generation = county_cache.generation
+    with stage('init_db'):
+        db = get_db()
+
+    with stage('get_county_from_zip'):
+        county_info = get_county(place, db)
+    if not county_info:
+        result = (json_body({"error": f"No county found for {place_name(place)}"}), 404)
+        response_cache.set(key, result, generation)
+        return result
+
+    county, state, _ = county_info
+    fips = county_fips(county_info)
+    county_key = (fips, county, state, measure_name, typed, 'series')
+    result = county_cache.get(county_key)
+    if result is None:
+        # Snapshots carry the untyped series of the most populous counties pre-encoded
+        with stage('get_health_data'):
+            fragment = db.prebuilt_series(fips, measure_name, typed) if fips is not None else None
+            rows = get_health_data(fips, measure_name, db) if fragment is None else None
+        if fragment is None and rows:
+            with stage('serialization'):
+                fragment = encode_series(county, state, measure_name, rows, typed)
+        if fragment is not None:
+            result = (json_body(fragment), 200)
+        else:
+            result = (json_body({"error": f"No data found for {county}, {state} with measure {measure_name}"}), 404)
+        county_cache.set(county_key, result, county_generation)
+
+    response_cache.set(key, result, generation)
+    return result
+
+def render_standing(standing, typed):
+    """Render a MeasureRanking standing, numbers as strings unless typed"""
+    if standing is None or typed:
+        return standing
+    return {scope: render_row(values, False) for scope, values in standing.items()}
+
+def weighted_county_data_body(zip_code, measure_name, typed=False, include_rows=True):
+    """Return the serialized (body, status) for every county of a zip, with weights.
+
+    Each county carries its share of the zip population and, with
+    include_rows, its rows. The aggregate is the population-weighted
+    raw_value per year_span, computed from the rows.
+    """
+    key = response_cache_key(zip_code, measure_name, typed,
+                             'all_counties' if include_rows else 'aggregate_only')
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = response_cache.generation
+    with stage('init_db'):
+        db = get_db()
+    
+    with stage('get_county_from_zip'):
+        weighted_counties = db.weighted_counties_for_zip(zip_code)
+    if not weighted_counties:
+        result = (json_body({"error": f"No county found for zip code {zip_code}"}), 404)
+        response_cache.set(key, result, generation)
+        return result
+    
+    with stage('get_health_data'):
+        if include_rows:
+            rows = db.health_rows_for_counties(counties_fips(weighted_counties), [measure_name])
+            aggregate = db.zip_aggregates(zip_code, measure_name, weighted_counties,
+                                          itertools.chain.from_iterable(rows.values()))
+        else:
+            aggregate = db.zip_aggregates(zip_code, measure_name, weighted_counties)
+    
+    if not aggregate and (not include_rows or not any(rows.values())):
+        result = (json_body({"error": f"No data found for zip code {zip_code} with measure {measure_name}"}), 404)
+    else:
+        result = (weighted_body(zip_code, measure_name, weighted_counties, aggregate,
+                                rows if include_rows else None, typed), 200)
+    response_cache.set(key, result, generation)
+    return result
+
+def weighted_body(zip_code, measure_name, weighted_counties, aggregate, rows, typed):
+    """Serialize an all_counties answer, or an aggregate_only one when rows is None"""
+    with stage('serialization'):
+        counties = []
+        for county, state, county_code, weight in weighted_counties:
+            county_result = {
+                'county': county,
+                'state': state,
+                'county_code': county_code,
+                'weight': weight if typed else render_value(weight),
+            }
+            if rows is not None:
+                county_result['rows'] = [render_row(row, typed)
+                                         for row in rows.get((fips_key(county_code), measure_name), [])]
+            counties.append(county_result)
+        return json_body({
+            'zip': zip_code,
+            'measure_name': measure_name,
+            'counties': counties,
+            'aggregate': [render_row(item, typed) for item in aggregate],
+        })
+
+def stream_county_data(place, measure_name, typed=False):
+    """Stream the rows for one lookup as NDJSON"""
+    records, error = county_data_records(place, measure_name, typed)
+    if error:
+        message, status = error
+        return jsonify(message), status
+    return ndjson_response(records)
+
+def county_data_records(place, measure_name, typed=False):
+    """Return (rendered rows iterator, None) for one lookup, else (None, (error, status))"""
+    db = get_db()
+    
+    county_info = get_county(place, db)
+    if not county_info:
+        return None, ({"error": f"No county found for {place_name(place)}"}, 404)
+    
+    county, state, _ = county_info
+    rows = db.iter_health_rows_for_counties(counties_fips([county_info]), [measure_name])
+    first = next(rows, None)
+    if first is None:
+        return None, ({"error": f"No data found for {county}, {state} with measure {measure_name}"}, 404)
+    rows = itertools.chain([first], rows)
+    return (render_row(row, typed) for row in rows), None
+
+def stream_batch_results(db, zip_keys, measure_names, county_infos, typed=False):
+    """Yield batch results as {"zip", "row"} and {"zip", ..., "error"} records.
+
+    Rows are read from the backend as they are sent. Only the set of
+    (FIPS code, measure) keys seen is kept, to report missing data at the
+    end, so memory stays flat however many rows the batch covers.
+    """
+    # Zips by their county's integer FIPS code; None for a county without one
+    zips_by_county = {}
+    for zip_code, valid in zip_keys.items():
+        if not valid:
+            yield {"zip": zip_code, "error": "Invalid zip code format"}
+        elif zip_code not in county_infos:
+            yield {"zip": zip_code, "error": f"No county found for zip code {zip_code}"}
+        else:
+            zips_by_county.setdefault(county_fips(county_infos[zip_code]), []).append(zip_code)
+    
+    valid_measures = [name for name in measure_names if name in VALID_MEASURES]
+    for measure_name in measure_names:
+        if measure_name not in VALID_MEASURES:
+            for zip_codes in zips_by_county.values():
+                for zip_code in zip_codes:
+                    yield {"zip": zip_code, "measure_name": measure_name, "error": "Invalid measure_name"}
+    
+    found = set()
+    counties = [fips for fips in zips_by_county if fips is not None]
+    for row in db.iter_health_rows_for_counties(counties, valid_measures):
+        fips = fips_key(row['fipscode'])
+        found.add((fips, row['measure_name']))
+        row = render_row(row, typed)
+        for zip_code in zips_by_county[fips]:
+            yield {"zip": zip_code, "row": row}
+    
+    for fips, zip_codes in zips_by_county.items():
+        for measure_name in valid_measures:
+            if (fips, measure_name) not in found:
+                for zip_code in zip_codes:
+                    county, state, _ = county_infos[zip_code]
+                    yield {"zip": zip_code, "measure_name": measure_name,
+                           "error": f"No data found for {county}, {state} with measure {measure_name}"}
+
+def parse_batch_request(data):
+    """Validate a /county_data/batch body.
+
+    Returns ((zip_keys, measure_names, typed), None), where zip_keys maps
+    each distinct zip to whether it is well formed, else
+    (None, (error, status)).
+    """
+    zip_codes = data.get('zips') if isinstance(data, dict) else None
+    measure_names = data.get('measure_names') if isinstance(data, dict) else None
+
+    if not isinstance(zip_codes, list) or not isinstance(measure_names, list) \
+            or not zip_codes or not measure_names:
+        return None, ({"error": "zips and measure_names must be non-empty lists"}, 400)
+
+    # Duplicate zips share one result. Non-string items are reported
+    # under their JSON text so every input still gets a key.
+    zip_keys = {}
+    for zip_code in zip_codes:
+        key = zip_code if isinstance(zip_code, str) else json.dumps(zip_code)
+        zip_keys.setdefault(key, is_valid_zip(zip_code))
+    if len(zip_keys) > BATCH_MAX_ZIPS:
+        return None, ({"error": f"Batch is limited to {BATCH_MAX_ZIPS} zips"}, 413)
+
+    measure_names = list(dict.fromkeys(
+        name if isinstance(name, str) else json.dumps(name) for name in measure_names))
+    return (zip_keys, measure_names, request_flag(data, 'typed')), None
+
+def batch_results(db, zip_keys, measure_names, county_infos, typed=False):
+    """Return {zip: {measure_name: rows or {"error": ...}} or {"error": ...}}.
+
+    Rows come as Fragments, encoded once per county and measure however
+    many zips share them, for json_body to splice in.
+    """
+    valid_measures = [name for name in measure_names if name in VALID_MEASURES]
+
+    # Zips in the same county are looked up once
+    counties = set(counties_fips(county_infos.values()))
+    with stage('get_health_data'):
+        health = db.health_fragments_for_counties(counties, valid_measures, typed)
+
+    results = {}
+    for zip_code, valid in zip_keys.items():
+        if not valid:
+            results[zip_code] = {"error": "Invalid zip code format"}
+            continue
+        if zip_code not in county_infos:
+            results[zip_code] = {"error": f"No county found for zip code {zip_code}"}
+            continue
+
+        county_info = county_infos[zip_code]
+        county, state, _ = county_info
+        fips = county_fips(county_info)
+        by_measure = {}
+        for measure_name in measure_names:
+            if measure_name not in VALID_MEASURES:
+                by_measure[measure_name] = {"error": "Invalid measure_name"}
+            elif health.get((fips, measure_name)) is not None:
+                by_measure[measure_name] = health[(fips, measure_name)]
+            else:
+                by_measure[measure_name] = {
+                    "error": f"No data found for {county}, {state} with measure {measure_name}"
+                }
+        results[zip_code] = by_measure
+    return results
+
+@app.route('/county_data/batch', methods=['POST'])
+def county_data_batch():
+    """Resolve many zips x many measures in one request.
+
+    Results are keyed by zip and then measure name; a zip or measure that
+    cannot be answered gets an inline {"error": ...} instead of failing the
+    whole batch. Streaming clients get NDJSON from stream_batch_results.
+    """
     try:
-        # Check content type
         if not request.is_json:
             return jsonify({"error": "Content-Type must be application/json"}), 400
         
-        data = request.get_json()
-        
-        # Check for teapot easter egg
-        if data.get('coffee') == 'teapot':
-            return "I'm a teapot", 418
-        
-        # Validate required fields
-        zip_code = data.get('zip')
-        measure_name = data.get('measure_name')
-        
-        if not zip_code or not measure_name:
-            return jsonify({"error": "Both zip and measure_name are required"}), 400
-            
-        # Validate zip code format
-        if not (isinstance(zip_code, str) and len(zip_code) == 5 and zip_code.isdigit()):
-            return jsonify({"error": "Invalid zip code format"}), 400
-            
-        # Validate measure name
-        if measure_name not in VALID_MEASURES:
-            return jsonify({"error": "Invalid measure_name"}), 400
-            
-        # Initialize database
-        conn = init_db()
+        data, error = parse_json_body(request.get_data())
+        if error:
+            return jsonify(error[0]), error[1]
+        batch, error = parse_batch_request(data)
+        if error:
+            message, status = error
+            return jsonify(message), status
+        zip_keys, measure_names, typed = batch
+
+        with stage('init_db'):
+            db = get_db()
+        with stage('get_county_from_zip'):
+            county_infos = db.counties_for_zips([key for key, valid in zip_keys.items() if valid])
+
+        if wants_stream(data):
+            return ndjson_response(stream_batch_results(db, zip_keys, measure_names, county_infos, typed))
+
+        results = batch_results(db, zip_keys, measure_names, county_infos, typed)
+        with stage('serialization'):
+            return Response(json_body({"results": results}), mimetype='application/json')
         
-        # Get county info from zip
-        county_info = get_county_from_zip(zip_code, conn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def encode_cursor(key):
+    """Opaque keyset cursor for the row key a page ended on"""
+    return base64.urlsafe_b64encode(encode(list(key))).rstrip(b'=').decode('ascii')
+
+def decode_cursor(cursor):
+    """The row key a cursor from encode_cursor carries, or None if it is not one"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    if isinstance(key, list) and len(key) == 3 and isinstance(key[0], str) \
+            and isinstance(key[1], str) and type(key[2]) is int:
+        return tuple(key)
+    return None
+
+def measure_output(data, accept_mimetypes=None):
+    """The export format asked for with format=, stream=true or Accept; None if unknown"""
+    output = data.get('format')
+    if output is None:
+        if request_flag(data, 'stream'):
+            return 'ndjson'
+        if accept_mimetypes is None:
+            accept_mimetypes = request.accept_mimetypes
+        best = accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE, CSV_MIMETYPE])
+        output = {NDJSON_MIMETYPE: 'ndjson', CSV_MIMETYPE: 'csv'}.get(best, 'json')
+    return output if output in MEASURE_OUTPUTS else None
+
+def is_digits(value):
+    """Check that a query parameter is a non-empty string of ASCII digits"""
+    return isinstance(value, str) and value.isascii() and value.isdigit()
+
+def parse_measure_request(measure_name, data, accept_mimetypes=None):
+    """Validate a /measures/<measure_name> query string.
+
+    Returns ((filters, after, limit, typed, output), None), where filters
+    are the MeasureIndex.page keyword arguments, after is the cursor's
+    row key and output is one of MEASURE_OUTPUTS, else (None, (error, status)).
+    """
+    if measure_name not in VALID_MEASURES:
+        return None, ({"error": "Invalid measure_name"}, 404)
+
+    fipscode = data.get('fipscode') or None
+    if fipscode is not None and not is_digits(fipscode):
+        return None, ({"error": "fipscode must be a prefix of digits"}, 400)
+
+    year = data.get('year')
+    if year is not None:
+        if not is_digits(year) or len(year) > 4:
+            return None, ({"error": "year must be a 4-digit data release year"}, 400)
+        year = int(year)
+
+    output = measure_output(data, accept_mimetypes)
+    if output is None:
+        return None, ({"error": "format must be json, ndjson or csv"}, 400)
+
+    limit = data.get('limit')
+    if limit is not None:
+        if not is_digits(limit) or int(limit) < 1:
+            return None, ({"error": "limit must be a positive integer"}, 400)
+        limit = int(limit)
+    elif output == 'json':
+        limit = MEASURE_PAGE_SIZE
+    if output == 'json' and limit > MEASURE_MAX_PAGE_SIZE:
+        return None, ({"error": f"JSON pages hold at most {MEASURE_MAX_PAGE_SIZE} rows; "
+                                "export more as CSV or NDJSON"}, 400)
+
+    after = None
+    if data.get('cursor'):
+        after = decode_cursor(data['cursor'])
+        if after is None:
+            return None, ({"error": "Invalid cursor"}, 400)
+
+    filters = {'fipscode_prefix': fipscode, 'state': data.get('state') or None, 'year': year}
+    return (filters, after, limit, request_flag(data, 'typed'), output), None
+
+def export_chunks(index, positions, output, typed=False):
+    """Yield rows of a MeasureIndex as NDJSON or CSV (header first), EXPORT_CHUNK_ROWS at a time"""
+    if output == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(index.columns)
+    for start in range(0, len(positions), EXPORT_CHUNK_ROWS):
+        chunk = positions[start:start + EXPORT_CHUNK_ROWS]
+        if output == 'csv':
+            writer.writerows(index.value_rows(chunk, text=True))
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield b''.join(dumps(row) + b'\n' for row in index.rows(chunk, text=not typed))
+    if output == 'csv' and not positions:
+        yield buffer.getvalue().encode('utf-8')
+
+@app.route('/measures/<measure_name>', methods=['GET'])
+def measure_export(measure_name):
+    """Every county's rows for one measure, filtered and a page at a time.
+
+    Rows come from the measure's MeasureIndex in (fipscode, year_span,
+    data_release_year) order. JSON pages carry next_cursor, which every
+    format also sends as X-Next-Cursor; CSV and NDJSON are streamed.
+    """
+    try:
+        data = request.args.to_dict()
+        query, error = parse_measure_request(measure_name, data)
+        if error:
+            message, status = error
+            return jsonify(message), status
+        filters, after, limit, typed, output = query
+
+        with stage('init_db'):
+            db = get_db()
+        with stage('get_health_data'):
+            index = db.measure_index(measure_name)
+            positions, next_key = index.page(after=after, limit=limit, **filters)
+        next_cursor = encode_cursor(next_key) if next_key else None
+
+        if output == 'json':
+            with stage('serialization'):
+                rows = index.rows(positions, text=not typed)
+                response = Response(json_body({
+                    'measure_name': measure_name,
+                    'rows': Fragment(dumps(rows)),
+                    'next_cursor': next_cursor,
+                }), mimetype='application/json')
+        else:
+            response = Response(export_chunks(index, positions, output, typed),
+                                mimetype=NDJSON_MIMETYPE if output == 'ndjson' else CSV_MIMETYPE)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        response.vary.add('Accept')
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def parse_ranking_request(measure_name, data):
+    """Validate a /measures/<measure_name>/rankings or /summary query string.
+
+    Returns ((year, state, limit, bottom, typed), None), where year is None
+    when not given, else (None, (error, status)).
+    """
+    if measure_name not in VALID_MEASURES:
+        return None, ({"error": "Invalid measure_name"}, 404)
+
+    year = data.get('year')
+    if year is not None:
+        if not is_digits(year) or len(year) > 4:
+            return None, ({"error": "year must be a 4-digit data release year"}, 400)
+        year = int(year)
+
+    order = data.get('order', 'top')
+    if order not in ('top', 'bottom'):
+        return None, ({"error": "order must be top or bottom"}, 400)
+
+    limit = data.get('limit', str(RANKING_SIZE))
+    if not is_digits(limit) or int(limit) < 1:
+        return None, ({"error": "limit must be a positive integer"}, 400)
+
+    return (year, data.get('state') or NATIONAL, int(limit), order == 'bottom', request_flag(data, 'typed')), None
+
+def ranking_error(measure_name, year, state):
+    """The 404 for a year or state with no ranked rows"""
+    scope = f" in {state}" if state is not NATIONAL else ''
+    return jsonify({"error": f"No ranked rows for {measure_name} in {year}{scope}"}), 404
+
+@app.route('/measures/<measure_name>/rankings', methods=['GET'])
+def measure_rankings(measure_name):
+    """The counties with the highest (or lowest) raw_value in a year, nationally or in one state"""
+    try:
+        query, error = parse_ranking_request(measure_name, request.args.to_dict())
+        if error:
+            message, status = error
+            return jsonify(message), status
+        year, state, limit, bottom, typed = query
+
+        with stage('init_db'):
+            db = get_db()
+        with stage('get_health_data'):
+            ranking = db.measure_ranking(measure_name)
+            if year is None:
+                year = max(ranking.years(), default=None)
+            summary = ranking.summary(year, state)
+            if summary is None:
+                return ranking_error(measure_name, year, state)
+            positions = ranking.top(year, state, limit, bottom)
+
+        with stage('serialization'):
+            index = ranking.index
+            scope = 'national' if state is NATIONAL else 'state'
+            counties = []
+            for position, row in zip(positions, index.rows(positions, text=not typed)):
+                standing = ranking.standing(position)[scope]
+                counties.append(render_row({
+                    'fipscode': row['fipscode'],
+                    'county': row['county'],
+                    'state': row['state'],
+                    'year_span': row['year_span'],
+                    'raw_value': row['raw_value'],
+                    'rank': standing['rank'],
+                    'percentile': standing['percentile'],
+                }, typed))
+            return Response(json_body({
+                'measure_name': measure_name,
+                'data_release_year': year,
+                'state': state,
+                'order': 'bottom' if bottom else 'top',
+                'count': summary['count'],
+                'counties': counties,
+            }), mimetype='application/json')
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/measures/<measure_name>/rankings/<fipscode>', methods=['GET'])
+def county_rankings(measure_name, fipscode):
+    """A county's national and state rank for a measure, in every year or one"""
+    try:
+        query, error = parse_ranking_request(measure_name, request.args.to_dict())
+        if error:
+            message, status = error
+            return jsonify(message), status
+        year, _, _, _, typed = query
+        if not is_digits(fipscode) or len(fipscode) != 5:
+            return jsonify({"error": "fipscode must be 5 digits"}), 400
+
+        with stage('init_db'):
+            db = get_db()
+        with stage('get_health_data'):
+            ranking = db.measure_ranking(measure_name)
+            index = ranking.index
+            start, stop = index.prefix_range(fipscode)
+            positions = [position for position in range(start, stop)
+                         if year is None or index.years[position] == year]
+        if not positions:
+            return jsonify({"error": f"No data found for fipscode {fipscode} with measure {measure_name}"}), 404
+
+        with stage('serialization'):
+            rankings = []
+            for position, row in zip(positions, index.rows(positions, text=not typed)):
+                ranked = render_row({
+                    'data_release_year': row['data_release_year'],
+                    'year_span': row['year_span'],
+                    'raw_value': row['raw_value'],
+                }, typed)
+                ranked['rank'] = render_standing(ranking.standing(position), typed)
+                rankings.append(ranked)
+            return Response(json_body({
+                'measure_name': measure_name,
+                'fipscode': fipscode,
+                'rankings': rankings,
+            }), mimetype='application/json')
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/measures/<measure_name>/summary', methods=['GET'])
+def measure_summary(measure_name):
+    """Count, mean, median, min and max of raw_value in a year, nationally and per state"""
+    try:
+        query, error = parse_ranking_request(measure_name, request.args.to_dict())
+        if error:
+            message, status = error
+            return jsonify(message), status
+        year, state, _, _, typed = query
+
+        with stage('init_db'):
+            db = get_db()
+        with stage('get_health_data'):
+            ranking = db.measure_ranking(measure_name)
+            if year is None:
+                year = max(ranking.years(), default=None)
+            national = ranking.summary(year)
+            states = [state] if state is not NATIONAL else ranking.states(year)
+            summaries = {name: ranking.summary(year, name) for name in states}
+            if national is None or None in summaries.values():
+                return ranking_error(measure_name, year, state)
+
+        return Response(json_body({
+            'measure_name': measure_name,
+            'data_release_year': year,
+            'national': render_row(national, typed),
+            'states': {name: render_row(summary, typed) for name, summary in summaries.items()},
+        }), mimetype='application/json')
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/fips/<fipscode>', methods=['GET'])
+def fips_lookup(fipscode):
+    """A county by FIPS code, named as its health rows are, with every zip it spans"""
+    try:
+        if not is_valid_fips(fipscode):
+            return jsonify({"error": "fipscode must be 5 digits"}), 400
+
+        with stage('init_db'):
+            db = get_db()
+        with stage('get_county_from_zip'):
+            fips = fips_key(fipscode)
+            county_info = db.county_for_fips(fips)
+            zip_codes = db.zips_for_fips(fips) if county_info else None
         if not county_info:
-            conn.close()
-            return jsonify({"error": f"No county found for zip code {zip_code}"}), 404
-            
-        county, state, county_code = county_info
-        
-        # Get health data
-        results = get_health_data(county, state, measure_name, conn)
-        conn.close()
-        
-        if not results:
-            return jsonify({"error": f"No data found for {county}, {state} with measure {measure_name}"}), 404
-            
-        return jsonify(results)
-        
+            return jsonify({"error": f"No county found for FIPS code {fipscode}"}), 404
+
+        county, state, _ = county_info
+        return Response(json_body({
+            'fips': fipscode,
+            'county': county,
+            'state': state,
+            'zips': zip_codes,
+        }), mimetype='application/json')
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/county_data/stats', methods=['GET'])
+def county_data_stats():
+    """Report response cache counters"""
+    return jsonify(cache_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage and request latency histograms and cache counters, in Prometheus text format"""
+    return Response(instrumentation.render_metrics(cache_stats()),
+                    mimetype='text/plain; version=0.0.4')
+
+def cache_stats():
+    """Counters of both response caches"""
+    return {
+        "response_cache": response_cache.stats(),
+        "county_cache": county_cache.stats(),
+    }
+
 # Only run the app if this file is run directly
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
+    if REFRESH_INTERVAL:
+        start_refresh_watcher(REFRESH_INTERVAL)
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,204 @@
+"""
+Opt-in request instrumentation for the County Health API
+Times the stages of each request (init_db, get_county_from_zip,
+get_health_data, serialization, ...), aggregates them into Prometheus
+histograms, and can profile a sample of requests, keeping the slowest.
+
+- COUNTY_DATA_TIMING=1: time stages, send Server-Timing, fill the histograms
+- COUNTY_DATA_PROFILE_SLOWEST=N: cProfile sampled requests and keep the N slowest
+- COUNTY_DATA_PROFILE_RATE: share of requests profiled (default 0.01)
+- COUNTY_DATA_PROFILE_DIR: where the .prof files go
+"""
+
+import cProfile
+import heapq
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+ENABLED = os.environ.get('COUNTY_DATA_TIMING') == '1'
+
+PROFILE_SLOWEST = int(os.environ.get('COUNTY_DATA_PROFILE_SLOWEST', 0))
+PROFILE_RATE = float(os.environ.get('COUNTY_DATA_PROFILE_RATE', 0.01))
+PROFILE_DIR = os.environ.get('COUNTY_DATA_PROFILE_DIR',
+                             os.path.join(tempfile.gettempdir(), 'county_data_profiles'))
+
+# Histogram upper bounds in seconds, from a cache hit to a cold CSV load
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+           0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The request being timed on this thread, if any
+_local = threading.local()
+_no_stage = nullcontext()
+
+# Held while a request is profiled: Python 3.12+ allows one active profiler
+# per process, so a request sampled while another is profiled goes unprofiled
+_profiling = threading.Lock()
+
+class Histogram:
+    """Thread-safe cumulative histogram in the Prometheus sense"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += seconds
+            self.count += 1
+
+    def samples(self):
+        """Return ([(le, cumulative count)], sum, count), +Inf included"""
+        with self._lock:
+            cumulative = list(itertools.accumulate(self.counts))
+            return (list(zip(self.buckets, cumulative)) + [('+Inf', self.count)],
+                    self.sum, self.count)
+
+# stage name -> Histogram, plus one for whole requests per endpoint
+stage_histograms = {}
+request_histograms = {}
+_histograms_lock = threading.Lock()
+
+def histogram(histograms, name):
+    """Return the named histogram, creating it on first use"""
+    found = histograms.get(name)
+    if found is None:
+        with _histograms_lock:
+            found = histograms.setdefault(name, Histogram())
+    return found
+
+class Stage:
+    """Context manager adding its elapsed time to a request's stage timings"""
+
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
+
+def stage(name):
+    """Time a block as one stage of the current request; a no-op when not timing"""
+    # Checked first: the thread-local lookup costs more than the whole no-op
+    if not ENABLED:
+        return _no_stage
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return _no_stage
+    return Stage(timings, name)
+
+def start_request():
+    """Begin timing (and maybe profiling) the request on this thread"""
+    if ENABLED:
+        _local.timings = {}
+    _local.start = time.perf_counter()
+    _local.profile = None
+    if PROFILE_SLOWEST and random.random() < PROFILE_RATE and _profiling.acquire(blocking=False):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (not ours) is already active
+            _profiling.release()
+            return
+        _local.profile = profile
+
+def finish_request(endpoint):
+    """Stop timing the request; return its Server-Timing header value or None"""
+    elapsed = time.perf_counter() - getattr(_local, 'start', time.perf_counter())
+    profile, _local.profile = getattr(_local, 'profile', None), None
+    if profile is not None:
+        profile.disable()
+        _profiling.release()
+        slowest_profiles.offer(elapsed, profile, endpoint)
+
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    if timings is None:
+        return None
+    for name, seconds in timings.items():
+        histogram(stage_histograms, name).observe(seconds)
+    histogram(request_histograms, endpoint).observe(elapsed)
+    return server_timing(timings, elapsed)
+
+def server_timing(timings, total):
+    """Format stage timings (seconds) as a Server-Timing header, in milliseconds"""
+    metrics = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()]
+    metrics.append(f"total;dur={total * 1000:.3f}")
+    return ', '.join(metrics)
+
+class SlowestProfiles:
+    """Keep cProfile dumps of the N slowest profiled requests on disk"""
+
+    def __init__(self, keep, directory):
+        self.keep = keep
+        self.directory = directory
+        self._heap = []  # (seconds, path), fastest first
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def offer(self, seconds, profile, endpoint):
+        with self._lock:
+            if len(self._heap) >= self.keep and seconds <= self._heap[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory,
+                                f"{endpoint}-{seconds * 1000:.3f}ms-{next(self._sequence)}.prof")
+            profile.dump_stats(path)
+            if len(self._heap) >= self.keep:
+                _, evicted = heapq.heapreplace(self._heap, (seconds, path))
+                os.remove(evicted)
+            else:
+                heapq.heappush(self._heap, (seconds, path))
+            return path
+
+    def paths(self):
+        """Profile files kept, slowest first"""
+        with self._lock:
+            return [path for _, path in sorted(self._heap, reverse=True)]
+
+slowest_profiles = SlowestProfiles(PROFILE_SLOWEST, PROFILE_DIR)
+
+def render_histograms(lines, metric, label, histograms):
+    for name, found in sorted(histograms.items()):
+        buckets, total, count = found.samples()
+        for bound, cumulative in buckets:
+            lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{label}="{name}"}} {total}')
+        lines.append(f'{metric}_count{{{label}="{name}"}} {count}')
+
+def render_metrics(caches=None):
+    """Prometheus text exposition of the histograms and, optionally, cache counters"""
+    lines = [
+        '# HELP county_data_stage_seconds Time spent in each request stage.',
+        '# TYPE county_data_stage_seconds histogram',
+    ]
+    render_histograms(lines, 'county_data_stage_seconds', 'stage', stage_histograms)
+    lines += [
+        '# HELP county_data_request_seconds Time to produce a response, per endpoint.',
+        '# TYPE county_data_request_seconds histogram',
+    ]
+    render_histograms(lines, 'county_data_request_seconds', 'endpoint', request_histograms)
+    for cache_name, stats in sorted((caches or {}).items()):
+        for counter in ('hits', 'misses', 'evictions', 'expirations'):
+            metric = f'county_data_{cache_name}_{counter}_total'
+            lines += [f'# TYPE {metric} counter', f'{metric} {stats[counter]}']
+        lines += [f'# TYPE county_data_{cache_name}_size gauge',
+                  f'county_data_{cache_name}_size {stats["size"]}']
+    return '\n'.join(lines) + '\n'
@@ -1,55 +1,406 @@
 """
 Data loading script for the County Health API
-This script runs during build time to prepare the data for the API
+This script runs during build time to prepare the data for the API.
+It compiles both CSV files into a versioned, checksummed SQLite snapshot
+that api/county_data.py opens read-only at cold start.
+
+With --incremental only the CSV files that changed since the last build
+are re-read, and only the rows that changed are replaced. --report prints
+the rows that fail to join the two files by FIPS code.
+
+Usage: python api/load_data.py [--data-dir DIR] [--output PATH] [--verify] [--incremental] [--report]
 """
 
-import csv
+import argparse
+import itertools
 import json
 import os
+import shutil
+import sqlite3
+import sys
+import time
+
+# Allow running as a script from anywhere (python api/load_data.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.backends import FRAGMENTS_TABLE, ZIP_INDEX_TABLE, read_fips_counties
+from api.county_data import (CLUSTERED_LAYOUTS, DATA_DIR, SNAPSHOT_FORMAT_VERSION, UPSERT_KEYS,
+                             build_fips_tables, compute_dataset_version, dataset_version_for,
+                             file_sha256, get_snapshot_path, load_csv_data, open_snapshot,
+                             read_snapshot_manifest)
+from api.serialization import encode_rows
+from api.time_series import encode_series
+from api.zip_index import IS_FIPS_SQL, ZipIndex, fips_key
+
+# Source CSV files and the tables they are loaded into
+SOURCE_TABLES = [
+    ('zip_county.csv', 'zip_county'),
+    ('county_health_rankings.csv', 'county_health_rankings'),
+]
+
+# Health rows with a FIPS code, grouped by integer code and measure_name;
+# each group's rows come in the order lookups return them
+HEALTH_BY_FIPS_SQL = f"""
+    SELECT *
+    FROM county_health_rankings
+    WHERE {IS_FIPS_SQL.format(column='fipscode')}
+    ORDER BY CAST(fipscode AS INTEGER), measure_name, fipscode, rowid
+"""
+
+# How many counties get their answers prebuilt into the snapshot
+PREBUILT_COUNTIES = int(os.environ.get('COUNTY_DATA_PREBUILT_COUNTIES', 500))
+
+# Integer FIPS codes of the counties zip_county points at, most residents
+# (each zip's population times the county's share of it) first
+COUNTY_POPULATION_SQL = f"""
+    SELECT CAST(county_code AS INTEGER) AS fips
+    FROM zip_county
+    WHERE {IS_FIPS_SQL.format(column='county_code')}
+    AND CAST(county_code AS INTEGER) IN (SELECT fips FROM fips_counties)
+    GROUP BY fips
+    ORDER BY SUM(COALESCE(zip_pop, 0) * COALESCE(zip_pop_in_county, 0)) DESC, fips
+    LIMIT ?
+"""
+
+# How many example rows join_report lists per problem
+REPORT_EXAMPLES = 5
+
+# Problem -> query for the rows that have it, over a database with the FIPS tables
+JOIN_REPORT_SQL = {
+    # zip_county rows whose county_code is not a FIPS code, so they have no health rows
+    'zip_rows_with_invalid_fips': f"""
+        SELECT zip, county, state_abbreviation, county_code
+        FROM zip_county
+        WHERE county_code IS NULL OR NOT {IS_FIPS_SQL.format(column='county_code')}
+        ORDER BY zip, county_code
+    """,
+    # zip_county rows whose FIPS code has no health rows
+    'zip_rows_without_health_rows': """
+        SELECT z.zip, z.county, z.state_abbreviation, z.county_code
+        FROM zip_counties AS z
+        LEFT JOIN fips_counties AS f ON f.fips = z.fips
+        WHERE z.fips IS NOT NULL AND f.fips IS NULL
+        ORDER BY z.zip, z.county_code
+    """,
+    # zip_county rows that join by FIPS code but name the county differently
+    'zip_rows_renamed': f"""
+        SELECT z.zip, z.county, z.state_abbreviation, z.county_code, f.county, f.state
+        FROM zip_county AS z
+        JOIN fips_counties AS f
+        ON f.fips = CASE WHEN {IS_FIPS_SQL.format(column='z.county_code')}
+                         THEN CAST(z.county_code AS INTEGER) END
+        WHERE z.county IS NOT f.county OR z.state_abbreviation IS NOT f.state
+        ORDER BY z.zip, z.county_code
+    """,
+    # Counties with health rows that no zip points at
+    'counties_without_zips': """
+        SELECT printf('%05d', f.fips), f.county, f.state
+        FROM fips_counties AS f
+        WHERE f.fips NOT IN (SELECT fips FROM zip_counties WHERE fips IS NOT NULL)
+        ORDER BY f.fips
+    """,
+    # Health rows whose fipscode is not a FIPS code
+    'health_rows_with_invalid_fips': f"""
+        SELECT DISTINCT fipscode, county, state
+        FROM county_health_rankings
+        WHERE fipscode IS NULL OR NOT {IS_FIPS_SQL.format(column='fipscode')}
+        ORDER BY fipscode, county, state
+    """,
+    # FIPS codes the health rows give several county names; fips_counties keeps the first
+    'fips_with_conflicting_names': f"""
+        SELECT printf('%05d', CAST(fipscode AS INTEGER)) AS fips,
+               group_concat(DISTINCT county || ', ' || state)
+        FROM county_health_rankings
+        WHERE {IS_FIPS_SQL.format(column='fipscode')}
+        AND CAST(fipscode AS INTEGER) % 1000 != 0
+        GROUP BY fips
+        HAVING COUNT(DISTINCT county || ', ' || state) > 1
+        ORDER BY fips
+    """,
+}
+
+def join_report(conn):
+    """{problem: {'count': rows, 'examples': [first REPORT_EXAMPLES rows]}} for JOIN_REPORT_SQL"""
+    report = {}
+    for problem, sql in JOIN_REPORT_SQL.items():
+        rows = conn.execute(sql).fetchall()
+        report[problem] = {'count': len(rows), 'examples': [list(row) for row in rows[:REPORT_EXAMPLES]]}
+    return report
+
+def health_groups(conn):
+    """Yield ((fips, measure_name), rows as dicts) for every group of HEALTH_BY_FIPS_SQL"""
+    health = conn.execute(HEALTH_BY_FIPS_SQL)
+    columns = [description[0] for description in health.description]
+    fipscode_index = columns.index('fipscode')
+    measure_index = columns.index('measure_name')
+    for key, rows in itertools.groupby(health, key=lambda row: (fips_key(row[fipscode_index]),
+                                                                  row[measure_index])):
+        yield key, [dict(zip(columns, row)) for row in rows]
+
+def build_zip_index(cursor):
+    """(Re)build the serialized ZipIndex of zip_county, stored as a single row"""
+    cursor.execute(f"DROP TABLE IF EXISTS {ZIP_INDEX_TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {ZIP_INDEX_TABLE} (
+            byteorder TEXT, zips BLOB, county_ids BLOB, weights BLOB, counties TEXT
+        )
+    """)
+    cursor.execute(f"INSERT INTO {ZIP_INDEX_TABLE} VALUES (?, ?, ?, ?, ?)",
+                   ZipIndex.from_connection(cursor.connection).to_row())
+
+def build_health_fragments(cursor):
+    """(Re)build the pre-encoded untyped rows and time series of the most populous counties.
+
+    Only the PREBUILT_COUNTIES counties with the most residents get a row
+    per measure, so the table stays small; other answers are built on
+    request and cached. Fragments are byte-identical to what encode_rows
+    and encode_series build at request time from the same rows, naming the
+    county as fips_counties does.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {FRAGMENTS_TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {FRAGMENTS_TABLE} (
+            fips INTEGER, measure_name TEXT, rows BLOB, series BLOB,
+            PRIMARY KEY (fips, measure_name)
+        ) WITHOUT ROWID
+    """)
+    conn = cursor.connection
+    prebuilt = {fips for fips, in conn.execute(COUNTY_POPULATION_SQL, (PREBUILT_COUNTIES,))}
+    names = read_fips_counties(conn)
+    for (fips, measure_name), rows in health_groups(conn):
+        if fips not in prebuilt:
+            continue
+        county, state = names[fips]
+        cursor.execute(f"INSERT INTO {FRAGMENTS_TABLE} VALUES (?, ?, ?, ?)", (
+            fips, measure_name, encode_rows(rows, False),
+            encode_series(county, state, measure_name, rows, False)))
+
+def build_snapshot(data_dir=None, snapshot_path=None):
+    """Build the snapshot from the CSV files and return its manifest"""
+    data_dir = data_dir or DATA_DIR
+    snapshot_path = snapshot_path or get_snapshot_path(data_dir)
+
+    dataset_version, sources = compute_dataset_version(data_dir)
+
+    # Write to a temporary file first so a running server never sees a partial snapshot
+    tmp_path = snapshot_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    cursor = conn.cursor()
+    for name, table_name in SOURCE_TABLES:
+        # The snapshot is written once, so it always gets the clustered layout
+        load_csv_data(cursor, os.path.join(data_dir, name), table_name, clustered=True)
+    build_fips_tables(cursor)
+    build_zip_index(cursor)
+    build_health_fragments(cursor)
+
+    cursor.execute("CREATE TABLE snapshot_meta (key TEXT PRIMARY KEY, value TEXT)")
+    cursor.executemany("INSERT INTO snapshot_meta VALUES (?, ?)", [
+        ('format_version', str(SNAPSHOT_FORMAT_VERSION)),
+        ('dataset_version', dataset_version),
+    ])
+    conn.commit()
+
+    # Compact the file; a published snapshot is never written to in place
+    cursor.execute("VACUUM")
+    conn.close()
 
-def load_csv_to_dict(csv_path):
-    """Load CSV file into a list of dictionaries"""
-    data = []
-    with open(csv_path, 'r', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            data.append(row)
-    return data
+    manifest = snapshot_manifest(tmp_path, data_dir, dataset_version, sources)
+    install_snapshot(tmp_path, snapshot_path, manifest)
+    return manifest
+
+def source_mtimes(data_dir):
+    """Return {source file: mtime in ns} for the CSV files"""
+    return {name: os.stat(os.path.join(data_dir, name)).st_mtime_ns for name, _ in SOURCE_TABLES}
+
+def snapshot_manifest(snapshot_path, data_dir, dataset_version, sources):
+    """Describe a finished snapshot file for its .json manifest"""
+    return {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'dataset_version': dataset_version,
+        'built_at': int(time.time()),
+        'size': os.path.getsize(snapshot_path),
+        'sha256': file_sha256(snapshot_path),
+        'sources': sources,
+        # Lets the next incremental build skip hashing untouched files
+        'source_mtimes': source_mtimes(data_dir),
+    }
+
+def install_snapshot(tmp_path, snapshot_path, manifest):
+    """Move a finished snapshot and its manifest into place"""
+    # Readers that already opened the old file keep reading it until they close
+    os.replace(tmp_path, snapshot_path)
+    write_manifest(snapshot_path, manifest)
+
+def write_manifest(snapshot_path, manifest):
+    """Atomically (re)write the .json manifest next to a snapshot"""
+    with open(snapshot_path + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(snapshot_path + '.json.tmp', snapshot_path + '.json')
+
+def changed_sources(data_dir, manifest):
+    """Return ({source file: sha256}, [changed source files]) relative to a manifest.
+
+    A file whose mtime matches the manifest is assumed unchanged; otherwise
+    it is hashed, so touching a file without editing it is not a change.
+    """
+    old_sources = manifest.get('sources', {})
+    old_mtimes = manifest.get('source_mtimes', {})
+    mtimes = source_mtimes(data_dir)
+    sources, changed = {}, []
+    for name, _ in SOURCE_TABLES:
+        if name in old_sources and old_mtimes.get(name) == mtimes[name]:
+            sources[name] = old_sources[name]
+            continue
+        sources[name] = file_sha256(os.path.join(data_dir, name))
+        if sources[name] != old_sources.get(name):
+            changed.append(name)
+    return sources, changed
+
+def apply_csv_delta(cursor, csv_path, table_name):
+    """Replace the rows of table_name that differ from csv_path.
+
+    Rows are matched on UPSERT_KEYS: every key with a new, changed or
+    removed row has all its rows replaced by the ones in the CSV (together
+    with the rest of their clustered group, to keep row order). Returns
+    the number of keys replaced, or None when the CSV columns no longer
+    match the table and it has to be rebuilt.
+    """
+    delta_table = f"{table_name}_delta"
+    load_csv_data(cursor, csv_path, table_name, into=delta_table)
+
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+    delta_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({delta_table})")]
+    if columns != delta_columns:
+        cursor.execute(f"DROP TABLE {delta_table}")
+        return None
+
+    key_columns = UPSERT_KEYS.get(table_name)
+    if not key_columns or not set(key_columns) <= set(columns):
+        # No usable key: swap the whole table's contents
+        cursor.execute(f"SELECT COUNT(*) FROM {delta_table}")
+        replaced = cursor.fetchone()[0]
+        cursor.execute(f"DELETE FROM {table_name}")
+        cursor.execute(f"INSERT INTO {table_name} SELECT * FROM {delta_table}")
+        cursor.execute(f"DROP TABLE {delta_table}")
+        return replaced
+
+    key = ', '.join(key_columns)
+    cursor.execute(f"""
+        CREATE TEMP TABLE changed_keys AS
+        SELECT {key} FROM (SELECT * FROM {delta_table} EXCEPT SELECT * FROM {table_name})
+        UNION
+        SELECT {key} FROM (SELECT * FROM {table_name} EXCEPT SELECT * FROM {delta_table})
+    """)
+    cursor.execute("SELECT COUNT(*) FROM changed_keys")
+    replaced = cursor.fetchone()[0]
+
+    # Lookups return a clustered table's rows in CSV order within each
+    # order_by group. Re-inserted rows would land after the unchanged rows
+    # of their group, so whole groups are replaced, in CSV order.
+    order_by = CLUSTERED_LAYOUTS.get(table_name, {}).get('order_by')
+    if order_by:
+        cursor.execute(f"""
+            CREATE TEMP TABLE changed_groups AS
+            SELECT {order_by} FROM {table_name} WHERE ({key}) IN (SELECT * FROM changed_keys)
+            UNION
+            SELECT {order_by} FROM {delta_table} WHERE ({key}) IN (SELECT * FROM changed_keys)
+        """)
+        where = f"({order_by}) IN (SELECT * FROM changed_groups)"
+    else:
+        where = f"({key}) IN (SELECT * FROM changed_keys)"
+    cursor.execute(f"DELETE FROM {table_name} WHERE {where}")
+    cursor.execute(f"INSERT INTO {table_name} SELECT * FROM {delta_table} WHERE {where} ORDER BY rowid")
+    cursor.execute("DROP TABLE IF EXISTS changed_groups")
+    cursor.execute("DROP TABLE changed_keys")
+    cursor.execute(f"DROP TABLE {delta_table}")
+    return replaced
+
+def update_snapshot(data_dir=None, snapshot_path=None):
+    """Apply changed CSV files to an existing snapshot.
+
+    The current snapshot is copied, only the changed files are diffed into
+    the copy, and the copy then replaces it. Falls back to build_snapshot
+    when there is no usable snapshot or a file's columns changed.
+    Returns (manifest, [changed source files]).
+    """
+    data_dir = data_dir or DATA_DIR
+    snapshot_path = snapshot_path or get_snapshot_path(data_dir)
+
+    try:
+        manifest = read_snapshot_manifest(snapshot_path)
+    except ValueError:
+        manifest = None
+    if (manifest is None or manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION
+            or not os.path.exists(snapshot_path)):
+        return build_snapshot(data_dir, snapshot_path), [name for name, _ in SOURCE_TABLES]
+
+    sources, changed = changed_sources(data_dir, manifest)
+    if not changed:
+        if manifest.get('source_mtimes') != source_mtimes(data_dir):
+            # Touched but identical: remember the new mtimes to skip hashing next time
+            manifest['source_mtimes'] = source_mtimes(data_dir)
+            write_manifest(snapshot_path, manifest)
+        return manifest, []
+
+    tmp_path = snapshot_path + '.tmp'
+    shutil.copyfile(snapshot_path, tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    cursor = conn.cursor()
+    for name, table_name in SOURCE_TABLES:
+        if name in changed and apply_csv_delta(cursor, os.path.join(data_dir, name), table_name) is None:
+            conn.close()
+            os.remove(tmp_path)
+            return build_snapshot(data_dir, snapshot_path), changed
+    build_fips_tables(cursor)
+    build_zip_index(cursor)
+    build_health_fragments(cursor)
+
+    dataset_version = dataset_version_for(sources)
+    cursor.execute("UPDATE snapshot_meta SET value = ? WHERE key = 'dataset_version'",
+                   (dataset_version,))
+    conn.commit()
+    # Small deltas leave few free pages; only compact once they add up
+    page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+    if cursor.execute("PRAGMA freelist_count").fetchone()[0] * 4 > page_count:
+        cursor.execute("VACUUM")
+    conn.close()
+
+    manifest = snapshot_manifest(tmp_path, data_dir, dataset_version, sources)
+    install_snapshot(tmp_path, snapshot_path, manifest)
+    return manifest, changed
 
 def main():
-    # Get the base directory (where the CSV files are)
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
-    # Load both CSV files
-    zip_data = load_csv_to_dict(os.path.join(base_dir, 'zip_county.csv'))
-    health_data = load_csv_to_dict(os.path.join(base_dir, 'county_health_rankings.csv'))
-    
-    # Create zip code to county mapping for faster lookups
-    zip_mapping = {}
-    for row in zip_data:
-        zip_mapping[row['zip']] = {
-            'county': row['county'],
-            'state': row['state_abbreviation'],
-            'county_code': row['county_code']
-        }
-    
-    # Create county to health data mapping for faster lookups
-    health_mapping = {}
-    for row in health_data:
-        key = (row['county'], row['state'], row['measure_name'])
-        if key not in health_mapping:
-            health_mapping[key] = []
-        health_mapping[key].append(row)
-    
-    # Save the processed data
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    
-    with open(os.path.join(data_dir, 'zip_mapping.json'), 'w') as f:
-        json.dump(zip_mapping, f)
-    
-    with open(os.path.join(data_dir, 'health_mapping.json'), 'w') as f:
-        json.dump(health_mapping, f)
+    parser = argparse.ArgumentParser(description='Build the County Health API data snapshot')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help='directory containing zip_county.csv and county_health_rankings.csv')
+    parser.add_argument('--output', help='snapshot path (default: <data-dir>/county_data.snapshot.sqlite)')
+    parser.add_argument('--verify', action='store_true',
+                        help='re-open the snapshot and check its checksum after building')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only apply the CSV files that changed since the last build')
+    parser.add_argument('--report', action='store_true',
+                        help='print the rows that fail to join zip_county and the health rows by FIPS code')
+    args = parser.parse_args()
+
+    snapshot_path = args.output or get_snapshot_path(args.data_dir)
+    if args.incremental:
+        manifest, changed = update_snapshot(args.data_dir, snapshot_path)
+        print(f"Changed sources: {', '.join(changed) or 'none'}")
+    else:
+        manifest = build_snapshot(args.data_dir, snapshot_path)
+
+    if args.verify:
+        open_snapshot(snapshot_path, verify=True).close()
+    if args.report:
+        conn = open_snapshot(snapshot_path)
+        print(json.dumps(join_report(conn), indent=2))
+        conn.close()
+
+    print(f"Created snapshot {snapshot_path} "
+          f"(version {manifest['dataset_version']}, {manifest['size']} bytes)")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,186 @@
+"""
+Per-measure export index for the County Health API
+One measure's health rows for every county, stored column by column in
+(fipscode, year_span, data_release_year) order. A fipscode prefix is a
+contiguous range found by binary search; the state and year filters
+compare packed integer columns, vectorized with NumPy when installed.
+
+Pages resume after a keyset cursor, the key of the last row sent, so
+paging stays consistent even if the data is reloaded in between.
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+
+from api.columns import is_numeric_column, number_from_column, numeric_column, numpy
+from api.schema import NUMERIC_TEXT_COLUMN
+from api.serialization import loads, render_value
+
+# Selects a measure's rows in index order, for databases without MEASURE_SHARDS_TABLE
+MEASURE_ROWS_SQL = """
+    SELECT *
+    FROM county_health_rankings
+    WHERE measure_name = ?
+    ORDER BY fipscode, year_span, data_release_year, rowid
+"""
+
+# Sorts after every character a fipscode prefix can be followed by
+PREFIX_END = '\U0010ffff'
+
+def row_key(fipscode, year_span, data_release_year):
+    """The (fipscode, year_span, data_release_year) key rows are ordered by; NULLs sort first"""
+    return (fipscode or '', year_span or '', data_release_year or 0)
+
+class MeasureIndex:
+    """One measure's rows as columns, sorted by row_key.
+
+    fipscodes, year_spans and years hold the key of every row (NULLs as ''
+    and 0); state_ids number the distinct states. The columns keep the
+    values as stored, for building rows; texts maps the position of each
+    row that kept the CSV text of a numeric field to {column: text}.
+    """
+
+    __slots__ = ('columns', 'data', 'numeric', 'texts', 'fipscodes', 'year_spans', 'years',
+                 'states', 'state_ids')
+
+    def __init__(self, columns, data, numeric):
+        intern = sys.intern
+        self.columns = tuple(name for name in columns if name != NUMERIC_TEXT_COLUMN)
+        self.data = data
+        self.numeric = numeric
+        self.texts = {position: loads(text) for position, text in enumerate(data.pop(NUMERIC_TEXT_COLUMN, ()))
+                      if text}
+        everything = range(len(data['fipscode']))
+        self.fipscodes = [code or '' for code in self.column('fipscode', everything)]
+        self.year_spans = [span or '' for span in self.column('year_span', everything)]
+        self.years = array('H', (year or 0 for year in self.column('data_release_year', everything)))
+        self.states = {}
+        self.state_ids = array('H', (self.states.setdefault(intern(state or ''), len(self.states))
+                                     for state in self.column('state', everything)))
+
+    @classmethod
+    def from_columns(cls, columns, values):
+        """Build the index from one list of values per column, already in row_key order"""
+        intern = sys.intern
+        data, numeric = {}, set()
+        for name, column in zip(columns, values):
+            if is_numeric_column(column):
+                data[name] = numeric_column(column)
+                numeric.add(name)
+            else:
+                data[name] = [intern(value) if isinstance(value, str) else value for value in column]
+        return cls(columns, data, frozenset(numeric))
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """Build the index from rows given as sequences in columns order, in any order"""
+        columns = list(columns)
+        key_indexes = [columns.index(name) for name in ('fipscode', 'year_span', 'data_release_year')]
+        # Stable, so rows with equal keys keep their order
+        rows = sorted(rows, key=lambda row: row_key(*(row[index] for index in key_indexes)))
+        values = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        return cls.from_columns(columns, values)
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        """Build the index from a cursor over county_health_rankings rows"""
+        return cls.from_rows([description[0] for description in cursor.description], cursor.fetchall())
+
+    def __len__(self):
+        return len(self.fipscodes)
+
+    def key(self, position):
+        """The row_key of the row at position"""
+        return (self.fipscodes[position], self.year_spans[position], self.years[position])
+
+    def column(self, name, positions, text=False):
+        """A column's values at positions as SQLite returns them, or with text as render_row renders them"""
+        values = self.data[name]
+        if name in self.numeric:
+            values = [number_from_column(values[position]) for position in positions]
+        else:
+            values = [values[position] for position in positions]
+        if not text:
+            return values
+        values = [value if value.__class__ is str else render_value(value) for value in values]
+        if self.texts:
+            for i, position in enumerate(positions):
+                kept = self.texts.get(position)
+                if kept and name in kept:
+                    values[i] = kept[name]
+        return values
+
+    def value_rows(self, positions, text=False):
+        """The rows at positions as tuples in column order, built a column at a time"""
+        return zip(*(self.column(name, positions, text) for name in self.columns))
+
+    def rows(self, positions, text=False):
+        """The rows at positions as dicts, in table column order"""
+        names = self.columns
+        return [dict(zip(names, values)) for values in self.value_rows(positions, text)]
+
+    def prefix_range(self, prefix):
+        """The (start, stop) positions of the rows whose fipscode starts with prefix"""
+        if not prefix:
+            return 0, len(self)
+        return (bisect_left(self.fipscodes, prefix),
+                bisect_left(self.fipscodes, prefix + PREFIX_END))
+
+    def position_after(self, key):
+        """The first position whose key sorts after key"""
+        position = bisect_left(self.fipscodes, key[0])
+        # Only the rows of one fipscode are left to step over
+        while position < len(self) and self.key(position) <= key:
+            position += 1
+        return position
+
+    def find(self, key):
+        """The first position whose key is key, or None"""
+        position = bisect_left(self.fipscodes, key[0])
+        while position < len(self) and self.fipscodes[position] == key[0]:
+            if self.key(position) == key:
+                return position
+            position += 1
+        return None
+
+    def matches(self, start, stop, state=None, year=None):
+        """Positions in [start, stop) of the rows in state and year (either may be None)"""
+        if state is None and year is None:
+            return list(range(start, stop))
+        state_id = self.states.get(state) if state is not None else None
+        if state is not None and state_id is None:
+            return []
+        if numpy is not None:
+            mask = numpy.ones(stop - start, dtype=bool)
+            if state_id is not None:
+                mask &= numpy.frombuffer(self.state_ids, dtype=numpy.uint16)[start:stop] == state_id
+            if year is not None:
+                mask &= numpy.frombuffer(self.years, dtype=numpy.uint16)[start:stop] == year
+            return (numpy.flatnonzero(mask) + start).tolist()
+        state_ids, years = self.state_ids, self.years
+        return [position for position in range(start, stop)
+                if (state_id is None or state_ids[position] == state_id)
+                and (year is None or years[position] == year)]
+
+    def page(self, fipscode_prefix=None, state=None, year=None, after=None, limit=None):
+        """Return (positions, next_key) of the next page of matching rows.
+
+        after is the key the previous page ended on. A page of limit rows
+        is extended over rows sharing its last key, so a cursor never
+        splits them; next_key is None on the last page.
+        """
+        start, stop = self.prefix_range(fipscode_prefix)
+        if after is not None:
+            start = max(start, self.position_after(after))
+        positions = self.matches(start, stop, state, year)
+        if limit is None or len(positions) <= limit:
+            return positions, None
+
+        end = limit
+        last = self.key(positions[end - 1])
+        while end < len(positions) and self.key(positions[end]) == last:
+            end += 1
+        if end == len(positions):
+            return positions, None
+        return positions[:end], last
@@ -0,0 +1,265 @@
+"""
+Pre-forking launcher for the County Health API
+The parent process loads the data once, opens the listening socket and
+forks COUNTY_DATA_WORKERS workers (default: one per core), each serving
+requests from the shared socket with Werkzeug's WSGI server.
+
+Workers inherit the loaded backend rather than building their own. The
+memory backends keep their data in packed arrays and interned strings,
+and the parent freezes the garbage collector's view of them before
+forking, so those pages stay shared copy-on-write. SQLite backends reopen
+the snapshot in each worker; its mmap'd pages are shared by the kernel.
+A worker forked after the snapshot file was replaced under the parent
+loads the new one itself instead (see backends.SnapshotReplaced).
+
+SIGHUP reloads the data (picking up changed CSV files like refresh_db)
+and replaces the workers: the new ones are forked from the reloaded
+parent before the old ones are told to stop, and the old ones finish the
+request in hand first. COUNTY_DATA_REFRESH_INTERVAL does the same
+whenever the files changed. SIGTERM or SIGINT stops every worker the same
+way, then the parent. A worker that crashes is replaced after a delay
+that doubles while workers keep crashing (COUNTY_DATA_RESTART_DELAY up
+to COUNTY_DATA_MAX_RESTART_DELAY seconds). Workers also stop by
+themselves if the parent dies without stopping them, rather than serving
+on from stale data unsupervised.
+
+Usage: PORT=8000 COUNTY_DATA_WORKERS=4 python -m api.prefork
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+import api.county_data as county_data
+from api.backends import SnapshotReplaced
+
+WORKERS = int(os.environ.get('COUNTY_DATA_WORKERS', 0)) or os.cpu_count() or 1
+
+# Seconds a stopping worker gets to finish its request before SIGKILL
+GRACEFUL_TIMEOUT = float(os.environ.get('COUNTY_DATA_GRACEFUL_TIMEOUT', 30))
+
+# Seconds between checks for signals, in the parent and in each worker
+POLL_INTERVAL = 0.5
+
+# A crashed worker is replaced after RESTART_DELAY seconds, doubling with
+# each crash in a row up to MAX_RESTART_DELAY, so workers dying at startup
+# are not forked in a tight loop. A worker that ran MAX_RESTART_DELAY
+# seconds before crashing ends the streak.
+RESTART_DELAY = float(os.environ.get('COUNTY_DATA_RESTART_DELAY', 0.5))
+MAX_RESTART_DELAY = float(os.environ.get('COUNTY_DATA_MAX_RESTART_DELAY', 60))
+
+# Signals the parent handles; blocked around fork() so none is lost in between
+PARENT_SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
+
+def serve(sock, parent):
+    """Worker loop: answer requests on the shared socket until SIGTERM or the parent exits"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    # Ctrl-C and SIGHUP are for the parent, which then stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, PARENT_SIGNALS)
+
+    try:
+        county_data.get_db().after_fork()
+    except SnapshotReplaced:
+        # The snapshot changed since the parent loaded it, so load it anew
+        # here rather than mix it with the inherited data
+        county_data.reload_db()
+    server = make_server(*sock.getsockname()[:2], county_data.app, fd=sock.fileno())
+    # Every worker wakes for each connection; the ones that lose the race
+    # to accept() must go back to waiting rather than block in it
+    server.socket.setblocking(False)
+    server.timeout = POLL_INTERVAL
+    # An orphaned worker is reparented, so its parent pid changes
+    while not stopping and os.getppid() == parent:
+        server.handle_request()
+    server.server_close()
+
+def load_shared(load):
+    """Run load() in the parent, then freeze every object allocated so far.
+
+    Frozen objects are never examined by the garbage collector, so the
+    workers' collections do not write to the pages holding them.
+    """
+    # Let the previous data be reclaimed once load() replaces it
+    gc.unfreeze()
+    try:
+        return load()
+    finally:
+        gc.collect()
+        gc.freeze()
+
+class Supervisor:
+    """Parent process: forks the workers, replaces them on reload and reaps them"""
+
+    def __init__(self, sock, size=None):
+        self.sock = sock
+        self.size = size or WORKERS
+        self.workers = set()
+        # pid -> when the worker was forked
+        self.started = {}
+        # pid -> time by which a stopping worker is killed
+        self.retiring = {}
+        # When to fork the replacements of crashed workers
+        self.respawns = []
+        self.restart_delay = 0
+        self.pending = []
+        self.stopping = False
+
+    def spawn(self):
+        """Fork one worker"""
+        parent = os.getpid()
+        signal.pthread_sigmask(signal.SIG_BLOCK, PARENT_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                status = 0
+                try:
+                    serve(self.sock, parent)
+                except BaseException:
+                    traceback.print_exc()
+                    status = 1
+                finally:
+                    os._exit(status)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, PARENT_SIGNALS)
+        self.workers.add(pid)
+        self.started[pid] = time.monotonic()
+        return pid
+
+    def retire(self, pids):
+        """Ask workers to stop once their current request is answered"""
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        for pid in pids:
+            self.workers.discard(pid)
+            self.retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def restart(self):
+        """Replace every worker by one forked from the current data"""
+        old = list(self.workers)
+        # The new workers also stand in for crashed ones not yet replaced
+        self.respawns.clear()
+        self.restart_delay = 0
+        for _ in range(self.size):
+            self.spawn()
+        self.retire(old)
+
+    def reload(self):
+        """Reload the data and restart the workers; keep the old ones if loading fails"""
+        try:
+            # Reload even when the CSV files did not change, e.g. for a replaced snapshot
+            load_shared(lambda: county_data.refresh_db() or county_data.reload_db())
+        except Exception as e:
+            county_data.app.logger.error("Data reload failed, keeping the current workers: %s", e)
+            return
+        county_data.app.logger.info("Reloaded data; restarting %d workers", self.size)
+        self.restart()
+
+    def refresh(self):
+        """Restart the workers if the data files changed"""
+        try:
+            changed = load_shared(county_data.refresh_db)
+        except Exception as e:
+            county_data.app.logger.error("Data refresh failed: %s", e)
+            return
+        if changed:
+            county_data.app.logger.info("Reloaded changed data; restarting %d workers", self.size)
+            self.restart()
+
+    def reap(self):
+        """Collect exited workers, replacing any that were not asked to stop"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.pop(pid, None)
+            started = self.started.pop(pid, None)
+            if pid in self.workers:
+                self.workers.discard(pid)
+                county_data.app.logger.warning("Worker %d exited with status %d", pid,
+                                               os.waitstatus_to_exitcode(status))
+                if not self.stopping:
+                    self.schedule_respawn(started)
+
+    def schedule_respawn(self, started):
+        """Plan the replacement of a worker forked at started, backing off while workers keep crashing"""
+        now = time.monotonic()
+        if started is not None and now - started >= MAX_RESTART_DELAY:
+            self.restart_delay = 0
+        self.restart_delay = min(self.restart_delay * 2 or RESTART_DELAY, MAX_RESTART_DELAY)
+        if self.restart_delay >= MAX_RESTART_DELAY:
+            county_data.app.logger.error("Workers keep crashing; replacing them at most every %g seconds",
+                                         MAX_RESTART_DELAY)
+        self.respawns.append(now + self.restart_delay)
+
+    def respawn_due(self):
+        """Fork the replacements whose delay is over"""
+        now = time.monotonic()
+        due = [at for at in self.respawns if at <= now]
+        self.respawns = [at for at in self.respawns if at > now]
+        for _ in due:
+            self.spawn()
+
+    def kill_overdue(self):
+        """SIGKILL stopping workers that outlived GRACEFUL_TIMEOUT"""
+        now = time.monotonic()
+        for pid, deadline in self.retiring.items():
+            if now >= deadline:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def on_signal(self, signum, frame):
+        self.pending.append(signum)
+
+    def run(self, refresh_interval=None):
+        """Serve until SIGTERM or SIGINT; SIGHUP reloads the data"""
+        for signum in PARENT_SIGNALS:
+            signal.signal(signum, self.on_signal)
+        load_shared(county_data.get_db)
+        for _ in range(self.size):
+            self.spawn()
+
+        next_refresh = time.monotonic() + refresh_interval if refresh_interval else None
+        while self.workers or self.retiring or self.respawns:
+            time.sleep(POLL_INTERVAL)
+            self.reap()
+            if not self.stopping:
+                self.respawn_due()
+            self.kill_overdue()
+            while self.pending:
+                signum = self.pending.pop(0)
+                if signum == signal.SIGHUP and not self.stopping:
+                    self.reload()
+                elif signum in (signal.SIGTERM, signal.SIGINT) and not self.stopping:
+                    self.stopping = True
+                    self.respawns.clear()
+                    self.retire(list(self.workers))
+            if next_refresh is not None and not self.stopping and time.monotonic() >= next_refresh:
+                self.refresh()
+                next_refresh = time.monotonic() + refresh_interval
+        self.sock.close()
+
+def main():
+    port = int(os.environ.get('PORT', 8000))
+    sock = socket.create_server(('0.0.0.0', port), backlog=socket.SOMAXCONN)
+    supervisor = Supervisor(sock)
+    county_data.app.logger.info("Serving on port %d with %d workers", port, supervisor.size)
+    supervisor.run(county_data.REFRESH_INTERVAL)
+
+if __name__ == '__main__':
+    main()
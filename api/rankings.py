@@ -0,0 +1,124 @@
+"""
+Rankings and summaries for the County Health API
+One measure's counties ranked by raw_value within each data release year,
+nationally and within their state. Everything is computed once per
+measure from its MeasureIndex, so a county's rank, a top-N list or a
+state's mean and median is a lookup.
+
+Rank 1 is the highest raw_value and tied values share the best rank. A
+percentile is the share of ranked counties with a lower raw_value, ties
+counting half. Rows without a numeric raw_value and the state and
+national summary rows (fipscode ending in 000) are not ranked.
+"""
+
+import math
+from array import array
+
+# The scope of national rankings and summaries, next to state abbreviations
+NATIONAL = None
+
+def is_ranked(fipscode, value):
+    """Check whether a row takes part in the rankings"""
+    # Numeric columns hold only ints, floats and None (never bools)
+    return value.__class__ in (int, float) and fipscode and not fipscode.endswith('000')
+
+def summarize(values):
+    """count, mean, median, min and max of values sorted in ascending order"""
+    count = len(values)
+    middle = count // 2
+    return {
+        'count': count,
+        'mean': math.fsum(values) / count,
+        'median': values[middle] if count % 2 else (values[middle - 1] + values[middle]) / 2,
+        'min': values[0],
+        'max': values[-1],
+    }
+
+class MeasureRanking:
+    """Per-year rankings of one measure's rows, by position in its MeasureIndex.
+
+    orders maps (data_release_year, state or NATIONAL) to the positions of
+    the ranked rows from the highest raw_value down; ranks and percentiles
+    hold each row's national and state standing (rank 0 when unranked).
+    """
+
+    __slots__ = ('index', 'values', 'orders', 'summaries', 'national_ranks', 'national_percentiles',
+                 'state_ranks', 'state_percentiles')
+
+    def __init__(self, index):
+        self.index = index
+        self.values = values = index.column('raw_value', range(len(index)))
+        fipscodes, years, state_ids = index.fipscodes, index.years, index.state_ids
+
+        groups = {}
+        for position, value in enumerate(values):
+            if is_ranked(fipscodes[position], value):
+                groups.setdefault((years[position], state_ids[position]), []).append(position)
+
+        size = len(index)
+        self.national_ranks, self.state_ranks = array('I', [0]) * size, array('I', [0]) * size
+        self.national_percentiles, self.state_percentiles = array('d', [0.0]) * size, array('d', [0.0]) * size
+        self.orders, self.summaries = {}, {}
+        state_names = {state_id: state for state, state_id in index.states.items()}
+        nationals = {}
+        for (year, state_id), positions in groups.items():
+            nationals.setdefault(year, []).extend(positions)
+            self.add(year, state_names[state_id], positions, self.state_ranks, self.state_percentiles)
+        for year, positions in nationals.items():
+            positions.sort()
+            self.add(year, NATIONAL, positions, self.national_ranks, self.national_percentiles)
+
+    def add(self, year, scope, positions, ranks, percentiles):
+        """Sort a year and scope's positions, summarize them and fill in their ranks and percentiles"""
+        values = self.values
+        # Stable even reversed, so tied rows keep their order
+        order = sorted(positions, key=values.__getitem__, reverse=True)
+        self.orders[(year, scope)] = array('I', order)
+        self.summaries[(year, scope)] = summarize([values[position] for position in reversed(order)])
+
+        count = len(order)
+        start = 0
+        while start < count:
+            value = values[order[start]]
+            stop = start + 1
+            while stop < count and values[order[stop]] == value:
+                stop += 1
+            percentile = round(100 * (count - stop + (stop - start) / 2) / count, 2)
+            for position in order[start:stop]:
+                ranks[position] = start + 1
+                percentiles[position] = percentile
+            start = stop
+
+    def years(self):
+        """The data release years with ranked rows, oldest first"""
+        return sorted({year for year, scope in self.orders if scope is NATIONAL})
+
+    def states(self, year):
+        """The states with ranked rows in a year"""
+        return sorted(scope for ranked_year, scope in self.orders
+                      if ranked_year == year and scope is not NATIONAL)
+
+    def standing(self, position):
+        """A row's {'national': ..., 'state': ...} rank, count and percentile, or None if unranked"""
+        rank = self.national_ranks[position]
+        if not rank:
+            return None
+        year = self.index.years[position]
+        state = self.index.column('state', [position])[0] or ''
+        return {
+            'national': {'rank': rank, 'count': len(self.orders[(year, NATIONAL)]),
+                         'percentile': self.national_percentiles[position]},
+            'state': {'rank': self.state_ranks[position], 'count': len(self.orders[(year, state)]),
+                      'percentile': self.state_percentiles[position]},
+        }
+
+    def top(self, year, state=NATIONAL, limit=10, bottom=False):
+        """Positions of the limit highest raw_values (lowest with bottom) in a year and scope"""
+        order = self.orders.get((year, state), ())
+        if bottom:
+            return list(reversed(order[-limit:])) if limit else []
+        return list(order[:limit])
+
+    def summary(self, year, state=NATIONAL):
+        """count, mean, median, min and max of raw_value in a year and scope, or None"""
+        return self.summaries.get((year, state))
@@ -0,0 +1,136 @@
+"""
+Table definitions shared by the County Health API loaders
+api/county_data.py, api/load_data.py and csv_to_sqlite.py all load the two
+CSV files with these column types, lookup indexes and upsert keys, and
+parse numeric fields the same way. Kept free of Flask so the standalone
+scripts can import it.
+"""
+
+import hashlib
+import json
+
+# Declared column types; anything not listed is TEXT. Codes such as zip,
+# fipscode, county_code and year_span stay TEXT so leading zeros and ranges
+# survive. NUMERIC keeps whole numbers as INTEGER and the rest as REAL.
+TABLE_SCHEMAS = {
+    'zip_county': {
+        'zip_pop': 'INTEGER',
+        'zip_pop_in_county': 'NUMERIC',
+        'n_counties': 'INTEGER',
+    },
+    'county_health_rankings': {
+        'numerator': 'NUMERIC',
+        'denominator': 'NUMERIC',
+        'raw_value': 'NUMERIC',
+        'confidence_interval_lower_bound': 'NUMERIC',
+        'confidence_interval_upper_bound': 'NUMERIC',
+        'data_release_year': 'INTEGER',
+    },
+}
+
+# Lookup indexes created once a table is loaded, as (name, columns).
+# The zip index covers every column get_county_from_zip selects; health
+# rows are looked up by FIPS code.
+TABLE_INDEXES = {
+    'zip_county': [
+        ('idx_zip_county_zip', 'zip, county, state_abbreviation, county_code'),
+    ],
+    'county_health_rankings': [
+        ('idx_health_fipscode_measure', 'fipscode, measure_name'),
+    ],
+}
+
+# Columns identifying a row across data releases. An incremental update
+# replaces every row whose key gained, lost or changed a row.
+UPSERT_KEYS = {
+    'zip_county': ('zip', 'county_code'),
+    'county_health_rankings': ('fipscode', 'measure_id', 'year_span'),
+}
+
+# Health rows keep the CSV text of any numeric field that the parsed number
+# would not render back as ("77.0", "0.10", "1.5E-3") in this TEXT column, a
+# JSON object of column name -> text; NULL when every field renders as
+# written. Untyped answers return that text (see serialization.render_row).
+NUMERIC_TEXT_COLUMN = 'numeric_text'
+NUMERIC_TEXT_TABLES = ('county_health_rankings',)
+
+def csv_columns(table_name, headers, typed=True):
+    """(column definitions, {position: name} of the numeric columns, whether the text is kept) for CSV headers.
+
+    Untyped loads declare every column TEXT and keep the fields as written.
+    """
+    schema = TABLE_SCHEMAS.get(table_name, {}) if typed else {}
+    columns = [f"{header} {schema.get(header, 'TEXT')}" for header in headers]
+    keep_text = bool(schema) and table_name in NUMERIC_TEXT_TABLES
+    if keep_text:
+        columns.append(f"{NUMERIC_TEXT_COLUMN} TEXT")
+    return columns, {i: header for i, header in enumerate(headers) if header in schema}, keep_text
+
+def parse_number(value):
+    """Convert a CSV field to int or float; empty strings become None"""
+    if value == '':
+        return None
+    try:
+        # Most fields are decimals; skip the failing int() call for them
+        return float(value) if '.' in value else int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        # Leave anything unparseable as text rather than dropping it
+        return value
+
+def stored_text(number):
+    """The text a parsed field renders as once a NUMERIC column has stored it (77.0 -> "77")"""
+    if number is None:
+        return ''
+    if isinstance(number, float) and number.is_integer() and abs(number) < 2 ** 63:
+        number = int(number)
+    return str(number)
+
+# Encodes NUMERIC_TEXT_COLUMN values; built once, as json.dumps with options builds one per call
+_text_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+def parse_numbers(row, numeric_columns, keep_text):
+    """Parse a CSV row's numeric fields in place; with keep_text, append its NUMERIC_TEXT_COLUMN value"""
+    if not keep_text:
+        for i in numeric_columns:
+            row[i] = parse_number(row[i])
+        return row
+    texts = None
+    for i, name in numeric_columns.items():
+        text = row[i]
+        # Inline parse_number's decimal case and skip stored_text for the
+        # fields that plainly render as written: decimals whose repr is
+        # the text, canonical ints, empty and unparseable fields
+        if '.' in text:
+            try:
+                row[i] = number = float(text)
+            except ValueError:
+                row[i] = number = parse_number(text)
+            else:
+                if repr(number) == text and not number.is_integer():
+                    continue
+        else:
+            row[i] = number = parse_number(text)
+            kind = number.__class__
+            if kind is int:
+                if repr(number) == text:
+                    continue
+            elif kind is not float:
+                continue
+        if stored_text(number) != text:
+            if texts is None:
+                texts = {}
+            texts[name] = text
+    row.append(_text_encoder.encode(texts) if texts else None)
+    return row
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
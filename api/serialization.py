@@ -0,0 +1,109 @@
+"""
+JSON serialization for the County Health API
+Bodies are JSON with sorted keys, compact separators and non-ASCII
+characters escaped, byte for byte what Flask's jsonify sends. orjson is
+used when installed and the standard library json otherwise; orjson's
+output is escaped to match, and bodies whose floats it writes differently
+are encoded by the standard library.
+
+Rows that never change between requests can be encoded once (at snapshot
+build time, or once per batch) and spliced into a larger body as a
+Fragment instead of being encoded again.
+"""
+
+import json
+import re
+
+from api.schema import NUMERIC_TEXT_COLUMN
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the standard library
+    orjson = None
+
+_stdlib_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+def stdlib_dumps(obj):
+    """Encode obj with the standard library json module"""
+    return _stdlib_encoder.encode(obj).encode('ascii')
+
+# orjson always writes UTF-8; outside strings JSON is ASCII, so any
+# non-ASCII character is escaped in place
+_non_ascii = re.compile('[^\x00-\x7f]')
+
+def _escape_non_ascii(match):
+    return json.encoder.encode_basestring_ascii(match.group())[1:-1]
+
+# Floats orjson spells unlike repr: with an exponent (1e16 for 1e+16,
+# 1e-7 for 1e-07) or without one below 1e-4 (0.00001 for 1e-05). Such
+# text inside a string only costs a needless fallback.
+_orjson_exponent = re.compile(rb'e[-\d]')
+
+def orjson_dumps(obj):
+    """Encode obj with orjson, giving the standard library's bytes"""
+    data = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    if b'0.0000' in data or _orjson_exponent.search(data):
+        return stdlib_dumps(obj)
+    if not data.isascii():
+        data = _non_ascii.sub(_escape_non_ascii, data.decode('utf-8')).encode('ascii')
+    return data
+
+ENCODER = 'orjson' if orjson is not None else 'json'
+dumps = orjson_dumps if orjson is not None else stdlib_dumps
+
+# Decodes what dumps wrote, from bytes
+loads = orjson.loads if orjson is not None else json.loads
+
+class Fragment(bytes):
+    """Already-encoded JSON that encode() splices in verbatim"""
+
+    __slots__ = ()
+
+# Values encode() has to look inside for fragments
+_CONTAINERS = (dict, list, Fragment)
+
+def encode(obj):
+    """Encode obj like dumps, splicing in any Fragment it contains.
+
+    Containers holding no other container are handed to dumps whole, so
+    only the levels above the fragments are assembled here.
+    """
+    if isinstance(obj, Fragment):
+        return obj
+    if isinstance(obj, dict):
+        if not any(isinstance(value, _CONTAINERS) for value in obj.values()):
+            return dumps(obj)
+        return b'{' + b','.join(dumps(key) + b':' + encode(obj[key]) for key in sorted(obj)) + b'}'
+    if isinstance(obj, list):
+        if not any(isinstance(item, _CONTAINERS) for item in obj):
+            return dumps(obj)
+        return b'[' + b','.join(encode(item) for item in obj) + b']'
+    return dumps(obj)
+
+def render_value(value):
+    """Render a stored value as the TEXT-only tables used to return it"""
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+def render_row(row, typed):
+    """Return a row with real numbers (typed) or all-string values.
+
+    Untyped, numeric fields come back as written in the CSV where the row
+    kept their text (see schema.NUMERIC_TEXT_COLUMN), which is never returned.
+    """
+    if typed:
+        if NUMERIC_TEXT_COLUMN not in row:
+            return row
+        return {name: value for name, value in row.items() if name != NUMERIC_TEXT_COLUMN}
+    rendered = {name: render_value(value) for name, value in row.items()}
+    texts = rendered.pop(NUMERIC_TEXT_COLUMN, None)
+    if texts:
+        rendered.update(loads(texts))
+    return rendered
+
+def encode_rows(rows, typed):
+    """Encode a group of health rows as a JSON array Fragment"""
+    return Fragment(dumps([render_row(row, typed) for row in rows]))
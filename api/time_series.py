@@ -0,0 +1,71 @@
+"""
+Time series of one county's health rows for a measure
+The rows become parallel arrays ordered by (data_release_year, year_span),
+with the change in raw_value from each entry to the next and the
+least-squares slope of raw_value per data release year. api/load_data.py
+precomputes the encoded series of every county and measure into the
+snapshot; other backends build them from the rows on request.
+"""
+
+from api.serialization import Fragment, dumps, render_row, render_value
+
+# Series array -> the health column it is read from
+SERIES_COLUMNS = {
+    'years': 'data_release_year',
+    'year_spans': 'year_span',
+    'values': 'raw_value',
+    'ci_lower': 'confidence_interval_lower_bound',
+    'ci_upper': 'confidence_interval_upper_bound',
+}
+
+# Deltas and slopes are rounded to this many decimal places, dropping
+# the float noise of subtracting values that were stored rounded
+SERIES_DIGITS = 10
+
+def is_number(value):
+    """Check for an int or float that is not a bool"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def series_order(row):
+    """Sort key of a row in a series; NULLs first"""
+    return (row['data_release_year'] or 0, row['year_span'] or '')
+
+def slope(years, values):
+    """Least-squares slope of values per year over the numeric pairs, or None"""
+    points = [(year, value) for year, value in zip(years, values) if is_number(year) and is_number(value)]
+    if len({year for year, _ in points}) < 2:
+        return None
+    mean_year = sum(year for year, _ in points) / len(points)
+    mean_value = sum(value for _, value in points) / len(points)
+    covariance = sum((year - mean_year) * (value - mean_value) for year, value in points)
+    variance = sum((year - mean_year) ** 2 for year, _ in points)
+    return round(covariance / variance, SERIES_DIGITS)
+
+def time_series(county, state, measure_name, rows):
+    """The time series record of one county's rows for a measure"""
+    rows = sorted(rows, key=series_order)
+    record = {'county': county, 'state': state, 'measure_name': measure_name}
+    for name, column in SERIES_COLUMNS.items():
+        record[name] = [row[column] for row in rows]
+    values = record['values']
+    # Change from the previous entry; null for the first and next to missing values
+    record['deltas'] = [round(value - previous, SERIES_DIGITS) if is_number(value) and is_number(previous) else None
+                        for previous, value in zip([None] + values, values)]
+    record['slope'] = slope(record['years'], values)
+    return record
+
+def render_series(record, rows, typed):
+    """Return a series record of rows with real numbers (typed) or all-string values"""
+    if typed:
+        return record
+    rendered = {name: [render_value(item) for item in value] if isinstance(value, list) else render_value(value)
+                for name, value in record.items() if name not in SERIES_COLUMNS}
+    # Values read from the rows are rendered as the rows are, in their CSV text
+    rows = [render_row(row, False) for row in sorted(rows, key=series_order)]
+    for name, column in SERIES_COLUMNS.items():
+        rendered[name] = [row[column] for row in rows]
+    return rendered
+
+def encode_series(county, state, measure_name, rows, typed):
+    """Encode the time series of a group of health rows as a Fragment"""
+    return Fragment(dumps(render_series(time_series(county, state, measure_name, rows), rows, typed)))
@@ -0,0 +1,168 @@
+"""
+Compact zip code index for the County Health API
+Every row of zip_county as three parallel arrays sorted by zip: the zip as
+an unsigned int (see zip_key), a county id and the county's share of the zip population.
+A lookup is a binary search. The arrays serialize to bytes for the snapshot,
+so loading the index is a copy rather than a query over every row.
+
+Counties are read through the zip_counties view, which names them as the
+health rows do (joined on integer FIPS code). The reverse index from FIPS
+code to zips is built from the same arrays on first use.
+"""
+
+import json
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Selects the rows from_rows expects, in the order it expects them
+ZIP_ROWS_SQL = """
+    SELECT zip, county, state_abbreviation, county_code, COALESCE(zip_pop_in_county, 0)
+    FROM zip_counties
+    ORDER BY zip, county, state_abbreviation, county_code
+"""
+
+def zip_key(zip_code):
+    """The integer a zip code is indexed under, or None if it cannot be.
+
+    A leading 1 keeps leading zeros apart ("02138" -> 102138, "2138" ->
+    12138); codes of up to 9 digits fit an unsigned 32-bit int.
+    """
+    if not isinstance(zip_code, str) or not zip_code.isascii() or not zip_code.isdigit() \
+            or len(zip_code) > 9:
+        return None
+    return int('1' + zip_code)
+
+# SQL condition matching the codes fips_key accepts: 1 to 5 ASCII digits
+IS_FIPS_SQL = "({column} GLOB '[0-9]*' AND {column} NOT GLOB '*[^0-9]*' AND length({column}) <= 5)"
+
+def fips_key(fipscode):
+    """The integer a FIPS county code is indexed under ("01001" and "1001" -> 1001), or None"""
+    if not isinstance(fipscode, str) or not fipscode.isascii() or not fipscode.isdigit() \
+            or len(fipscode) > 5:
+        return None
+    return int(fipscode)
+
+def fips_codes(fips):
+    """Every text code fips_key reads as fips, shortest first (1001 -> ["1001", "01001"])"""
+    code = str(fips)
+    return [code.zfill(width) for width in range(len(code), 6)]
+
+class ZipIndex:
+    """Sorted integer zip codes with parallel county ids and weights.
+
+    counties maps a county id to (county, state, county_code). Rows of the
+    same zip keep (county, state, county_code) order, so the first one is
+    the county ZIP_SQL picks. fips_index, built by zips_for_fips, holds
+    every row's FIPS code and zip as two arrays sorted by FIPS code.
+    """
+
+    __slots__ = ('zips', 'county_ids', 'weights', 'counties', 'fips_index', 'fips_lock')
+
+    def __init__(self, zips, county_ids, weights, counties):
+        self.zips = zips
+        self.county_ids = county_ids
+        self.weights = weights
+        self.counties = counties
+        self.fips_index = None
+        self.fips_lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the index from (zip, county, state, county_code, weight) rows in ZIP_ROWS_SQL order"""
+        counties, ids, entries = [], {}, []
+        for zip_code, county, state, county_code, weight in rows:
+            key = zip_key(zip_code)
+            # Zips that are not numbers cannot be requested
+            if key is None:
+                continue
+            county_info = (county, state, county_code)
+            county_id = ids.get(county_info)
+            if county_id is None:
+                county_id = ids[county_info] = len(counties)
+                counties.append(county_info)
+            entries.append((key, county_id, float(weight)))
+        # Text order differs from numeric order when zips differ in length;
+        # the sort is stable, so each zip's rows keep their order
+        entries.sort(key=lambda entry: entry[0])
+        return cls(array('I', [entry[0] for entry in entries]), array('I', [entry[1] for entry in entries]),
+                   array('d', [entry[2] for entry in entries]), counties)
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Build the index from a database's zip_counties view"""
+        return cls.from_rows(conn.execute(ZIP_ROWS_SQL))
+
+    def to_row(self):
+        """(byteorder, zips, county_ids, weights, counties) for storing in a table"""
+        return (sys.byteorder, self.zips.tobytes(), self.county_ids.tobytes(), self.weights.tobytes(),
+                json.dumps(self.counties))
+
+    @classmethod
+    def from_row(cls, row):
+        """Rebuild an index stored with to_row"""
+        byteorder, zips, county_ids, weights, counties = row
+        arrays = array('I', zips), array('I', county_ids), array('d', weights)
+        if byteorder != sys.byteorder:
+            for values in arrays:
+                values.byteswap()
+        return cls(*arrays, [tuple(county_info) for county_info in json.loads(counties)])
+
+    def bounds(self, zip_code):
+        """(start, stop) of a zip's rows; empty when it is unknown"""
+        key = zip_key(zip_code)
+        if key is None:
+            return 0, 0
+        start = bisect_left(self.zips, key)
+        if start == len(self.zips) or self.zips[start] != key:
+            return start, start
+        return start, bisect_right(self.zips, key, start)
+
+    def county_for_zip(self, zip_code):
+        """Return (county, state, county_code) for a zip code, or None"""
+        start, stop = self.bounds(zip_code)
+        if start == stop:
+            return None
+        return self.counties[self.county_ids[start]]
+
+    def weighted_counties_for_zip(self, zip_code):
+        """Return [(county, state, county_code, weight)], heaviest first"""
+        start, stop = self.bounds(zip_code)
+        # Stable sort: equal weights keep (county, state, county_code) order
+        return sorted((self.counties[self.county_ids[i]] + (self.weights[i],) for i in range(start, stop)),
+                      key=lambda county_info: -county_info[3])
+
+    def multi_county_zips(self):
+        """The zip codes with rows for several counties, in zip order"""
+        zips = self.zips
+        # Drop the leading 1 zip_key adds
+        return [str(zips[i])[1:] for i in range(1, len(zips))
+                if zips[i] == zips[i - 1] and (i == 1 or zips[i - 2] != zips[i])]
+
+    def build_fips_index(self):
+        """(fips_keys, fips_zips): every row's FIPS code and zip, sorted by FIPS code"""
+        county_fips = [fips_key(county_code) or 0 for _, _, county_code in self.counties]
+        # Rows are in zip order, so the stable sort keeps each county's zips sorted
+        rows = sorted(((county_fips[county_id], key) for key, county_id in zip(self.zips, self.county_ids)),
+                      key=lambda row: row[0])
+        return array('I', [row[0] for row in rows]), array('I', [row[1] for row in rows])
+
+    def zips_for_fips(self, fips):
+        """Return the zip codes with any part in the county with an integer FIPS code, in zip order"""
+        fips_index = self.fips_index
+        if fips_index is None:
+            # Built once; both arrays are published together so no thread sees half of them
+            with self.fips_lock:
+                if self.fips_index is None:
+                    self.fips_index = self.build_fips_index()
+                fips_index = self.fips_index
+        fips_keys, fips_zips = fips_index
+        start = bisect_left(fips_keys, fips)
+        stop = bisect_right(fips_keys, fips, start)
+        # Drop the leading 1 zip_key adds; a zip listed twice for a county is given once
+        return [str(key)[1:] for key in dict.fromkeys(fips_zips[start:stop])]
+
+    def nbytes(self):
+        """Bytes held by the three arrays"""
+        return sum(values.itemsize * len(values) for values in (self.zips, self.county_ids, self.weights))
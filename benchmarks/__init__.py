@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the County Health API
+Run from the repository root, e.g. python -m benchmarks.bench_cold_start
+"""
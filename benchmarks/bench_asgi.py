@@ -0,0 +1,126 @@
+"""
+ASGI load test: requests/sec and p50/p99 latency of GET /county_data through
+the Flask WSGI app driven from a pool of client threads (a threaded server)
+versus the ASGI app driven from concurrent coroutines on one event loop.
+Both use an in-process stand-in client, so no server or sockets are needed.
+
+Usage: python -m benchmarks.bench_asgi [--requests N] [--concurrency N]
+                                       [--backend NAME] [--data-dir DIR]
+"""
+
+import argparse
+import asyncio
+import io
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import urlencode
+
+import api.asgi as asgi
+import api.county_data as county_data
+from api.cache import LRUCache
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset, sample_zips, summarize
+
+def wsgi_get(query):
+    """GET /county_data?query through the Flask WSGI app; return (status line, body)"""
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/county_data',
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    body = b''.join(county_data.app(environ, lambda line, headers, exc_info=None: status.append(line)))
+    return status[0], body
+
+async def asgi_get(query):
+    """GET /county_data?query through the ASGI app; return (status, body)"""
+    scope = {'type': 'http', 'method': 'GET', 'path': '/county_data',
+             'query_string': query.encode('latin-1'), 'headers': []}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.app(scope, receive, send)
+    return sent[0]['status'], sent[1]['body']
+
+def run_sync(queries, concurrency):
+    """Return (seconds, latencies) for queries spread over concurrency threads"""
+    def timed(query):
+        start = time.perf_counter()
+        wsgi_get(query)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(timed, queries))
+        return time.perf_counter() - start, latencies
+
+def run_async(queries, concurrency):
+    """Return (seconds, latencies) for queries spread over concurrency coroutines"""
+    async def client(pending, latencies):
+        for query in pending:
+            start = time.perf_counter()
+            await asgi_get(query)
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        pending, latencies = iter(queries), []
+        start = time.perf_counter()
+        await asyncio.gather(*(client(pending, latencies) for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies
+
+    return asyncio.run(main())
+
+CLIENTS = {
+    'sync (WSGI, threads)': run_sync,
+    'async (ASGI, loop)': run_async,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--backend', default='sqlite_pool', choices=sorted(county_data.BACKENDS))
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    build_snapshot(data_dir, county_data.get_snapshot_path(data_dir))
+    db = county_data.load_backend(data_dir, args.backend)
+
+    rng = random.Random(1060)
+    zips = sample_zips(data_dir, 2000)
+    measures = sorted(county_data.VALID_MEASURES)
+    queries = [urlencode({'zip': rng.choice(zips), 'measure_name': rng.choice(measures)})
+               for _ in range(args.requests)]
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, backend {args.backend}")
+    print(f"{'client':<22} {'cache':<6} {'req/s':>9} {'p50 us':>9} {'p99 us':>9}")
+    for cache_size in (county_data.CACHE_SIZE, 0):
+        for name, run in CLIENTS.items():
+            with mock.patch.object(county_data, '_db', db), \
+                    mock.patch.object(county_data, 'response_cache', LRUCache(cache_size)), \
+                    mock.patch.object(county_data, 'county_cache', LRUCache(cache_size)):
+                seconds, latencies = run(queries, args.concurrency)
+            stats = summarize(latencies)
+            print(f"{name:<22} {'on' if cache_size else 'off':<6} {len(queries) / seconds:>9.0f} "
+                  f"{stats['p50_ms'] * 1000:>9.0f} {stats['p99_ms'] * 1000:>9.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Backend microbenchmark: per-lookup latency and resident memory of the
+SQLite and in-memory storage backends, each measured in a fresh process.
+
+Usage: python -m benchmarks.bench_backends [--lookups N] [--data-dir DIR]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+from api.county_data import BASE_DIR, BACKENDS, get_snapshot_path
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset, sample_zips
+
+CHILD = """
+import json, sys
+from api.backends import county_fips
+from api.county_data import load_backend, get_county_from_zip, get_health_data
+from benchmarks.common import rss_bytes, summarize, time_calls
+
+data_dir, backend_name, zips = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+rss_before = rss_bytes()
+db = load_backend(data_dir, backend_name)
+rss_loaded = rss_bytes()
+
+pending = iter(zips)
+def lookup():
+    county_info = get_county_from_zip(next(pending), db)
+    get_health_data(county_fips(county_info), 'Adult obesity', db)
+
+stats = summarize(time_calls(lookup, len(zips)))
+stats['rss_mb'] = (rss_loaded - rss_before) / 1e6
+stats['rss_after_lookups_mb'] = (rss_bytes() - rss_before) / 1e6
+print(json.dumps(stats))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    build_snapshot(data_dir, get_snapshot_path(data_dir))
+    zips = json.dumps(sample_zips(data_dir, args.lookups))
+
+    print(f"{'backend':<8} {'p50 us':>8} {'p99 us':>8} {'load RSS MB':>12} {'RSS after MB':>13}")
+    for name in BACKENDS:
+        result = subprocess.run([sys.executable, '-c', CHILD, data_dir, name, zips],
+                                cwd=BASE_DIR, check=True, capture_output=True, text=True)
+        stats = json.loads(result.stdout)
+        print(f"{name:<8} {stats['p50_ms'] * 1000:>8.1f} {stats['p99_ms'] * 1000:>8.1f} "
+              f"{stats['rss_mb']:>12.1f} {stats['rss_after_lookups_mb']:>13.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Batch throughput benchmark: (zip, measure) pairs per second answered through
+/county_data one pair at a time versus a single /county_data/batch request.
+
+Usage: python -m benchmarks.bench_batch [--zips N] [--data-dir DIR]
+"""
+
+import argparse
+import json
+import tempfile
+import time
+
+import api.county_data as county_data
+from benchmarks.common import ensure_dataset, sample_zips
+
+def post(client, path, data):
+    return client.post(path, data=json.dumps(data), content_type='application/json')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--zips', type=int, default=2000)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    county_data.DATA_DIR = data_dir
+    county_data.reload_db()
+    client = county_data.app.test_client()
+
+    zips = sample_zips(data_dir, args.zips)
+    measures = sorted(county_data.VALID_MEASURES)
+    pairs = len(zips) * len(measures)
+
+    start = time.perf_counter()
+    for zip_code in zips:
+        for measure_name in measures:
+            post(client, '/county_data', {'zip': zip_code, 'measure_name': measure_name})
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = post(client, '/county_data/batch', {'zips': zips, 'measure_names': measures})
+    batch = time.perf_counter() - start
+    assert response.status_code == 200, response.data
+
+    print(f"{'mode':<8} {'requests':>9} {'seconds':>9} {'pairs/sec':>11}")
+    print(f"{'single':<8} {pairs:>9} {single:>9.2f} {pairs / single:>11.0f}")
+    print(f"{'batch':<8} {1:>9} {batch:>9.2f} {pairs / batch:>11.0f}")
+
+if __name__ == '__main__':
+    main()
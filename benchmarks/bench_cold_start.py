@@ -0,0 +1,89 @@
+"""
+Cold-start benchmark: time from a fresh process to the first answered lookup
+for each data source (raw CSV, optimize_data.py gzip JSON, prebuilt snapshot).
+
+Usage: python -m benchmarks.bench_cold_start [--runs N] [--data-dir DIR]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from api.county_data import BASE_DIR, get_snapshot_path
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset, summarize
+
+# Each snippet loads its source and answers one lookup, then prints the
+# in-process load time in seconds
+SOURCES = {
+    'csv': """
+import time; start = time.perf_counter()
+from api.backends import county_fips
+from api.county_data import load_csv_db, get_county_from_zip, get_health_data
+conn = load_csv_db({data_dir!r})
+county_info = get_county_from_zip('84102', conn)
+get_health_data(county_fips(county_info), 'Adult obesity', conn)
+print(time.perf_counter() - start)
+""",
+    'gzip_json': """
+import time; start = time.perf_counter()
+import gzip, json
+with gzip.open({gzip_path!r}, 'rt') as f:
+    data = json.load(f)
+info = data['zip_to_county']['84102']
+data['health_data'].get(f"{{info['county']}}|{{info['state']}}|Adult obesity")
+print(time.perf_counter() - start)
+""",
+    'snapshot': """
+import time; start = time.perf_counter()
+from api.backends import county_fips
+from api.county_data import open_snapshot, get_county_from_zip, get_health_data
+conn = open_snapshot({snapshot_path!r})
+county_info = get_county_from_zip('84102', conn)
+get_health_data(county_fips(county_info), 'Adult obesity', conn)
+print(time.perf_counter() - start)
+""",
+}
+
+def build_gzip_json(data_dir):
+    """Run optimize_data.py against data_dir and return the output path"""
+    subprocess.run([sys.executable, os.path.join(BASE_DIR, 'optimize_data.py')],
+                   cwd=data_dir, check=True, stdout=subprocess.DEVNULL)
+    return os.path.join(data_dir, 'api', 'optimized_data.json.gz')
+
+def run_source(code, runs):
+    """Run a snippet in fresh interpreters; return (process, load) latencies"""
+    process_times, load_times = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, check=True,
+                                capture_output=True, text=True)
+        process_times.append(time.perf_counter() - start)
+        load_times.append(float(result.stdout.strip().splitlines()[-1]))
+    return process_times, load_times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    params = {
+        'data_dir': data_dir,
+        'gzip_path': build_gzip_json(data_dir),
+        'snapshot_path': get_snapshot_path(data_dir),
+    }
+    build_snapshot(data_dir, params['snapshot_path'])
+
+    print(f"{'source':<12} {'load p50 ms':>12} {'process p50 ms':>15}")
+    for name, template in SOURCES.items():
+        process_times, load_times = run_source(template.format(**params), args.runs)
+        print(f"{name:<12} {summarize(load_times)['p50_ms']:>12.1f} "
+              f"{summarize(process_times)['p50_ms']:>15.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Ingest benchmark: rows/sec for csv_to_sqlite.py's sequential loader versus
+the parallel parse + single-writer fast path.
+
+Usage: python -m benchmarks.bench_ingest [--runs N] [--workers N] [--batch-size N] [--data-dir DIR]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.common import ensure_dataset
+from csv_to_sqlite import DEFAULT_BATCH_SIZE, create_table_from_csv, load_csvs_parallel
+
+CSV_NAMES = ['zip_county.csv', 'county_health_rankings.csv']
+
+def load_sequential(db_path, csv_paths, workers, batch_size):
+    """The original path: one table at a time on a default connection"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    for csv_path in csv_paths:
+        create_table_from_csv(cursor, csv_path, batch_size)
+    conn.commit()
+    rows = sum(conn.execute(f"SELECT COUNT(*) FROM {os.path.splitext(os.path.basename(path))[0]}")
+               .fetchone()[0] for path in csv_paths)
+    conn.close()
+    return rows
+
+def load_fast(db_path, csv_paths, workers, batch_size):
+    conn = sqlite3.connect(db_path)
+    rows = load_csvs_parallel(conn, csv_paths, workers, batch_size)
+    conn.close()
+    return rows
+
+LOADERS = {
+    'sequential': load_sequential,
+    'fast': load_fast,
+}
+
+def time_load(loader, csv_paths, workers, batch_size, runs):
+    """Return (rows, best seconds) over runs fresh databases"""
+    best, rows = None, 0
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='county_ingest_') as tmp_dir:
+            start = time.perf_counter()
+            rows = loader(os.path.join(tmp_dir, 'bench.db'), csv_paths, workers, batch_size)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return rows, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int, help='parser processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    csv_paths = [os.path.join(data_dir, name) for name in CSV_NAMES]
+
+    print(f"workers={args.workers or os.cpu_count()} batch_size={args.batch_size}")
+    print(f"{'loader':<12} {'rows':>9} {'seconds':>9} {'rows/sec':>11}")
+    for name, loader in LOADERS.items():
+        rows, seconds = time_load(loader, csv_paths, args.workers, args.batch_size, args.runs)
+        print(f"{name:<12} {rows:>9} {seconds:>9.2f} {rows / seconds:>11.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure export benchmark: time to build one measure's MeasureIndex from
+county_health_rankings, then the latency of /measures/<measure_name> for a
+full national export in each format, a filtered page and a walk through
+every page with keyset cursors.
+Also times computing the measure's MeasureRanking and a top-100 ranking.
+
+Usage: python -m benchmarks.bench_measures [--measure NAME] [--page-size N] [--data-dir DIR]
+"""
+
+import argparse
+import tempfile
+import time
+from unittest import mock
+from urllib.parse import quote
+
+import api.county_data as county_data
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset
+
+def timed(func):
+    """Return (result, seconds) for func()"""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--measure', default='Adult obesity')
+    parser.add_argument('--page-size', type=int, default=5000)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    build_snapshot(data_dir, county_data.get_snapshot_path(data_dir))
+    db = county_data.load_backend(data_dir, 'sqlite')
+
+    index, index_seconds = timed(lambda: db.measure_index(args.measure))
+    print(f"{len(index)} rows for {args.measure}; index built in {index_seconds * 1000:.0f} ms")
+    _, ranking_seconds = timed(lambda: db.measure_ranking(args.measure))
+    print(f"MeasureRanking over {len(index)} rows {ranking_seconds * 1000:.0f} ms")
+
+    path = '/measures/' + quote(args.measure)
+    client = county_data.app.test_client()
+    state = index.column('state', [len(index) // 2])[0]
+    requests = [
+        ('full export, NDJSON', '?format=ndjson'),
+        ('full export, NDJSON typed', '?format=ndjson&typed=true'),
+        ('full export, CSV', '?format=csv'),
+        (f'JSON page of {args.page_size}', f'?limit={args.page_size}'),
+        (f'state={state}, one year', f'?state={state}&year={index.years[len(index) // 2]}'),
+        ('top 100 by raw_value', '/rankings?limit=100'),
+    ]
+    print(f"{'request':<28} {'rows/s':>10} {'MB':>7} {'ms':>8}")
+    with mock.patch.object(county_data, '_db', db):
+        for name, query in requests:
+            # Streamed bodies are rendered as they are read
+            body, seconds = timed(lambda: client.get(path + query).data)
+            rows = body.count(b'\n') - (1 if 'csv' in query else 0)
+            if 'format=' not in query:
+                rows = body.count(b'"fipscode"')
+            print(f"{name:<28} {rows / seconds:>10.0f} {len(body) / 1e6:>7.2f} {seconds * 1000:>8.1f}")
+
+        def walk():
+            cursor, pages = '', 0
+            while True:
+                response = client.get(f"{path}?limit={args.page_size}" + (f"&cursor={cursor}" if cursor else ''))
+                pages += 1
+                cursor = response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    return pages
+        pages, seconds = timed(walk)
+        print(f"{'every page, keyset cursor':<28} {len(index) / seconds:>10.0f} {'':>7} {seconds * 1000:>8.1f}"
+              f"  ({pages} pages)")
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Prebuilt-fragment benchmark: space and latency of serving /county_data with
+the untyped rows of the N most populous counties pre-encoded into the
+snapshot's health_fragments table (one query, raw bytes) and every other
+county's rows looked up and serialized per request, for several N, across
+every zip x measure.
+
+Usage: python -m benchmarks.bench_prebuilt [--lookups N] [--counties N,N,...] [--data-dir DIR]
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+from unittest import mock
+
+import api.county_data as county_data
+from api import load_data
+from api.backends import FRAGMENTS_TABLE
+from api.cache import LRUCache
+from benchmarks.common import ensure_dataset, summarize, time_calls
+
+def table_sizes(snapshot_path):
+    """{table or index: bytes}, when SQLite was built with dbstat"""
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        return dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+def lookup_latency(db, lookups):
+    """p50/p99 of county_data_body with both response caches disabled"""
+    pending = itertools.cycle(lookups)
+    with mock.patch.object(county_data, '_db', db), \
+            mock.patch.object(county_data, 'response_cache', LRUCache(0)), \
+            mock.patch.object(county_data, 'county_cache', LRUCache(0)):
+        return summarize(time_calls(lambda: county_data.county_data_body(*next(pending)), len(lookups)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--counties', default=f'0,100,{load_data.PREBUILT_COUNTIES},100000',
+                        help='comma-separated numbers of prebuilt counties to compare')
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    snapshot_path = county_data.get_snapshot_path(data_dir)
+
+    rng = random.Random(1060)
+    measures = sorted(county_data.VALID_MEASURES)
+    lookups = None
+
+    print(f"{'prebuilt counties':>17} {'p50 us':>8} {'p99 us':>8} {'fragments MB':>13} {'snapshot MB':>12}")
+    for counties in map(int, args.counties.split(',')):
+        with mock.patch.object(load_data, 'PREBUILT_COUNTIES', counties):
+            load_data.build_snapshot(data_dir, snapshot_path)
+        db = county_data.load_backend(data_dir, 'sqlite')
+        if lookups is None:
+            # Requests come from zips, so counties with more zips are asked for more
+            with db.connection() as conn:
+                zips = [zip_code for zip_code, in conn.execute("SELECT DISTINCT zip FROM zip_county ORDER BY zip")]
+            lookups = [(rng.choice(zips), rng.choice(measures)) for _ in range(args.lookups)]
+        stats = lookup_latency(db, lookups)
+        db.close()
+        fragments = table_sizes(snapshot_path).get(FRAGMENTS_TABLE, 0)
+        print(f"{counties:>17} {stats['p50_ms'] * 1000:>8.1f} {stats['p99_ms'] * 1000:>8.1f} "
+              f"{fragments / 1e6:>13.1f} {os.path.getsize(snapshot_path) / 1e6:>12.1f}")
+
+if __name__ == '__main__':
+    main()
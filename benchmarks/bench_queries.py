@@ -0,0 +1,51 @@
+"""
+Query benchmark: zip and health lookup latency on the full dataset with
+no indexes (table scans), with lookup indexes, and with the clustered layout.
+
+Usage: python -m benchmarks.bench_queries [--lookups N] [--data-dir DIR]
+"""
+
+import argparse
+import tempfile
+
+from api.backends import county_fips
+from api.county_data import get_county_from_zip, get_health_data, load_csv_db
+from benchmarks.common import ensure_dataset, sample_zips, summarize, time_calls
+
+LAYOUTS = {
+    'scan': {'indexed': False},
+    'indexed': {'indexed': True},
+    'clustered': {'indexed': True, 'clustered': True},
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    zips = sample_zips(data_dir, args.lookups)
+
+    print(f"{'layout':<10} {'zip p50 ms':>11} {'zip p99 ms':>11} {'health p50 ms':>14} {'health p99 ms':>14}")
+    for name, options in LAYOUTS.items():
+        conn = load_csv_db(data_dir, **options)
+        pending_zips = iter(zips)
+        counties = []
+
+        def zip_lookup():
+            counties.append(get_county_from_zip(next(pending_zips), conn))
+
+        zip_stats = summarize(time_calls(zip_lookup, len(zips)))
+        pending_counties = iter(counties)
+
+        def health_lookup():
+            get_health_data(county_fips(next(pending_counties)), 'Adult obesity', conn)
+
+        health_stats = summarize(time_calls(health_lookup, len(counties)))
+        conn.close()
+        print(f"{name:<10} {zip_stats['p50_ms']:>11.3f} {zip_stats['p99_ms']:>11.3f} "
+              f"{health_stats['p50_ms']:>14.3f} {health_stats['p99_ms']:>14.3f}")
+
+if __name__ == '__main__':
+    main()
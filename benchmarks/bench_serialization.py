@@ -0,0 +1,94 @@
+"""
+Serialization benchmark: time to turn the largest (county, measure) result
+sets into response bytes with Flask's json provider (the old path), the
+standard library encoder, orjson (when installed) and the snapshot's
+pre-encoded fragments, where the group has one. Rows are fetched once up front, so the encoders are
+timed alone; the fragment path is timed from the query that reads it.
+
+Usage: python -m benchmarks.bench_serialization [--groups N] [--repeat N] [--data-dir DIR]
+"""
+
+import argparse
+import tempfile
+
+import api.county_data as county_data
+from api import serialization
+from api.load_data import build_snapshot
+from api.serialization import render_row
+from api.zip_index import IS_FIPS_SQL
+from benchmarks.common import ensure_dataset, summarize, time_calls
+
+def largest_groups(db, count):
+    """The count (FIPS code, measure_name) groups with the most rows"""
+    with db.connection() as conn:
+        return conn.execute(f"""
+            SELECT CAST(fipscode AS INTEGER) AS fips, measure_name
+            FROM county_health_rankings
+            WHERE {IS_FIPS_SQL.format(column='fipscode')}
+            GROUP BY fips, measure_name
+            ORDER BY COUNT(*) DESC, fips, measure_name
+            LIMIT ?
+        """, (count,)).fetchall()
+
+def encoders():
+    """{name: rows -> bytes} for every encoder available here"""
+    found = {
+        'flask app.json': lambda rows: (county_data.app.json.dumps(rows) + '\n').encode('utf-8'),
+        'stdlib json': lambda rows: serialization.stdlib_dumps(rows) + b'\n',
+    }
+    if serialization.orjson is not None:
+        found['orjson'] = lambda rows: serialization.orjson_dumps(rows) + b'\n'
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--groups', type=int, default=50, help='largest result sets to encode')
+    parser.add_argument('--repeat', type=int, default=200, help='encodings per group and path')
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    build_snapshot(data_dir, county_data.get_snapshot_path(data_dir))
+    db = county_data.load_backend(data_dir, 'sqlite')
+
+    groups = largest_groups(db, args.groups)
+    rows = [db.health_rows(*group) for group in groups]
+    print(f"{len(groups)} largest result sets, {min(map(len, rows))}-{max(map(len, rows))} rows each, "
+          f"default encoder: {serialization.ENCODER}")
+    print(f"{'path':<24} {'rows':<7} {'p50 us':>8} {'p99 us':>8} {'KB':>6}")
+
+    for typed in (False, True):
+        label = 'typed' if typed else 'text'
+        for name, encoder in encoders().items():
+            latencies = []
+            for group_rows in rows:
+                latencies += time_calls(lambda: encoder([render_row(row, typed) for row in group_rows]),
+                                        args.repeat)
+            stats = summarize(latencies)
+            size = sum(len(encoder([render_row(row, typed) for row in group_rows])) for group_rows in rows)
+            print(f"{name:<24} {label:<7} {stats['p50_ms'] * 1000:>8.1f} {stats['p99_ms'] * 1000:>8.1f} "
+                  f"{size / len(rows) / 1000:>6.1f}")
+
+        # Only the untyped rows of the most populous counties are prebuilt
+        prebuilt = [group for group in groups if db.prebuilt_rows(*group, typed) is not None]
+        if prebuilt:
+            latencies = []
+            for group in prebuilt:
+                latencies += time_calls(lambda: county_data.json_body(db.prebuilt_rows(*group, typed)),
+                                        args.repeat)
+            stats = summarize(latencies)
+            size = sum(len(db.prebuilt_rows(*group, typed)) + 1 for group in prebuilt)
+            print(f"{'prebuilt fragment':<24} {label:<7} {stats['p50_ms'] * 1000:>8.1f} "
+                  f"{stats['p99_ms'] * 1000:>8.1f} {size / len(prebuilt) / 1000:>6.1f}")
+
+        # For scale: reading the same rows as dicts, before any encoding
+        latencies = []
+        for group in groups:
+            latencies += time_calls(lambda: db.health_rows(*group), args.repeat)
+        stats = summarize(latencies)
+        print(f"{'(row dicts only)':<24} {label:<7} {stats['p50_ms'] * 1000:>8.1f} "
+              f"{stats['p99_ms'] * 1000:>8.1f}")
+    db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Time series benchmark: latency and body size of /county_data?series=true
+served from the records the snapshot precomputes for its most populous
+counties versus building the record from the rows per request, next to the plain rows answer a chart
+would otherwise sort and parse client-side.
+
+Usage: python -m benchmarks.bench_series [--lookups N] [--data-dir DIR]
+"""
+
+import argparse
+import itertools
+import random
+import tempfile
+from unittest import mock
+
+import api.county_data as county_data
+from api.backends import county_fips
+from api.cache import LRUCache
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset, sample_zips, summarize, time_calls
+
+def lookup_latency(db, body, lookups):
+    """p50/p99 of body(zip, measure) with both response caches disabled"""
+    pending = itertools.cycle(lookups)
+    with mock.patch.object(county_data, '_db', db), \
+            mock.patch.object(county_data, 'response_cache', LRUCache(0)), \
+            mock.patch.object(county_data, 'county_cache', LRUCache(0)):
+        return summarize(time_calls(lambda: body(*next(pending)), len(lookups)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=5000)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    build_snapshot(data_dir, county_data.get_snapshot_path(data_dir))
+    prebuilt = county_data.load_backend(data_dir, 'sqlite')
+    from_rows = county_data.load_backend(data_dir, 'sqlite')
+    # Hide the precomputed records so series are built from the rows
+    from_rows.prebuilt_series = lambda fips, measure_name, typed=False: None
+
+    rng = random.Random(1060)
+    measures = sorted(county_data.VALID_MEASURES)
+    # Only the most populous counties have precomputed records
+    zips = [zip_code for zip_code in sample_zips(data_dir, args.lookups * 10)
+            if prebuilt.prebuilt_series(county_fips(prebuilt.county_for_zip(zip_code)), measures[0])]
+    lookups = [(zip_code, rng.choice(measures)) for zip_code in zips[:args.lookups]]
+
+    print(f"{'path':<26} {'p50 us':>8} {'p99 us':>8} {'bytes':>8}")
+    for name, db, body in (('series, precomputed', prebuilt, county_data.series_county_data_body),
+                           ('series, built from rows', from_rows, county_data.series_county_data_body),
+                           ('rows', prebuilt, county_data.county_data_body)):
+        stats = lookup_latency(db, body, lookups)
+        with mock.patch.object(county_data, '_db', db):
+            size = sum(len(body(*lookup)[0]) for lookup in lookups[:500]) / min(500, len(lookups))
+        print(f"{name:<26} {stats['p50_ms'] * 1000:>8.1f} {stats['p99_ms'] * 1000:>8.1f} {size:>8.0f}")
+
+if __name__ == '__main__':
+    main()
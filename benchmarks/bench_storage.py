@@ -0,0 +1,68 @@
+"""
+Storage benchmark: memory used by the health data before (all-TEXT columns,
+tuple-per-row engine) and after (typed columns, columnar engine) on the full
+dataset. Each variant is loaded in a fresh process; SQLite size comes from
+page_count and the engine size from tracemalloc.
+
+Usage: python -m benchmarks.bench_storage [--data-dir DIR]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+from api.county_data import BASE_DIR
+from benchmarks.common import ensure_dataset
+
+CHILD = """
+import gc, json, sys, tracemalloc
+from api.county_data import load_csv_db
+from api.backends import MemoryBackend
+
+data_dir, variant = sys.argv[1], sys.argv[2]
+typed = variant.startswith('typed')
+
+conn = load_csv_db(data_dir, typed=typed)
+page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+db_bytes = conn.execute('PRAGMA page_count').fetchone()[0] * page_size
+
+tracemalloc.start()
+if variant == 'text_rows':
+    # The engine layout before typed storage: one tuple of strings per row
+    cursor = conn.execute('SELECT * FROM county_health_rankings')
+    engine = {}
+    for row in cursor:
+        row = tuple(sys.intern(value) for value in row)
+        engine.setdefault((row[1], row[0], row[5]), []).append(row)
+else:
+    engine = MemoryBackend.from_connection(conn)
+gc.collect()
+engine_bytes, peak_bytes = tracemalloc.get_traced_memory()
+print(json.dumps({'db_mb': db_bytes / 1e6, 'engine_mb': engine_bytes / 1e6,
+                  'peak_mb': peak_bytes / 1e6}))
+"""
+
+VARIANTS = {
+    'text_rows': 'all TEXT columns, tuple-per-row engine',
+    'typed_columnar': 'typed columns, columnar engine',
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+
+    print(f"{'variant':<16} {'SQLite MB':>10} {'engine MB':>10} {'load peak MB':>13}  description")
+    for name, description in VARIANTS.items():
+        result = subprocess.run([sys.executable, '-c', CHILD, data_dir, name],
+                                cwd=BASE_DIR, check=True, capture_output=True, text=True)
+        stats = json.loads(result.stdout)
+        print(f"{name:<16} {stats['db_mb']:>10.1f} {stats['engine_mb']:>10.1f} "
+              f"{stats['peak_mb']:>13.1f}  {description}")
+
+if __name__ == '__main__':
+    main()
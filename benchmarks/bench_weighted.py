@@ -0,0 +1,68 @@
+"""
+Multi-county benchmark: latency of all_counties and aggregate_only answers,
+whose population-weighted aggregates are computed at request time, next to
+the single-county lookup, over zips that span several counties.
+
+Usage: python -m benchmarks.bench_weighted [--lookups N] [--data-dir DIR]
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import random
+import tempfile
+
+from api.backends import counties_fips, county_fips, weighted_aggregates
+from api.county_data import VALID_MEASURES, get_snapshot_path, load_backend
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset, summarize, time_calls
+
+def multi_county_zips(data_dir, count, seed=1060):
+    """Return a deterministic sample of zips with n_counties > 1"""
+    with open(os.path.join(data_dir, 'zip_county.csv'), 'r', encoding='utf-8-sig') as f:
+        zips = sorted({row['zip'] for row in csv.DictReader(f) if row['n_counties'] not in ('', '1')})
+    return random.Random(seed).sample(zips, min(count, len(zips)))
+
+def single_county(db, zip_code, measure_name):
+    db.health_rows(county_fips(db.county_for_zip(zip_code)), measure_name)
+
+def all_counties(db, zip_code, measure_name):
+    weighted_counties = db.weighted_counties_for_zip(zip_code)
+    rows = db.health_rows_for_counties(counties_fips(weighted_counties), [measure_name])
+    weighted_aggregates(weighted_counties, itertools.chain.from_iterable(rows.values()))
+
+def request_time_aggregate(db, zip_code, measure_name):
+    weighted_counties = db.weighted_counties_for_zip(zip_code)
+    rows = db.iter_health_rows_for_counties(counties_fips(weighted_counties), [measure_name])
+    return weighted_aggregates(weighted_counties, rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    snapshot_path = get_snapshot_path(data_dir)
+    build_snapshot(data_dir, snapshot_path)
+    db = load_backend(data_dir, 'sqlite')
+
+    measures = sorted(VALID_MEASURES)
+    lookups = [(zip_code, measures[i % len(measures)])
+               for i, zip_code in enumerate(multi_county_zips(data_dir, args.lookups))]
+    modes = {
+        'single county': lambda zip_code, measure: single_county(db, zip_code, measure),
+        'all counties': lambda zip_code, measure: all_counties(db, zip_code, measure),
+        'aggregate only': lambda zip_code, measure: request_time_aggregate(db, zip_code, measure),
+    }
+
+    print(f"{len(lookups)} lookups over multi-county zips")
+    print(f"{'mode':<30} {'p50 us':>8} {'p99 us':>8}")
+    for name, func in modes.items():
+        pending = itertools.cycle(lookups)
+        stats = summarize(time_calls(lambda: func(*next(pending)), len(lookups)))
+        print(f"{name:<30} {stats['p50_ms'] * 1000:>8.1f} {stats['p99_ms'] * 1000:>8.1f}")
+
+if __name__ == '__main__':
+    main()
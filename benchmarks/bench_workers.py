@@ -0,0 +1,126 @@
+"""
+Multi-process benchmark: aggregate requests/sec and memory of the pre-forking
+launcher (api/prefork.py) as it scales from 1 worker to one per core. Each
+run starts the launcher on a free port, drives GET /county_data from
+--clients client processes for --seconds, and then sums RSS and PSS (RSS
+with shared pages split between the processes sharing them) over the parent
+and its workers, read from /proc (Linux). Clients run on the same machine,
+so they compete with the workers for the cores.
+
+Usage: python -m benchmarks.bench_workers [--max-workers N] [--clients N]
+                                          [--seconds S] [--backend NAME] [--data-dir DIR]
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode
+
+from api.county_data import BASE_DIR, DEFAULT_BACKEND, get_snapshot_path
+from api.load_data import build_snapshot
+from benchmarks.common import ensure_dataset, sample_zips
+
+def free_port():
+    """A TCP port nothing is listening on right now"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def get(port, query):
+    """GET /county_data?query; return the status"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', '/county_data?' + query)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+def wait_until_serving(port, timeout=300):
+    """Poll the launcher until it answers"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            get(port, urlencode({'zip': '00000', 'measure_name': 'Adult obesity'}))
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+def client(port, queries, seconds):
+    """Send queries round robin for seconds; return the number answered"""
+    answered = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        get(port, queries[answered % len(queries)])
+        answered += 1
+    return answered
+
+def process_tree(pid):
+    """pid and its children (Linux)"""
+    with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+        return [pid] + [int(child) for child in f.read().split()]
+
+def memory_kb(pid):
+    """(RSS, PSS) of a process in kB, from /proc/<pid>/smaps_rollup"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                values[name] = int(rest.split()[0])
+    return values['Rss'], values['Pss']
+
+def run(data_dir, backend, workers, clients, seconds, queries):
+    """Start the launcher with workers workers and load it; return (rps, rss MB, pss MB)"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), COUNTY_DATA_DIR=data_dir,
+               COUNTY_DATA_BACKEND=backend, COUNTY_DATA_WORKERS=str(workers))
+    launcher = subprocess.Popen([sys.executable, '-m', 'api.prefork'], cwd=BASE_DIR, env=env,
+                                stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(port)
+        # Every worker answers some requests before memory is measured
+        with ProcessPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, [port] * clients, [queries] * clients, [0.5] * clients))
+            start = time.perf_counter()
+            answered = sum(pool.map(client, [port] * clients, [queries] * clients, [seconds] * clients))
+            elapsed = time.perf_counter() - start
+        memory = [memory_kb(pid) for pid in process_tree(launcher.pid)]
+        return (answered / elapsed, sum(rss for rss, _ in memory) / 1024,
+                sum(pss for _, pss in memory) / 1024)
+    finally:
+        launcher.send_signal(signal.SIGTERM)
+        launcher.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--backend', default=DEFAULT_BACKEND)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    build_snapshot(data_dir, get_snapshot_path(data_dir))
+    queries = [urlencode({'zip': zip_code, 'measure_name': 'Adult obesity'})
+               for zip_code in sample_zips(data_dir, 2000)]
+
+    print(f"backend {args.backend}, {args.clients} clients, {args.seconds:g}s per run")
+    print(f"{'workers':>7} {'req/s':>8} {'total RSS MB':>13} {'total PSS MB':>13}")
+    for workers in range(1, args.max_workers + 1):
+        rps, rss_mb, pss_mb = run(data_dir, args.backend, workers, args.clients, args.seconds, queries)
+        print(f"{workers:>7} {rps:>8.0f} {rss_mb:>13.1f} {pss_mb:>13.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Zip index benchmark: memory, load time and lookup latency of resolving a zip
+to its county through a dict of dicts (as optimize_data.py builds), a dict of
+county tuples, the snapshot's zip_county table (ZIP_SQL) and the compact
+ZipIndex (sorted array('I') + bisect) loaded from the snapshot. Load times
+are taken under tracemalloc, so they only compare with each other.
+
+Usage: python -m benchmarks.bench_zip_index [--lookups N] [--data-dir DIR]
+"""
+
+import argparse
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import api.county_data as county_data
+from api.backends import ZIP_INDEX_TABLE, ZIP_SQL
+from api.load_data import build_snapshot
+from api.zip_index import ZIP_ROWS_SQL, ZipIndex
+from benchmarks.common import ensure_dataset, sample_zips, summarize, time_calls
+
+def dict_of_dicts(conn):
+    """{zip: {'county', 'state', 'county_code'}} for the first county of each zip"""
+    index = {}
+    for zip_code, county, state, county_code, _ in conn.execute(ZIP_ROWS_SQL):
+        index.setdefault(zip_code, {'county': county, 'state': state, 'county_code': county_code})
+    return index
+
+def dict_of_tuples(conn):
+    """{zip: (county, state, county_code)}, county tuples shared between zips"""
+    index, counties = {}, {}
+    for zip_code, county, state, county_code, _ in conn.execute(ZIP_ROWS_SQL):
+        county_info = counties.setdefault((county, state, county_code), (county, state, county_code))
+        index.setdefault(zip_code, county_info)
+    return index
+
+def load_zip_index(conn):
+    """The ZipIndex stored in the snapshot"""
+    return ZipIndex.from_row(conn.execute(f"SELECT * FROM {ZIP_INDEX_TABLE}").fetchone())
+
+def traced(build):
+    """Return (result, bytes allocated and still held, seconds) for build()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, held, seconds
+
+def sqlite_bytes(conn):
+    """Pages of zip_county and its indexes, when SQLite was built with dbstat"""
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = 'zip_county' "
+                            "OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'zip_county')"
+                            ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--data-dir', help='dataset directory (default: temporary copy)')
+    args = parser.parse_args()
+
+    data_dir = ensure_dataset(args.data_dir or tempfile.mkdtemp(prefix='county_bench_'))
+    snapshot_path = county_data.get_snapshot_path(data_dir)
+    build_snapshot(data_dir, snapshot_path)
+    conn = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    zips = sample_zips(data_dir, args.lookups)
+
+    by_dicts, dicts_bytes, dicts_seconds = traced(lambda: dict_of_dicts(conn))
+    by_tuples, tuples_bytes, tuples_seconds = traced(lambda: dict_of_tuples(conn))
+    zip_index, index_bytes, index_seconds = traced(lambda: load_zip_index(conn))
+    for zip_code in zips:
+        assert zip_index.county_for_zip(zip_code) == by_tuples.get(zip_code) == \
+            conn.execute(ZIP_SQL, (zip_code,)).fetchone()
+
+    def sql_lookup(zip_code):
+        return conn.execute(ZIP_SQL, (zip_code,)).fetchone()
+
+    paths = [
+        ('dict of dicts', by_dicts.get, dicts_bytes, dicts_seconds),
+        ('dict of tuples', by_tuples.get, tuples_bytes, tuples_seconds),
+        ('sqlite ZIP_SQL', sql_lookup, sqlite_bytes(conn), None),
+        ('ZipIndex (bisect)', zip_index.county_for_zip, index_bytes, index_seconds),
+    ]
+    print(f"{len(zip_index.zips)} zip rows, {len(zip_index.counties)} counties, "
+          f"{len(zips)} lookups; ZipIndex arrays: {zip_index.nbytes() / 1e6:.2f} MB")
+    print(f"{'index':<20} {'MB':>7} {'load ms':>8} {'p50 us':>8} {'p99 us':>8}")
+    for name, lookup, size, load_seconds in paths:
+        pending = iter(zips)
+        stats = summarize(time_calls(lambda: lookup(next(pending)), len(zips)))
+        size_text = f"{size / 1e6:.2f}" if size is not None else 'n/a'
+        load_text = f"{load_seconds * 1000:.1f}" if load_seconds is not None else '-'
+        print(f"{name:<20} {size_text:>7} {load_text:>8} {stats['p50_ms'] * 1000:>8.2f} "
+              f"{stats['p99_ms'] * 1000:>8.2f}")
+    conn.close()
+
+if __name__ == '__main__':
+    main()
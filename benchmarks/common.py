@@ -0,0 +1,85 @@
+"""
+Shared helpers for the benchmarks
+"""
+
+import csv
+import os
+import random
+import shutil
+import statistics
+import time
+
+from api.county_data import BASE_DIR, VALID_MEASURES
+
+HEALTH_HEADERS = ['State', 'County', 'State_code', 'County_code',
+                  'Year_span', 'Measure_name', 'Measure_id', 'Numerator',
+                  'Denominator', 'Raw_value', 'Confidence_Interval_Lower_Bound',
+                  'Confidence_Interval_Upper_Bound', 'Data_Release_Year', 'fipscode']
+
+def write_synthetic_health_csv(zip_csv, health_csv, years=('2019', '2020', '2021'), seed=1060):
+    """Write a county_health_rankings.csv covering every county in zip_csv"""
+    rng = random.Random(seed)
+    counties = {}
+    with open(zip_csv, 'r', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            counties[(row['county'], row['state_abbreviation'])] = row['county_code']
+
+    with open(health_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEALTH_HEADERS)
+        for (county, state), county_code in sorted(counties.items()):
+            fips = county_code.zfill(5)
+            for measure_id, measure in enumerate(sorted(VALID_MEASURES), start=1):
+                for year in years:
+                    denominator = rng.randint(1000, 1000000)
+                    numerator = rng.randint(0, denominator)
+                    raw_value = numerator / denominator
+                    writer.writerow([state, county, fips[:2], fips[2:], year, measure,
+                                     str(measure_id), str(numerator), str(denominator),
+                                     f"{raw_value:.6f}", f"{raw_value * 0.95:.6f}",
+                                     f"{raw_value * 1.05:.6f}", year, fips])
+
+def ensure_dataset(directory):
+    """Populate directory with the full zip_county.csv and a health CSV"""
+    os.makedirs(directory, exist_ok=True)
+    zip_csv = os.path.join(directory, 'zip_county.csv')
+    health_csv = os.path.join(directory, 'county_health_rankings.csv')
+    if not os.path.exists(zip_csv):
+        shutil.copyfile(os.path.join(BASE_DIR, 'zip_county.csv'), zip_csv)
+    if not os.path.exists(health_csv):
+        real_health_csv = os.path.join(BASE_DIR, 'county_health_rankings.csv')
+        if os.path.exists(real_health_csv):
+            shutil.copyfile(real_health_csv, health_csv)
+        else:
+            write_synthetic_health_csv(zip_csv, health_csv)
+    return directory
+
+def sample_zips(directory, count, seed=1060):
+    """Return a deterministic sample of zip codes from the dataset"""
+    with open(os.path.join(directory, 'zip_county.csv'), 'r', encoding='utf-8-sig') as f:
+        zips = sorted({row['zip'] for row in csv.DictReader(f)})
+    return random.Random(seed).sample(zips, min(count, len(zips)))
+
+def rss_bytes():
+    """Return the resident set size of this process in bytes (Linux)"""
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def time_calls(func, repeat):
+    """Call func repeat times and return per-call latencies in seconds"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def summarize(latencies):
+    """Summarize latencies (seconds) as milliseconds"""
+    ordered = sorted(latencies)
+    return {
+        'n': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+    }
@@ -0,0 +1,259 @@
+"""
+Synthetic dataset generator: writes zip_county.csv and county_health_rankings.csv
+at a multiple of real size for scaling tests, deterministically from a seed.
+
+Scale 1 is the real geography: every row of zip_county.csv, and every county in
+it x all 12 measures x --releases data releases. Scale N adds N-1 replicas of
+that geography. A replica suffixes county names and gives every zip and FIPS
+code a valid 5-digit code the source does not use: zips from the free zip
+codes, FIPS codes from states the source has no counties in. Each zip
+therefore keeps its counties and population weights, and the multi-county zip
+distribution is preserved exactly.
+
+The 5-digit code space bounds the scale. Free FIPS codes hold about 13
+replicas of the real counties; asking for more is an error. Free zips hold
+about one and a half replicas of the real zips, so later replicas leave out
+the zips that get no code: their counties still get health rows, which are
+looked up by FIPS code. Output is streamed row by row, so memory stays flat at
+any scale; --gzip writes .csv.gz files instead.
+
+Usage: python -m benchmarks.generate_dataset --out DIR [--scale N] [--seed N]
+                                             [--releases N] [--gzip]
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import random
+import sys
+import time
+
+from api.county_data import BASE_DIR, VALID_MEASURES
+from benchmarks.common import HEALTH_HEADERS
+
+# measure_name: (measure_id, kind, typical low, typical high, years per span).
+# kind is "rate" (a share of the population), "per_100k" (numerator per
+# 100,000 residents) or "level" (a plain value with no numerator/denominator).
+MEASURES = {
+    "Premature Death": (1, 'per_100k', 4500, 14000, 3),
+    "Preventable hospital stays": (5, 'per_100k', 1500, 6500, 1),
+    "Diabetic screening": (7, 'rate', 0.75, 0.92, 1),
+    "Adult obesity": (11, 'rate', 0.22, 0.45, 1),
+    "Unemployment": (23, 'rate', 0.02, 0.10, 1),
+    "Children in poverty": (24, 'rate', 0.05, 0.40, 1),
+    "Violent crime rate": (43, 'per_100k', 40, 900, 3),
+    "Sexually transmitted infections": (45, 'per_100k', 150, 900, 1),
+    "Mammography screening": (50, 'rate', 0.30, 0.55, 1),
+    "Physical inactivity": (70, 'rate', 0.15, 0.38, 1),
+    "Uninsured": (85, 'rate', 0.04, 0.25, 1),
+    "Daily fine particulate matter": (125, 'level', 4.0, 13.0, 1),
+}
+assert set(MEASURES) == VALID_MEASURES
+
+# Share of rows published without a value (suppressed small counts)
+MISSING_RATE = 0.02
+
+# Years between a release and the last year of data it reports
+RELEASE_LAG = 2
+
+def open_output(path, compress):
+    """Open a CSV for writing, gzip-compressed when asked"""
+    if compress:
+        return gzip.open(path + '.gz', 'wt', newline='', encoding='utf-8', compresslevel=6)
+    return open(path, 'w', newline='', encoding='utf-8')
+
+class ReplicaCodes:
+    """Maps each source zip or FIPS code to its code in every replica.
+
+    Replica r takes the r-th run of len(source codes) free codes, in
+    source code order, so the mapping never depends on row order.
+    """
+
+    def __init__(self, used, free):
+        self.index = {code: i for i, code in enumerate(sorted(used))}
+        self.free = free
+
+    def full_replicas(self):
+        """How many replicas get a code for every source code"""
+        return len(self.free) // len(self.index) if self.index else sys.maxsize
+
+    def code(self, code, replica):
+        """The code for a replica, the source code for replica 0, or None once free codes run out"""
+        if replica == 0:
+            return code
+        position = (replica - 1) * len(self.index) + self.index[code]
+        return self.free[position] if position < len(self.free) else None
+
+def free_zips(used):
+    """Every 5-digit zip code not in used, in order"""
+    return [code for code in (f"{number:05d}" for number in range(1, 100000)) if code not in used]
+
+def free_fips(used):
+    """Every 5-digit county FIPS code in a state no code in used belongs to, in order.
+
+    County parts run from 001 to 999; 000 is a state's own row.
+    """
+    states = {code[:2] for code in used}
+    return [f"{state:02d}{county:03d}" for state in range(1, 100) if f"{state:02d}" not in states
+            for county in range(1, 1000)]
+
+def replica_county(county, replica):
+    """County name for a replica, kept distinct so lookups by name do not merge"""
+    return county if replica == 0 else f"{county} {replica}"
+
+def read_zip_rows(zip_csv):
+    """Yield the header row of the source zip_county.csv, then each row, streamed"""
+    with open(zip_csv, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        headers = next(reader)
+        yield headers
+        yield from reader
+
+def read_codes(zip_csv):
+    """(zips, 5-digit county codes) used by the source zip_county.csv"""
+    rows = read_zip_rows(zip_csv)
+    headers = next(rows)
+    column = {name: i for i, name in enumerate(headers)}
+    zips, counties = set(), set()
+    for row in rows:
+        zips.add(row[column['zip']])
+        counties.add(row[column['county_code']].zfill(5))
+    return zips, counties
+
+def read_counties(zip_csv):
+    """{(county, state): (5-digit fips, population)}, population summed over zip shares"""
+    rows = read_zip_rows(zip_csv)
+    headers = next(rows)
+    column = {name: i for i, name in enumerate(headers)}
+    counties = {}
+    for row in rows:
+        key = (row[column['county']], row[column['state_abbreviation']])
+        # A few territory zips carry no county to report on
+        if not all(key):
+            continue
+        fips, population = counties.get(key, (row[column['county_code']].zfill(5), 0.0))
+        if row[column['zip_pop']] and row[column['zip_pop_in_county']]:
+            population += float(row[column['zip_pop']]) * float(row[column['zip_pop_in_county']])
+        counties[key] = (fips, population)
+    return counties
+
+def write_zip_county(zip_csv, out_path, scale, compress, zip_codes, fips_codes):
+    """Copy zip_county.csv once per replica, rewriting codes and names; return rows"""
+    written = 0
+    with open_output(out_path, compress) as f:
+        writer = csv.writer(f)
+        for replica in range(scale):
+            rows = read_zip_rows(zip_csv)
+            headers = next(rows)
+            column = {name: i for i, name in enumerate(headers)}
+            if replica == 0:
+                writer.writerow(headers)
+            for row in rows:
+                zip_code = zip_codes.code(row[column['zip']], replica)
+                if zip_code is None:
+                    continue
+                row[column['zip']] = zip_code
+                row[column['county']] = replica_county(row[column['county']], replica)
+                if replica:
+                    # Pad first, so replica codes match the health file's fipscode
+                    row[column['county_code']] = fips_codes.code(row[column['county_code']].zfill(5), replica)
+                writer.writerow(row)
+                written += 1
+    return written
+
+def format_value(kind, value):
+    return f"{value:.6f}" if kind == 'rate' else f"{value:.3f}"
+
+def health_rows(counties, replica, releases, last_release, seed, fips_codes):
+    """Yield health rows for one replica: every county x measure x release"""
+    rng = random.Random(seed * 1000003 + replica)
+    first_release = last_release - releases + 1
+    for (county, state), (fips, population) in sorted(counties.items()):
+        population = max(int(population), 1000)
+        code = fips_codes.code(fips, replica)
+        name = replica_county(county, replica)
+        for measure_name, (measure_id, kind, low, high, span) in sorted(MEASURES.items()):
+            # Each county has its own level and trend per measure
+            level = rng.uniform(low, high)
+            trend = rng.uniform(-0.03, 0.03) * level
+            for release in range(first_release, last_release + 1):
+                last_year = release - RELEASE_LAG
+                year_span = str(last_year) if span == 1 else f"{last_year - span + 1}-{last_year}"
+                row = [state, name, code[:2], code[2:], year_span, measure_name, str(measure_id),
+                       '', '', '', '', '', str(release), code]
+                if rng.random() >= MISSING_RATE:
+                    value = max(level + trend * (release - first_release) + rng.gauss(0, 0.05 * level), 0.0)
+                    if kind == 'rate':
+                        value = min(value, 1.0)
+                        row[7], row[8] = str(round(value * population)), str(population)
+                    elif kind == 'per_100k':
+                        row[7], row[8] = str(round(value * population / 100000)), str(population)
+                    # Smaller counties get wider intervals
+                    half_width = value * rng.uniform(0.5, 2.0) / population ** 0.5
+                    row[9] = format_value(kind, value)
+                    row[10] = format_value(kind, max(value - half_width, 0.0))
+                    row[11] = format_value(kind, value + half_width)
+                yield row
+
+def write_health(counties, out_path, scale, releases, last_release, seed, compress, fips_codes):
+    """Write county_health_rankings.csv for every replica; return rows"""
+    written = 0
+    with open_output(out_path, compress) as f:
+        writer = csv.writer(f)
+        writer.writerow(HEALTH_HEADERS)
+        for replica in range(scale):
+            for row in health_rows(counties, replica, releases, last_release, seed, fips_codes):
+                writer.writerow(row)
+                written += 1
+    return written
+
+def generate(out_dir, scale=1, seed=1060, releases=10, last_release=2024, compress=False, zip_csv=None):
+    """Write both CSV files into out_dir; return {file name: rows written}.
+
+    Raises ValueError when the free FIPS codes cannot hold scale - 1 replicas.
+    """
+    zip_csv = zip_csv or os.path.join(BASE_DIR, 'zip_county.csv')
+    zips, county_codes = read_codes(zip_csv)
+    zip_codes = ReplicaCodes(zips, free_zips(zips))
+    fips_codes = ReplicaCodes(county_codes, free_fips(county_codes))
+    if fips_codes.full_replicas() < scale - 1:
+        raise ValueError(f"scale {scale} needs more free FIPS codes than there are; "
+                         f"at most {fips_codes.full_replicas() + 1} fits")
+    os.makedirs(out_dir, exist_ok=True)
+    counties = read_counties(zip_csv)
+    return {
+        'zip_county.csv': write_zip_county(zip_csv, os.path.join(out_dir, 'zip_county.csv'),
+                                           scale, compress, zip_codes, fips_codes),
+        'county_health_rankings.csv': write_health(counties, os.path.join(out_dir, 'county_health_rankings.csv'),
+                                                   scale, releases, last_release, seed, compress, fips_codes),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--scale', type=int, default=1, help='multiple of real size, e.g. 1 or 10')
+    parser.add_argument('--seed', type=int, default=1060)
+    parser.add_argument('--releases', type=int, default=10, help='data releases per county and measure')
+    parser.add_argument('--last-release', type=int, default=2024)
+    parser.add_argument('--gzip', action='store_true', help='write .csv.gz files')
+    parser.add_argument('--zip-csv', help='source zip_county.csv (default: the repository copy)')
+    args = parser.parse_args()
+    if args.scale < 1 or args.releases < 1:
+        parser.error('--scale and --releases must be at least 1')
+
+    start = time.perf_counter()
+    try:
+        rows = generate(args.out, args.scale, args.seed, args.releases, args.last_release, args.gzip, args.zip_csv)
+    except ValueError as e:
+        parser.error(str(e))
+    seconds = time.perf_counter() - start
+
+    print(f"{'file':<32} {'rows':>11} {'MB':>9}")
+    for name, count in rows.items():
+        path = os.path.join(args.out, name + ('.gz' if args.gzip else ''))
+        print(f"{name + ('.gz' if args.gzip else ''):<32} {count:>11} {os.path.getsize(path) / 1e6:>9.1f}")
+    print(f"scale {args.scale} in {seconds:.1f} s")
+
+if __name__ == '__main__':
+    main()
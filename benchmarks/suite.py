@@ -0,0 +1,251 @@
+"""
+Benchmark suite: cold start, lookup latency, batch throughput, ingest rows/sec
+and resident memory in one offline run, written as JSON and compared against a
+stored baseline. Exits with status 1 when any metric is worse than the
+baseline by more than the threshold.
+
+The dataset is written by benchmarks/generate_dataset.py at --scale times real
+size, and its scale is recorded with the results: a baseline only compares
+against runs at the same scale.
+
+Usage: python -m benchmarks.suite [--output FILE] [--baseline FILE] [--threshold F]
+                                  [--update-baseline] [--quick] [--scale N]
+                                  [--releases N] [--data-dir DIR]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import api.county_data as county_data
+from api.backends import county_fips
+from api.cache import LRUCache
+from api.load_data import build_snapshot
+from benchmarks import bench_backends, bench_cold_start, bench_ingest
+from benchmarks.common import sample_zips, summarize, time_calls
+from benchmarks.generate_dataset import generate
+
+# Records how a generated dataset directory was built, so reruns can reuse it
+DATASET_MANIFEST = 'suite_dataset.json'
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Largest tolerated relative change for the worse, e.g. 0.35 = 35%
+DEFAULT_THRESHOLD = 0.35
+
+# name: whether higher is better
+METRICS = {
+    'cold_start_ms': False,
+    'lookup_p50_us': False,
+    'lookup_p99_us': False,
+    'batch_pairs_per_sec': True,
+    'ingest_rows_per_sec': True,
+    'rss_mb': False,
+}
+
+# Looser floors for metrics that swing more between identical runs.
+# Microsecond-scale lookups move by a third with background load on a
+# shared machine; the regressions worth catching cost multiples.
+METRIC_THRESHOLDS = {
+    'lookup_p50_us': 0.75,
+    'lookup_p99_us': 1.0,
+}
+
+# Workload sizes; --quick trades precision for a shorter run
+SIZES = {
+    'full': {'cold_start_runs': 5, 'lookups': 20000, 'rounds': 5, 'batch_zips': 2000, 'ingest_runs': 3},
+    'quick': {'cold_start_runs': 2, 'lookups': 1000, 'rounds': 1, 'batch_zips': 500, 'ingest_runs': 1},
+}
+
+def ensure_suite_dataset(data_dir, scale, releases, seed=1060):
+    """Generate the dataset into data_dir unless it already holds this scale; return its description"""
+    dataset = {'scale': scale, 'releases': releases, 'seed': seed}
+    manifest_path = os.path.join(data_dir, DATASET_MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            existing = json.load(f)
+        if {name: existing.get(name) for name in dataset} == dataset:
+            return existing
+    rows = generate(data_dir, scale, seed, releases)
+    dataset['zip_rows'] = rows['zip_county.csv']
+    dataset['health_rows'] = rows['county_health_rankings.csv']
+    with open(manifest_path, 'w') as f:
+        json.dump(dataset, f, indent=2)
+    return dataset
+
+def measure_cold_start(data_dir, runs):
+    """p50 ms from a fresh process to the first lookup answered from the snapshot"""
+    code = bench_cold_start.SOURCES['snapshot'].format(snapshot_path=county_data.get_snapshot_path(data_dir))
+    _, load_times = bench_cold_start.run_source(code, runs)
+    return summarize(load_times)['p50_ms']
+
+def answered_zips(data_dir, count):
+    """A deterministic sample of up to count zips whose lookups find health rows.
+
+    Every measurement sends these, so none of them times a quick 404 for a
+    zip without a county or rows.
+    """
+    db = county_data.load_backend(data_dir)
+    zips = []
+    for zip_code in sample_zips(data_dir, count * 2):
+        county_info = county_data.is_valid_zip(zip_code) and db.county_for_zip(zip_code)
+        if county_info and db.health_rows(county_fips(county_info), 'Adult obesity'):
+            zips.append(zip_code)
+    db.close()
+    return zips[:count]
+
+def measure_lookups(data_dir, zips, rounds):
+    """Best p50/p99 us over rounds of /county_data answers with the response caches disabled"""
+    db = county_data.load_backend(data_dir)
+    measures = sorted(county_data.VALID_MEASURES)
+    lookups = [(zip_code, measures[i % len(measures)]) for i, zip_code in enumerate(zips)]
+
+    def lookup():
+        body, status = county_data.county_data_body(*next(pending))
+        assert status == 200, body
+
+    p50, p99 = [], []
+    with mock.patch.object(county_data, '_db', db), \
+            mock.patch.object(county_data, 'response_cache', LRUCache(0)), \
+            mock.patch.object(county_data, 'county_cache', LRUCache(0)):
+        for _ in range(rounds):
+            pending = iter(lookups)
+            stats = summarize(time_calls(lookup, len(lookups)))
+            p50.append(stats['p50_ms'] * 1000)
+            p99.append(stats['p99_ms'] * 1000)
+    db.close()
+    return min(p50), min(p99)
+
+def measure_batch(data_dir, zips, rounds):
+    """Best (zip, measure) pairs per second answered by one /county_data/batch request"""
+    measures = sorted(county_data.VALID_MEASURES)
+    body = json.dumps({'zips': zips, 'measure_names': measures})
+    client = county_data.app.test_client()
+    db = county_data.load_backend(data_dir)
+    best = None
+    with mock.patch.object(county_data, '_db', db):
+        for _ in range(rounds):
+            start = time.perf_counter()
+            response = client.post('/county_data/batch', data=body, content_type='application/json')
+            seconds = time.perf_counter() - start
+            assert response.status_code == 200, response.data
+            best = seconds if best is None else min(best, seconds)
+    db.close()
+    return len(zips) * len(measures) / best
+
+def measure_ingest(data_dir, runs):
+    """Rows per second through csv_to_sqlite.py's fast path"""
+    csv_paths = [os.path.join(data_dir, name) for name in bench_ingest.CSV_NAMES]
+    rows, seconds = bench_ingest.time_load(bench_ingest.load_fast, csv_paths, None,
+                                           bench_ingest.DEFAULT_BATCH_SIZE, runs)
+    return rows / seconds
+
+def measure_rss(data_dir, zips):
+    """MB of resident memory the default backend adds to a fresh process"""
+    result = subprocess.run([sys.executable, '-c', bench_backends.CHILD, data_dir,
+                             os.environ.get('COUNTY_DATA_BACKEND', county_data.DEFAULT_BACKEND),
+                             json.dumps(zips)],
+                            cwd=county_data.BASE_DIR, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)['rss_after_lookups_mb']
+
+def run_suite(data_dir, sizes):
+    """Run every measurement and return {metric: value}"""
+    build_snapshot(data_dir, county_data.get_snapshot_path(data_dir))
+    zips = answered_zips(data_dir, max(sizes['lookups'], sizes['batch_zips']))
+    lookup_p50, lookup_p99 = measure_lookups(data_dir, zips[:sizes['lookups']], sizes['rounds'])
+    return {
+        'cold_start_ms': measure_cold_start(data_dir, sizes['cold_start_runs']),
+        'lookup_p50_us': lookup_p50,
+        'lookup_p99_us': lookup_p99,
+        'batch_pairs_per_sec': measure_batch(data_dir, zips[:sizes['batch_zips']], sizes['rounds']),
+        'ingest_rows_per_sec': measure_ingest(data_dir, sizes['ingest_runs']),
+        'rss_mb': measure_rss(data_dir, zips[:2000]),
+    }
+
+def compare(metrics, baseline, threshold):
+    """Return {metric: relative change for the worse} for metrics past the threshold"""
+    regressions = {}
+    for name, value in metrics.items():
+        old = baseline.get(name)
+        if name not in METRICS or not old:
+            continue
+        worse = (old - value) / old if METRICS[name] else (value - old) / old
+        if worse > max(threshold, METRIC_THRESHOLDS.get(name, 0)):
+            regressions[name] = worse
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'tolerated relative regression (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store these results as the new baseline instead of comparing')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads')
+    parser.add_argument('--scale', type=int, default=1, help='dataset size as a multiple of real size')
+    parser.add_argument('--releases', type=int, default=10, help='data releases per county and measure')
+    parser.add_argument('--data-dir', help='dataset directory, reused across runs at the same scale '
+                                           '(default: temporary)')
+    args = parser.parse_args()
+    if args.scale < 1 or args.releases < 1:
+        parser.error('--scale and --releases must be at least 1')
+
+    size_name = 'quick' if args.quick else 'full'
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='county_bench_')
+    os.makedirs(data_dir, exist_ok=True)
+    dataset = ensure_suite_dataset(data_dir, args.scale, args.releases)
+    results = {
+        'sizes': size_name,
+        'dataset': dataset,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'backend': os.environ.get('COUNTY_DATA_BACKEND', county_data.DEFAULT_BACKEND),
+        },
+        'metrics': run_suite(data_dir, SIZES[size_name]),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    baseline = {}
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('sizes') != size_name:
+            print(f"warning: baseline was recorded with {baseline.get('sizes')!r} sizes", file=sys.stderr)
+        baseline_dataset = baseline.get('dataset') or {}
+        if (baseline_dataset.get('scale'), baseline_dataset.get('releases')) != (args.scale, args.releases):
+            # Numbers from a different amount of data are not comparable
+            print(f"warning: baseline was recorded at scale {baseline_dataset.get('scale')!r} with "
+                  f"{baseline_dataset.get('releases')!r} releases; not comparing", file=sys.stderr)
+            baseline = {}
+    regressions = compare(results['metrics'], baseline.get('metrics', {}), args.threshold)
+
+    print(f"{'metric':<22} {'value':>12} {'baseline':>12} {'change':>8}")
+    for name, value in results['metrics'].items():
+        old = baseline.get('metrics', {}).get(name)
+        old_text = f"{old:.1f}" if old else ''
+        change = f"{(value - old) / old:+.0%}" if old else ''
+        flag = '  REGRESSION' if name in regressions else ''
+        print(f"{name:<22} {value:>12.1f} {old_text:>12} {change:>8}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,33 @@ Sources:
 
 import sqlite3
 import csv
+import io
 import sys
 import os
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from api.schema import TABLE_INDEXES, UPSERT_KEYS, csv_columns, file_sha256, parse_numbers
+
+# Rows per executemany() call
+DEFAULT_BATCH_SIZE = 1000
+
+# Size of the byte ranges a CSV file is split into for parallel parsing
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Pragmas for a one-off bulk load: no fsyncs and a large page cache.
+# A crash mid-load can leave a corrupt file, which is acceptable because
+# the database is rebuilt from the CSV files anyway.
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Bookkeeping table recording the mtime and hash of each loaded CSV file
+SOURCES_TABLE = '_csv_sources'
 
 def normalize_column_name(name: str) -> str:
     """
@@ -29,13 +54,27 @@ def normalize_column_name(name: str) -> str:
     # Convert to lowercase for consistency
     return name.lower()
 
-def create_table_from_csv(cursor: sqlite3.Cursor, csv_path: str) -> None:
+def create_indexes(cursor: sqlite3.Cursor, table_name: str) -> None:
+    """
+    Create the lookup indexes defined for a table, if any.
+    
+    Args:
+        cursor: SQLite cursor
+        table_name (str): Name of the loaded table
+    """
+    for index_name, index_columns in TABLE_INDEXES.get(table_name, []):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({index_columns})")
+
+def create_table_from_csv(cursor: sqlite3.Cursor, csv_path: str,
+                          batch_size: int = DEFAULT_BATCH_SIZE, into: str = None) -> None:
     """
     Create a SQLite table from a CSV file.
     
     Args:
         cursor: SQLite cursor
         csv_path (str): Path to the CSV file
+        batch_size (int): Rows per executemany() call
+        into (str): Unindexed table to fill instead, typed like the file's own table
     Raises:
         FileNotFoundError: If the CSV file doesn't exist
         Exception: For other errors during processing
@@ -49,21 +88,20 @@ def create_table_from_csv(cursor: sqlite3.Cursor, csv_path: str) -> None:
             csv_reader = csv.reader(csvfile)
             headers = [normalize_column_name(header) for header in next(csv_reader)]
             
-            # Create SQL column definitions (all columns as TEXT)
-            columns = [f"{header} TEXT" for header in headers]
-            create_table_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})"
+            # Create SQL column definitions (TEXT unless the schema declares a type)
+            columns, numeric_columns, keep_text = csv_columns(table_name, headers)
+            create_table_sql = f"CREATE TABLE IF NOT EXISTS {into or table_name} ({', '.join(columns)})"
             cursor.execute(create_table_sql)
             
             # Prepare the INSERT statement once
-            placeholders = ','.join(['?' for _ in headers])
-            insert_sql = f"INSERT INTO {table_name} VALUES ({placeholders})"
+            placeholders = ','.join(['?' for _ in columns])
+            insert_sql = f"INSERT INTO {into or table_name} VALUES ({placeholders})"
             
             # Read and insert data in batches
-            batch_size = 1000
             rows = []
             
             for row in csv_reader:
-                rows.append(row)
+                rows.append(parse_numbers(row, numeric_columns, keep_text))
                 if len(rows) >= batch_size:
                     cursor.executemany(insert_sql, rows)
                     rows = []
@@ -71,6 +109,10 @@ def create_table_from_csv(cursor: sqlite3.Cursor, csv_path: str) -> None:
             # Insert any remaining rows
             if rows:
                 cursor.executemany(insert_sql, rows)
+        
+        # Index after the bulk insert rather than maintaining it row by row
+        if not into:
+            create_indexes(cursor, table_name)
                 
     except FileNotFoundError:
         print(f"Error: CSV file not found: {csv_path}", file=sys.stderr)
@@ -79,14 +121,266 @@ def create_table_from_csv(cursor: sqlite3.Cursor, csv_path: str) -> None:
         print(f"Error processing {csv_path}: {str(e)}", file=sys.stderr)
         raise
 
+def split_csv(csv_path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES):
+    """
+    Read a CSV header and split the rest of the file into line-aligned byte ranges.
+    
+    Ranges always end on a line boundary, so quoted fields must not contain
+    newlines (true for the CHR and zip_county extracts).
+    
+    Args:
+        csv_path (str): Path to the CSV file
+        chunk_bytes (int): Approximate size of each range
+    Returns:
+        tuple: (normalized headers, list of (start, end) byte offsets)
+    """
+    with open(csv_path, 'rb') as f:
+        header_line = f.readline()
+        headers = [normalize_column_name(header)
+                   for header in next(csv.reader([header_line.decode('utf-8')]))]
+        
+        size = os.fstat(f.fileno()).st_size
+        ranges = []
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            # Finish the partial line so the next range starts on a fresh one
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return headers, ranges
+
+def parse_csv_range(csv_path: str, start: int, end: int, numeric_columns: dict, keep_text: bool) -> list:
+    """
+    Parse one byte range of a CSV file (runs in a worker process).
+    
+    Args:
+        csv_path (str): Path to the CSV file
+        start (int): Offset of the first byte of the range
+        end (int): Offset just past the last byte of the range
+        numeric_columns (dict): {position: name} of the columns to convert with parse_number
+        keep_text (bool): Append each row's numeric_text (see api.schema.parse_numbers)
+    Returns:
+        list: Parsed rows ready for executemany()
+    """
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    
+    rows = []
+    for row in csv.reader(io.StringIO(text)):
+        rows.append(parse_numbers(row, numeric_columns, keep_text))
+    return rows
+
+def load_csvs_parallel(conn: sqlite3.Connection, csv_paths: list, workers: int = None,
+                       batch_size: int = DEFAULT_BATCH_SIZE,
+                       chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> int:
+    """
+    Fast ingest: parse CSV byte ranges in worker processes and insert them from a single writer.
+    
+    Bulk-load pragmas are applied for the duration of the load, and indexes
+    are created only after every file has been inserted.
+    
+    Args:
+        conn: SQLite connection (the single writer)
+        csv_paths (list): CSV files to load, one table each
+        workers (int): Parser processes (default: CPU count); 1 parses in-process
+        batch_size (int): Rows per executemany() call
+        chunk_bytes (int): Size of the byte ranges handed to workers
+    Returns:
+        int: Number of rows inserted
+    """
+    cursor = conn.cursor()
+    for pragma in BULK_LOAD_PRAGMAS:
+        cursor.execute(pragma)
+    
+    tables = []
+    for csv_path in csv_paths:
+        table_name = os.path.splitext(os.path.basename(csv_path))[0]
+        headers, ranges = split_csv(csv_path, chunk_bytes)
+        columns, numeric_columns, keep_text = csv_columns(table_name, headers)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})")
+        insert_sql = f"INSERT INTO {table_name} VALUES ({','.join(['?' for _ in columns])})"
+        tables.append((csv_path, table_name, ranges, numeric_columns, keep_text, insert_sql))
+    
+    jobs = [(csv_path, start, end, numeric_columns, keep_text, insert_sql)
+            for csv_path, _, ranges, numeric_columns, keep_text, insert_sql in tables
+            for start, end in ranges]
+    
+    def insert(insert_sql, rows):
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(insert_sql, rows[start:start + batch_size])
+        return len(rows)
+    
+    total_rows = 0
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        # A single parser process would only add pickling overhead
+        for job in jobs:
+            total_rows += insert(job[5], parse_csv_range(*job[:5]))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # A bounded queue of pending ranges keeps memory flat while the
+            # writer drains results in file order
+            pending = deque()
+            job_iter = iter(jobs)
+            for job in job_iter:
+                pending.append((job[5], executor.submit(parse_csv_range, *job[:5])))
+                if len(pending) >= workers * 2:
+                    break
+            
+            while pending:
+                insert_sql, future = pending.popleft()
+                total_rows += insert(insert_sql, future.result())
+                
+                job = next(job_iter, None)
+                if job is not None:
+                    pending.append((job[5], executor.submit(parse_csv_range, *job[:5])))
+    
+    conn.commit()
+    for _, table_name, _, _, _, _ in tables:
+        create_indexes(cursor, table_name)
+    conn.commit()
+    
+    # Leave a self-contained file behind: fold the WAL back in
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    cursor.execute("PRAGMA journal_mode = DELETE")
+    return total_rows
+
+def source_changed(cursor: sqlite3.Cursor, table_name: str, csv_path: str):
+    """
+    Check a CSV file against the mtime and hash recorded when it was last loaded.
+    
+    The file is only hashed when its mtime moved, so touching a file
+    without editing it is not a change.
+    
+    Args:
+        cursor: SQLite cursor
+        table_name (str): Table the file is loaded into
+        csv_path (str): Path to the CSV file
+    Returns:
+        tuple: (changed, mtime_ns, sha256)
+    """
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {SOURCES_TABLE} "
+                   f"(table_name TEXT PRIMARY KEY, mtime_ns INTEGER, sha256 TEXT)")
+    cursor.execute(f"SELECT mtime_ns, sha256 FROM {SOURCES_TABLE} WHERE table_name = ?", (table_name,))
+    recorded = cursor.fetchone()
+    mtime_ns = os.stat(csv_path).st_mtime_ns
+    if recorded and recorded[0] == mtime_ns:
+        return False, mtime_ns, recorded[1]
+    sha256 = file_sha256(csv_path)
+    return recorded is None or recorded[1] != sha256, mtime_ns, sha256
+
+def apply_csv_delta(cursor: sqlite3.Cursor, csv_path: str,
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Bring a loaded table in line with its CSV file, replacing only the rows that changed.
+    
+    Rows are matched on UPSERT_KEYS: every key with a new, changed or removed
+    row has all its rows replaced by the ones in the file. Tables without a
+    usable key, or whose columns changed, are replaced wholesale.
+    
+    Args:
+        cursor: SQLite cursor
+        csv_path (str): Path to the CSV file
+        batch_size (int): Rows per executemany() call
+    Returns:
+        int: Number of keys (or rows, when replaced wholesale) written
+    """
+    table_name = os.path.splitext(os.path.basename(csv_path))[0]
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    if cursor.fetchone() is None:
+        create_table_from_csv(cursor, csv_path, batch_size)
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+        return cursor.fetchone()[0]
+    
+    delta_table = f"{table_name}_delta"
+    create_table_from_csv(cursor, csv_path, batch_size, into=delta_table)
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+    delta_columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({delta_table})")]
+    key_columns = UPSERT_KEYS.get(table_name)
+    
+    if columns != delta_columns:
+        cursor.execute(f"DROP TABLE {table_name}")
+        cursor.execute(f"ALTER TABLE {delta_table} RENAME TO {table_name}")
+        create_indexes(cursor, table_name)
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+        return cursor.fetchone()[0]
+    
+    if not key_columns or not set(key_columns) <= set(columns):
+        cursor.execute(f"DELETE FROM {table_name}")
+        cursor.execute(f"INSERT INTO {table_name} SELECT * FROM {delta_table}")
+        replaced = cursor.rowcount
+    else:
+        key = ', '.join(key_columns)
+        cursor.execute(f"""
+            CREATE TEMP TABLE changed_keys AS
+            SELECT {key} FROM (SELECT * FROM {delta_table} EXCEPT SELECT * FROM {table_name})
+            UNION
+            SELECT {key} FROM (SELECT * FROM {table_name} EXCEPT SELECT * FROM {delta_table})
+        """)
+        cursor.execute(f"DELETE FROM {table_name} WHERE ({key}) IN (SELECT * FROM changed_keys)")
+        cursor.execute(f"INSERT INTO {table_name} SELECT * FROM {delta_table} "
+                       f"WHERE ({key}) IN (SELECT * FROM changed_keys)")
+        cursor.execute("SELECT COUNT(*) FROM changed_keys")
+        replaced = cursor.fetchone()[0]
+        cursor.execute("DROP TABLE changed_keys")
+    cursor.execute(f"DROP TABLE {delta_table}")
+    return replaced
+
+def load_incremental(conn: sqlite3.Connection, csv_paths: list,
+                     batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """
+    Apply only the CSV files that changed since the last load, in one transaction.
+    
+    The database is switched to WAL so readers keep seeing the previous
+    version until the transaction commits, then see the new one in full.
+    
+    Args:
+        conn: SQLite connection
+        csv_paths (list): CSV files to load, one table each
+        batch_size (int): Rows per executemany() call
+    Returns:
+        dict: {table name: keys replaced, or None if the file was unchanged}
+    """
+    conn.execute("PRAGMA journal_mode = WAL")
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        results = {}
+        for csv_path in csv_paths:
+            table_name = os.path.splitext(os.path.basename(csv_path))[0]
+            changed, mtime_ns, sha256 = source_changed(cursor, table_name, csv_path)
+            results[table_name] = apply_csv_delta(cursor, csv_path, batch_size) if changed else None
+            cursor.execute(f"INSERT OR REPLACE INTO {SOURCES_TABLE} VALUES (?, ?, ?)",
+                           (table_name, mtime_ns, sha256))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
 def main():
     """Main function to handle command line arguments and execute the conversion."""
-    if len(sys.argv) < 3:
-        print("Usage: python3 csv_to_sqlite.py <database_file> <csv_file> [<csv_file> ...]", file=sys.stderr)
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        usage="python3 csv_to_sqlite.py [--fast | --incremental] [--workers N] [--batch-size N] "
+              "<database_file> <csv_file> [<csv_file> ...]")
+    parser.add_argument('database_file')
+    parser.add_argument('csv_files', nargs='+')
+    parser.add_argument('--fast', action='store_true',
+                        help='parse in worker processes with bulk-load pragmas')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only apply rows from files that changed since the last load')
+    parser.add_argument('--workers', type=int, help='parser processes for --fast (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='rows per executemany() call')
+    args = parser.parse_args()
+    if args.fast and args.incremental:
+        parser.error("--fast and --incremental cannot be combined")
     
-    db_path = sys.argv[1]
-    csv_files = sys.argv[2:]
+    db_path = args.database_file
+    csv_files = args.csv_files
     
     # Verify CSV files exist
     for csv_path in csv_files:
@@ -99,9 +393,15 @@ def main():
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
-        # Process each CSV file
-        for csv_path in csv_files:
-            create_table_from_csv(cursor, csv_path)
+        if args.fast:
+            load_csvs_parallel(conn, csv_files, args.workers, args.batch_size)
+        elif args.incremental:
+            for table_name, replaced in load_incremental(conn, csv_files, args.batch_size).items():
+                print(f"{table_name}: {'unchanged' if replaced is None else f'{replaced} keys replaced'}")
+        else:
+            # Process each CSV file
+            for csv_path in csv_files:
+                create_table_from_csv(cursor, csv_path, args.batch_size)
         
         # Commit all changes at once
         conn.commit()
@@ -8,6 +8,12 @@ import json
 import gzip
 import os
 
+from api.schema import parse_number
+
+def to_number(value):
+    """Convert a numeric CSV field to int or float; empty strings become None"""
+    return parse_number(value.strip())
+
 def process_csvs():
     # Create api directory if it doesn't exist
     os.makedirs('api', exist_ok=True)
@@ -40,12 +46,12 @@ def process_csvs():
             health_data[key].append({
                 'year_span': row['Year_span'].strip(),
                 'measure_id': row['Measure_id'].strip(),
-                'numerator': row['Numerator'].strip(),
-                'denominator': row['Denominator'].strip(),
-                'raw_value': row['Raw_value'].strip(),
-                'confidence_interval_lower_bound': row['Confidence_Interval_Lower_Bound'].strip(),
-                'confidence_interval_upper_bound': row['Confidence_Interval_Upper_Bound'].strip(),
-                'data_release_year': row['Data_Release_Year'].strip(),
+                'numerator': to_number(row['Numerator']),
+                'denominator': to_number(row['Denominator']),
+                'raw_value': to_number(row['Raw_value']),
+                'confidence_interval_lower_bound': to_number(row['Confidence_Interval_Lower_Bound']),
+                'confidence_interval_upper_bound': to_number(row['Confidence_Interval_Upper_Bound']),
+                'data_release_year': to_number(row['Data_Release_Year']),
                 'fipscode': row['fipscode'].strip()
             })
     
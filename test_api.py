@@ -5,8 +5,47 @@ Test suite for County Health API
 import unittest
 import json
 import os
+import csv
+import io
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from unittest import mock
+import api.county_data as county_data
+from api import instrumentation
+from api.backends import HEALTH_SQL
+from api.cache import LRUCache
 from api.county_data import app
 
+ZIP_HEADERS = ['zip', 'default_state', 'county', 'county_state',
+               'state_abbreviation', 'county_code', 'zip_pop',
+               'zip_pop_in_county', 'n_counties', 'default_city']
+
+HEALTH_HEADERS = ['State', 'County', 'State_code', 'County_code',
+                  'Year_span', 'Measure_name', 'Measure_id', 'Numerator',
+                  'Denominator', 'Raw_value', 'Confidence_Interval_Lower_Bound',
+                  'Confidence_Interval_Upper_Bound', 'Data_Release_Year', 'fipscode']
+
+def write_test_data(directory):
+    """Write a small zip_county.csv / county_health_rankings.csv pair"""
+    with open(os.path.join(directory, 'zip_county.csv'), 'w', newline='', encoding='utf-8') as f:
+        f.write('\ufeff')
+        writer = csv.writer(f)
+        writer.writerow(ZIP_HEADERS)
+        writer.writerow(['84102', 'UT', 'Salt Lake County', 'Utah', 'UT', '49035', '18000', '1', '1', 'Salt Lake City'])
+        writer.writerow(['02138', 'MA', 'Middlesex County', 'Massachusetts', 'MA', '25017', '36125', '1', '1', 'Cambridge'])
+
+    with open(os.path.join(directory, 'county_health_rankings.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEALTH_HEADERS)
+        for state, county, state_code, county_code in [('UT', 'Salt Lake County', '49', '035'),
+                                                       ('MA', 'Middlesex County', '25', '017')]:
+            for year in ('2019', '2020'):
+                writer.writerow([state, county, state_code, county_code, year,
+                                 'Adult obesity', '11', '1000', '10000', '0.1',
+                                 '0.08', '0.12', year, state_code + county_code])
+
 class TestCountyHealthAPI(unittest.TestCase):
     def setUp(self):
         """Set up test client"""
@@ -149,5 +188,970 @@ class TestCountyHealthAPI(unittest.TestCase):
             if len(result) > 0:  # Some measures might not have data
                 self.assertEqual(result[0]['measure_name'], measure)
 
+# Fields of the 2022 TestTypedResponses row as written in the CSV
+CSV_TEXT = {'numerator': '77.0', 'raw_value': '0.10', 'confidence_interval_lower_bound': '0.080',
+            'confidence_interval_upper_bound': '1.5E-3'}
+
+class FixtureDataTestCase(unittest.TestCase):
+    """Base class that points the API at a small temporary dataset"""
+
+    def setUp(self):
+        """Point the API at a small temporary dataset"""
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        self.data_dir = mock.patch.object(county_data, 'DATA_DIR', self.test_dir)
+        self.data_dir.start()
+        self.db = mock.patch.object(county_data, '_db', None)
+        self.db.start()
+        self.caches = [mock.patch.object(county_data, name, LRUCache(county_data.CACHE_SIZE))
+                       for name in ('response_cache', 'county_cache')]
+        for cache in self.caches:
+            cache.start()
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.stop()
+        self.db.stop()
+        self.data_dir.stop()
+        shutil.rmtree(self.test_dir)
+
+class TestSharedDatabase(FixtureDataTestCase):
+    def post(self, zip_code):
+        return self.client.post('/county_data',
+                                data=json.dumps({'zip': zip_code, 'measure_name': 'Adult obesity'}),
+                                content_type='application/json')
+
+    def test_second_request_does_no_csv_io(self):
+        """CSV files are parsed on the first request only"""
+        with mock.patch.object(county_data, 'load_csv_data',
+                               wraps=county_data.load_csv_data) as load:
+            self.assertEqual(self.post('84102').status_code, 200)
+            self.assertEqual(load.call_count, 2)
+
+            with mock.patch('builtins.open', side_effect=AssertionError('CSV read')):
+                response = self.post('02138')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)[0]['county'], 'Middlesex County')
+            self.assertEqual(load.call_count, 2)
+
+    def test_reload_db(self):
+        """reload_db swaps in a freshly built database"""
+        first = county_data.get_db()
+        self.assertIs(county_data.get_db(), first)
+
+        reloaded = county_data.reload_db()
+        self.assertIsNot(reloaded, first)
+        self.assertIs(county_data.get_db(), reloaded)
+        self.assertEqual(self.post('84102').status_code, 200)
+
+class TestIncrementalReload(FixtureDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # Imported here: api.load_data imports api.county_data
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+
+    def set_raw_value(self, raw_value, mtime_ns):
+        """Rewrite the health CSV with a new raw_value on every row"""
+        health_csv = os.path.join(self.test_dir, 'county_health_rankings.csv')
+        with open(health_csv, 'r', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        for row in rows[1:]:
+            row[9] = raw_value
+        with open(health_csv, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(rows)
+        # Distinct mtimes even on filesystems with coarse timestamps
+        os.utime(health_csv, ns=(mtime_ns, mtime_ns))
+
+    def test_refresh_without_changes(self):
+        """Nothing is reloaded while the CSV files are unchanged"""
+        first = county_data.get_db()
+        self.assertFalse(county_data.refresh_db())
+        self.assertIs(county_data.get_db(), first)
+
+    def test_concurrent_reads_during_swap(self):
+        """Requests keep succeeding, on the old or the new data, while refreshes swap it"""
+        first = county_data.get_db()
+        stop = threading.Event()
+        seen, errors = set(), []
+
+        def read():
+            client = app.test_client()
+            while not stop.is_set():
+                response = client.post('/county_data',
+                                       data=json.dumps({'zip': '84102', 'measure_name': 'Adult obesity'}),
+                                       content_type='application/json')
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+                    continue
+                # Every answer comes from one consistent snapshot
+                seen.add(frozenset(row['raw_value'] for row in json.loads(response.data)))
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for i, raw_value in enumerate(['0.2', '0.3', '0.4'], start=1):
+                self.set_raw_value(raw_value, 10 ** 18 + i * 10 ** 9)
+                self.assertTrue(county_data.refresh_db())
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(seen, {frozenset([value]) for value in ('0.1', '0.2', '0.3', '0.4')})
+        self.assertEqual(county_data.get_health_data(49035, 'Adult obesity',
+                                                     county_data.get_db())[0]['raw_value'], 0.4)
+        # A request still holding the old backend can finish on it
+        self.assertEqual(first.health_rows(49035, 'Adult obesity')[0]['raw_value'], 0.1)
+
+class TestResponseCache(FixtureDataTestCase):
+    def post(self, zip_code):
+        return self.client.post('/county_data',
+                                data=json.dumps({'zip': zip_code, 'measure_name': 'Adult obesity'}),
+                                content_type='application/json')
+
+    def stats(self):
+        return json.loads(self.client.get('/county_data/stats').data)
+
+    def test_cached_response_is_identical(self):
+        """A cache hit returns the same bytes without touching the backend"""
+        first = self.post('84102')
+        with mock.patch.object(county_data, 'get_health_data', side_effect=AssertionError('lookup')), \
+             mock.patch.object(county_data, 'get_county_from_zip', side_effect=AssertionError('lookup')):
+            second = self.post('84102')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.mimetype, 'application/json')
+
+        stats = self.stats()['response_cache']
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+
+    def test_county_level_cache(self):
+        """Zips in the same county share the (FIPS code, measure) entry"""
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['84101', 'UT', 'Salt Lake County', 'Utah', 'UT', '49035',
+                                    '5000', '1', '1', 'Salt Lake City'])
+        self.assertEqual(self.post('84102').status_code, 200)
+        with mock.patch.object(county_data, 'get_health_data', side_effect=AssertionError('lookup')):
+            self.assertEqual(self.post('84101').status_code, 200)
+        self.assertEqual(self.stats()['county_cache']['hits'], 1)
+
+    def test_not_found_is_cached(self):
+        """404 answers from the data are cached too"""
+        self.assertEqual(self.post('00000').status_code, 404)
+        self.assertEqual(self.post('00000').status_code, 404)
+        self.assertEqual(self.stats()['response_cache']['hits'], 1)
+
+    def test_reload_invalidates(self):
+        """Reloading the data empties both cache levels"""
+        self.post('84102')
+        county_data.reload_db()
+        stats = self.stats()
+        self.assertEqual(stats['response_cache']['size'], 0)
+        self.assertEqual(stats['county_cache']['size'], 0)
+
+    def test_stale_value_not_stored(self):
+        """A value computed before a reload is dropped"""
+        generation = county_data.response_cache.generation
+        county_data.invalidate_caches()
+        county_data.response_cache.set(('84102', 'Adult obesity'), (b'stale', 200), generation)
+        self.assertIsNone(county_data.response_cache.get(('84102', 'Adult obesity')))
+
+class TestTypedResponses(FixtureDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # A row with missing numbers, as in real CHR extracts
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', newline='',
+                  encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['UT', 'Salt Lake County', '49', '035', '2021', 'Adult obesity',
+                             '11', '', '', '0.25', '', '', '2021', '49035'])
+            # Numbers written so that str() of the parsed value would differ
+            writer.writerow(['UT', 'Salt Lake County', '49', '035', '2022', 'Adult obesity',
+                             '11', '77.0', '1000', '0.10', '0.080', '1.5E-3', '2022', '49035'])
+
+    def post(self, **options):
+        data = {'zip': '84102', 'measure_name': 'Adult obesity'}
+        data.update(options)
+        return self.client.post('/county_data', data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_default_returns_strings(self):
+        """Without typed, every value is a string as before"""
+        rows = json.loads(self.post().data)
+        self.assertEqual(rows[0]['raw_value'], '0.1')
+        self.assertEqual(rows[0]['numerator'], '1000')
+        self.assertEqual(rows[0]['data_release_year'], '2019')
+        self.assertEqual(rows[0]['fipscode'], '49035')
+        self.assertEqual(rows[2]['numerator'], '')
+        self.assertTrue(all(isinstance(value, str) for row in rows for value in row.values()))
+        # Trailing zeros and exponents come back as written in the CSV
+        self.assertEqual({name: rows[3][name] for name in CSV_TEXT}, CSV_TEXT)
+        self.assertNotIn('numeric_text', rows[3])
+
+    def test_csv_text_on_every_path(self):
+        """Every backend and untyped answer returns numbers as the CSV wrote them"""
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        batch = json.dumps({'zips': ['84102'], 'measure_names': ['Adult obesity']})
+
+        for name in county_data.BACKENDS:
+            with mock.patch.object(county_data, '_db', county_data.load_backend(self.test_dir, name)):
+                county_data.invalidate_caches()
+                answers = {
+                    'zip': json.loads(self.post().data),
+                    'fips': json.loads(self.client.get('/county_data?fips=49035&measure_name=Adult+obesity').data),
+                    'include_rank': json.loads(self.post(include_rank=True).data),
+                    'stream': [json.loads(line) for line in self.post(stream=True).data.splitlines()],
+                    'all_counties': json.loads(self.post(all_counties=True).data)['counties'][0]['rows'],
+                    'batch': json.loads(self.client.post('/county_data/batch', data=batch,
+                                                         content_type='application/json').data)
+                             ['results']['84102']['Adult obesity'],
+                    'export': json.loads(self.client.get('/measures/Adult obesity?state=UT').data)['rows'],
+                }
+                for path, rows in answers.items():
+                    row = next(row for row in rows if row['data_release_year'] == '2022')
+                    self.assertEqual({name: row[name] for name in CSV_TEXT}, CSV_TEXT, (name, path))
+                    self.assertNotIn('numeric_text', row, (name, path))
+
+                series = json.loads(self.post(series=True).data)
+                self.assertEqual(series['values'][-1], '0.10', name)
+                self.assertEqual(series['ci_upper'][-1], '1.5E-3', name)
+                csv_export = self.client.get('/measures/Adult obesity?state=UT&format=csv').data.decode()
+                self.assertIn(',77.0,1000,0.10,0.080,1.5E-3,2022,', csv_export, name)
+                self.assertNotIn('numeric_text', csv_export, name)
+                rankings = json.loads(self.client.get('/measures/Adult obesity/rankings/49035').data)
+                self.assertEqual(rankings['rankings'][-1]['raw_value'], '0.10', name)
+
+                typed = json.loads(self.post(typed=True).data)[3]
+                self.assertEqual((typed['numerator'], typed['raw_value'], typed['confidence_interval_upper_bound']),
+                                 (77, 0.1, 0.0015), name)
+                self.assertNotIn('numeric_text', typed, name)
+
+    def test_typed_returns_numbers(self):
+        """typed=true returns JSON numbers and nulls"""
+        rows = json.loads(self.post(typed=True).data)
+        self.assertEqual(rows[0]['raw_value'], 0.1)
+        self.assertEqual(rows[0]['numerator'], 1000)
+        self.assertEqual(rows[0]['data_release_year'], 2019)
+        self.assertEqual(rows[0]['fipscode'], '49035')
+        self.assertEqual(rows[0]['year_span'], '2019')
+        self.assertIsNone(rows[2]['numerator'])
+        self.assertIsNone(rows[2]['confidence_interval_lower_bound'])
+
+        get = self.client.get('/county_data?zip=84102&measure_name=Adult%20obesity&typed=true')
+        self.assertEqual(json.loads(get.data), rows)
+        self.assertNotEqual(get.headers['ETag'], self.post().headers['ETag'])
+
+    def test_typed_memory_backend(self):
+        """The memory backend's columnar storage gives the same typed rows"""
+        expected = json.loads(self.post(typed=True).data)
+        with mock.patch.object(county_data, '_db', county_data.load_backend(self.test_dir, 'memory')):
+            county_data.invalidate_caches()
+            self.assertEqual(json.loads(self.post(typed=True).data), expected)
+
+class TestAllCounties(FixtureDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # 84999 spans Salt Lake County (75% of its people) and Davis County (25%)
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['84999', 'UT', 'Salt Lake County', 'Utah', 'UT', '49035', '4000', '0.75', '2', 'Salt Lake City'])
+            writer.writerow(['84999', 'UT', 'Davis County', 'Utah', 'UT', '49011', '4000', '0.25', '2', 'Salt Lake City'])
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', newline='',
+                  encoding='utf-8') as f:
+            writer = csv.writer(f)
+            for year in ('2019', '2020'):
+                writer.writerow(['UT', 'Davis County', '49', '011', year, 'Adult obesity', '11',
+                                 '3000', '10000', '0.3', '0.28', '0.32', year, '49011'])
+
+    def post(self, zip_code='84999', **options):
+        data = {'zip': zip_code, 'measure_name': 'Adult obesity', 'all_counties': True}
+        data.update(options)
+        return self.client.post('/county_data', data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_weighted_counties(self):
+        """Every county is returned with its weight, plus the weighted aggregate"""
+        result = json.loads(self.post(typed=True).data)
+        self.assertEqual([(c['county'], c['county_code'], c['weight']) for c in result['counties']],
+                         [('Salt Lake County', '49035', 0.75), ('Davis County', '49011', 0.25)])
+        self.assertEqual([row['raw_value'] for row in result['counties'][1]['rows']], [0.3, 0.3])
+        self.assertEqual([item['year_span'] for item in result['aggregate']], ['2019', '2020'])
+        for item in result['aggregate']:
+            self.assertAlmostEqual(item['raw_value'], 0.75 * 0.1 + 0.25 * 0.3)
+            self.assertEqual((item['weight'], item['n_counties']), (1.0, 2))
+
+        # Untyped answers render numbers as strings, as elsewhere
+        result = json.loads(self.post().data)
+        self.assertEqual(result['counties'][0]['weight'], '0.75')
+        self.assertIsInstance(result['aggregate'][0]['raw_value'], str)
+
+        # The default mode is unchanged and cached separately
+        default = json.loads(self.post(all_counties=False).data)
+        self.assertEqual({row['county'] for row in default}, {'Davis County'})
+        self.assertNotEqual(self.post().headers['ETag'], self.post(all_counties=False).headers['ETag'])
+        self.assertEqual(self.post('99999').status_code, 404)
+
+    def test_aggregate_only(self):
+        """aggregate_only returns the weights and aggregate without rows"""
+        full = json.loads(self.post(typed=True).data)
+        result = json.loads(self.post(typed=True, aggregate_only=True).data)
+        self.assertEqual(result['aggregate'], full['aggregate'])
+        self.assertEqual(result['counties'], [{key: value for key, value in county.items() if key != 'rows'}
+                                              for county in full['counties']])
+        self.assertNotEqual(self.post(aggregate_only=True).headers['ETag'], self.post().headers['ETag'])
+
+    def test_snapshot_matches_csv_database(self):
+        """Snapshot aggregates equal the ones computed from the CSV database"""
+        from api.load_data import build_snapshot
+        snapshot_path = county_data.get_snapshot_path(self.test_dir)
+        build_snapshot(self.test_dir, snapshot_path)
+        snapshot = county_data.load_backend(self.test_dir, 'sqlite')
+        os.remove(snapshot_path)
+        others = [county_data.load_backend(self.test_dir, name) for name in ('sqlite', 'memory')]
+
+        expected = {zip_code: snapshot.zip_aggregates(zip_code, 'Adult obesity')
+                    for zip_code in ('84102', '02138', '84999')}
+        for backend in others:
+            for zip_code, aggregate in expected.items():
+                self.assertEqual(backend.weighted_counties_for_zip(zip_code),
+                                 snapshot.weighted_counties_for_zip(zip_code))
+                self.assertEqual(backend.zip_aggregates(zip_code, 'Adult obesity'), aggregate)
+
+    def test_same_bytes_on_every_backend(self):
+        """A multi-county answer is byte-identical on every backend"""
+        # 84998's weights and values do not add up exactly in floating point
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            for county, county_code, weight in [('Salt Lake County', '49035', '0.1'),
+                                                ('Davis County', '49011', '0.2'),
+                                                ('Utah County', '49049', '0.7')]:
+                writer.writerow(['84998', 'UT', county, 'Utah', 'UT', county_code, '9000', weight, '3',
+                                 'Provo'])
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', newline='',
+                  encoding='utf-8') as f:
+            writer = csv.writer(f)
+            for year in ('2019', '2020'):
+                writer.writerow(['UT', 'Utah County', '49', '049', year, 'Adult obesity', '11',
+                                 '7000', '10000', '0.7', '0.68', '0.72', year, '49049'])
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+
+        answers = {}
+        for name in county_data.BACKENDS:
+            with mock.patch.object(county_data, '_db', county_data.load_backend(self.test_dir, name)):
+                county_data.invalidate_caches()
+                answers[name] = [self.post('84998', **options).data
+                                 for options in ({}, {'typed': True}, {'aggregate_only': True})]
+        self.assertEqual(len(set(map(tuple, answers.values()))), 1, answers)
+
+class TestPrebuiltBodies(FixtureDataTestCase):
+    def lookups(self):
+        """Every (zip, measure) the endpoint answers, plus an unknown zip"""
+        return [(zip_code, measure_name) for zip_code in ('84102', '02138', '99999')
+                for measure_name in sorted(county_data.VALID_MEASURES)]
+
+    def test_snapshot_serves_prebuilt_bytes(self):
+        """Snapshot answers are byte-identical to serialized ones, without row lookups"""
+        expected = {lookup: county_data.county_data_body(*lookup) for lookup in self.lookups()}
+        expected_typed = county_data.county_data_body('84102', 'Adult obesity', typed=True)
+
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        county_data.reload_db()
+        with mock.patch('api.backends.SQLiteBackend.health_rows', return_value=[]) as health_rows:
+            for lookup, result in expected.items():
+                self.assertEqual(county_data.county_data_body(*lookup), result)
+        # Only measures without rows are looked up, to answer 404
+        self.assertEqual({call.args[1] for call in health_rows.call_args_list},
+                         county_data.VALID_MEASURES - {'Adult obesity'})
+
+        # Typed answers are not prebuilt
+        self.assertIsNone(county_data.get_db().prebuilt_rows(49035, 'Adult obesity', typed=True))
+        self.assertEqual(county_data.county_data_body('84102', 'Adult obesity', typed=True), expected_typed)
+
+    def test_only_most_populous_counties_are_prebuilt(self):
+        """Counties outside PREBUILT_COUNTIES are answered from their rows, byte for byte"""
+        expected = {lookup: county_data.county_data_body(*lookup) for lookup in self.lookups()}
+
+        from api import load_data
+        with mock.patch.object(load_data, 'PREBUILT_COUNTIES', 1):
+            load_data.build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        county_data.reload_db()
+        db = county_data.get_db()
+        # Middlesex County has the most residents
+        self.assertIsNotNone(db.prebuilt_rows(25017, 'Adult obesity'))
+        self.assertIsNone(db.prebuilt_rows(49035, 'Adult obesity'))
+        for lookup, result in expected.items():
+            self.assertEqual(county_data.county_data_body(*lookup), result)
+
+    def test_snapshot_splices_prebuilt_rows(self):
+        """Batch answers splice the snapshot's encoded rows, byte for byte"""
+        batch = json.dumps({'zips': ['84102', '02138', '99999'],
+                            'measure_names': sorted(county_data.VALID_MEASURES)})
+        expected_batch = self.client.post('/county_data/batch', data=batch,
+                                          content_type='application/json').data
+
+        from api import load_data
+        load_data.build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        county_data.reload_db()
+        with mock.patch('api.backends.SQLiteBackend.iter_health_rows_for_counties') as iter_rows:
+            self.assertEqual(self.client.post('/county_data/batch', data=batch,
+                                              content_type='application/json').data, expected_batch)
+        iter_rows.assert_not_called()
+
+        # Counties without prebuilt rows are encoded from them
+        with mock.patch.object(load_data, 'PREBUILT_COUNTIES', 1):
+            load_data.build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        county_data.reload_db()
+        self.assertEqual(self.client.post('/county_data/batch', data=batch,
+                                          content_type='application/json').data, expected_batch)
+
+class TestConditionalRequests(FixtureDataTestCase):
+    def post(self, zip_code, headers=None):
+        return self.client.post('/county_data',
+                                data=json.dumps({'zip': zip_code, 'measure_name': 'Adult obesity'}),
+                                content_type='application/json', headers=headers)
+
+    def test_etag_and_cache_control(self):
+        """Responses carry an ETag and Cache-Control"""
+        response = self.post('84102')
+        self.assertEqual(response.status_code, 200)
+        etag, weak = response.get_etag()
+        self.assertFalse(weak)
+        self.assertTrue(etag.startswith(county_data.get_db().dataset_version + '-'))
+        self.assertIn('max-age', response.headers['Cache-Control'])
+        self.assertNotEqual(etag, self.post('02138').get_etag()[0])
+
+    def test_if_none_match(self):
+        """A matching If-None-Match gets a 304 without a lookup"""
+        etag = self.post('84102').headers['ETag']
+        with mock.patch.object(county_data, 'county_data_body', side_effect=AssertionError('lookup')):
+            response = self.post('84102', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        response = self.post('84102', headers={'If-None-Match': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_weak_if_none_match(self):
+        """A weak If-None-Match (as rewritten by compressing proxies) gets a 304 from both apps"""
+        from test_asgi import call
+        etag = self.post('84102').headers['ETag']
+        headers = {'If-None-Match': f'"stale", W/{etag}'}
+        self.assertEqual(self.post('84102', headers=headers).status_code, 304)
+        status, _, body = call('POST', '/county_data', body={'zip': '84102', 'measure_name': 'Adult obesity'},
+                               headers=headers)
+        self.assertEqual((status, body), (304, b''))
+
+    def test_get_form(self):
+        """GET /county_data?zip=..&measure_name=.. matches the POST form"""
+        post = self.post('84102')
+        get = self.client.get('/county_data?zip=84102&measure_name=Adult%20obesity')
+        self.assertEqual(get.status_code, 200)
+        self.assertEqual(get.data, post.data)
+        self.assertEqual(get.headers['ETag'], post.headers['ETag'])
+
+        get = self.client.get('/county_data?zip=84102')
+        self.assertEqual(get.status_code, 400)
+
+    def test_etag_changes_with_dataset(self):
+        """Regenerating the CSVs changes every ETag"""
+        etag = self.post('84102').headers['ETag']
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', newline='',
+                  encoding='utf-8') as f:
+            csv.writer(f).writerow(['UT', 'Salt Lake County', '49', '035', '2021', 'Adult obesity',
+                                    '11', '1000', '10000', '0.1', '0.08', '0.12', '2021', '49035'])
+        county_data.reload_db()
+        response = self.post('84102', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)), 3)
+
+class TestBatchEndpoint(FixtureDataTestCase):
+    def post_batch(self, data):
+        return self.client.post('/county_data/batch',
+                                data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_batch_results(self):
+        """Each zip and measure gets its own result or inline error"""
+        response = self.post_batch({
+            'zips': ['84102', '02138', '84102', '00000', 'abc', 84102],
+            'measure_names': ['Adult obesity', 'Uninsured', 'Invalid Measure'],
+        })
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual(set(results), {'84102', '02138', '00000', 'abc'})
+
+        salt_lake = results['84102']
+        self.assertEqual(len(salt_lake['Adult obesity']), 2)
+        self.assertEqual(salt_lake['Adult obesity'][0]['county'], 'Salt Lake County')
+        self.assertIn('No data found', salt_lake['Uninsured']['error'])
+        self.assertEqual(salt_lake['Invalid Measure'], {'error': 'Invalid measure_name'})
+        self.assertEqual(results['02138']['Adult obesity'][0]['county'], 'Middlesex County')
+        self.assertIn('No county found', results['00000']['error'])
+        self.assertEqual(results['abc'], {'error': 'Invalid zip code format'})
+
+    def test_batch_matches_single_endpoint(self):
+        """Batch rows are the same as /county_data rows"""
+        single = self.client.post('/county_data',
+                                  data=json.dumps({'zip': '84102', 'measure_name': 'Adult obesity'}),
+                                  content_type='application/json')
+        batch = self.post_batch({'zips': ['84102'], 'measure_names': ['Adult obesity']})
+        self.assertEqual(json.loads(batch.data)['results']['84102']['Adult obesity'],
+                         json.loads(single.data))
+
+    def test_batch_validation(self):
+        """Malformed and oversized batches are rejected"""
+        self.assertEqual(self.post_batch({'zips': [], 'measure_names': ['Adult obesity']}).status_code, 400)
+        self.assertEqual(self.post_batch({'zips': '84102', 'measure_names': ['Adult obesity']}).status_code, 400)
+        with mock.patch.object(county_data, 'BATCH_MAX_ZIPS', 1):
+            response = self.post_batch({'zips': ['84102', '02138'], 'measure_names': ['Adult obesity']})
+        self.assertEqual(response.status_code, 413)
+
+def write_large_state_data(directory, counties=250, years=4):
+    """Write a dataset with one large state: two zips per county, every measure"""
+    with open(os.path.join(directory, 'zip_county.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(ZIP_HEADERS)
+        for i in range(counties):
+            for j in range(2):
+                writer.writerow([f'{70000 + i * 2 + j:05d}', 'TX', f'County {i}', 'Texas', 'TX',
+                                 f'48{i:03d}', '1000', '1', '1', 'City'])
+
+    with open(os.path.join(directory, 'county_health_rankings.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEALTH_HEADERS)
+        for i in range(counties):
+            for measure_id, measure in enumerate(sorted(county_data.VALID_MEASURES)):
+                for year in range(2010, 2010 + years):
+                    writer.writerow(['TX', f'County {i}', '48', f'{i:03d}', str(year), measure,
+                                     str(measure_id), '1000', '10000', '0.1', '0.08', '0.12',
+                                     str(year), f'48{i:03d}'])
+
+class TestStreaming(FixtureDataTestCase):
+    def post(self, path, data, **kwargs):
+        return self.client.post(path, data=json.dumps(data),
+                                content_type='application/json', **kwargs)
+
+    def test_stream_single_with_accept_header(self):
+        """Accept: application/x-ndjson streams one row per line"""
+        response = self.post('/county_data', {'zip': '84102', 'measure_name': 'Adult obesity'},
+                             headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        buffered = self.post('/county_data', {'zip': '84102', 'measure_name': 'Adult obesity'})
+        self.assertEqual(rows, json.loads(buffered.data))
+
+    def test_stream_single_no_data(self):
+        """Streaming still reports missing data as a 404"""
+        response = self.post('/county_data', {'zip': '84102', 'measure_name': 'Uninsured',
+                                              'stream': True})
+        self.assertEqual(response.status_code, 404)
+
+    def test_stream_batch(self):
+        """Batch streaming emits rows and inline errors as records"""
+        response = self.post('/county_data/batch', {
+            'zips': ['84102', '00000'],
+            'measure_names': ['Adult obesity', 'Uninsured'],
+            'stream': True,
+        })
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        records = [json.loads(line) for line in response.data.decode().splitlines()]
+        rows = [record for record in records if 'row' in record]
+        errors = [record for record in records if 'error' in record]
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(all(record['zip'] == '84102' for record in rows))
+        self.assertEqual(len(errors), 2)
+        self.assertIn({'zip': '00000', 'error': 'No county found for zip code 00000'}, errors)
+
+    def test_stream_memory_is_bounded(self):
+        """Streaming every measure for a large state keeps peak memory flat"""
+        large_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, large_dir)
+        write_large_state_data(large_dir)
+        db = county_data.load_backend(large_dir)
+        zips = list(db.counties_for_zips([f'{70000 + i:05d}' for i in range(500)]))
+
+        with mock.patch.object(county_data, '_db', db):
+            tracemalloc.start()
+            try:
+                response = self.post('/county_data/batch', {
+                    'zips': zips,
+                    'measure_names': sorted(county_data.VALID_MEASURES),
+                }, headers={'Accept': 'application/x-ndjson'})
+                total_bytes = 0
+                lines = 0
+                for chunk in response.response:
+                    total_bytes += len(chunk)
+                    lines += 1
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(lines, 500 * 12 * 4)
+        # The whole response is several times larger than anything held at once
+        self.assertLess(peak, total_bytes / 4)
+
+class TestMeasureExport(FixtureDataTestCase):
+    def get(self, query='', **kwargs):
+        return self.client.get('/measures/Adult obesity' + query, **kwargs)
+
+    def test_filters_and_formats(self):
+        """Rows in fipscode order, filtered, as JSON, NDJSON or CSV"""
+        result = json.loads(self.get().data)
+        self.assertEqual([(row['fipscode'], row['year_span']) for row in result['rows']],
+                         [('25017', '2019'), ('25017', '2020'), ('49035', '2019'), ('49035', '2020')])
+        self.assertIsNone(result['next_cursor'])
+        self.assertEqual(result['rows'][2], json.loads(self.client.get(
+            '/county_data?zip=84102&measure_name=Adult+obesity').data)[0])
+
+        rows = json.loads(self.get('?state=UT&year=2020&typed=true').data)['rows']
+        self.assertEqual([(row['county'], row['raw_value']) for row in rows], [('Salt Lake County', 0.1)])
+        self.assertEqual(len(json.loads(self.get('?fipscode=2').data)['rows']), 2)
+
+        ndjson = self.get(headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(ndjson.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in ndjson.data.decode().splitlines()], result['rows'])
+
+        lines = list(csv.DictReader(io.StringIO(self.get('?format=csv').data.decode())))
+        self.assertEqual(lines, result['rows'])
+
+    def test_keyset_cursor(self):
+        """limit pages through every row with next_cursor, in any format"""
+        first = self.get('?limit=3')
+        page = json.loads(first.data)
+        self.assertEqual(len(page['rows']), 3)
+        self.assertEqual(first.headers['X-Next-Cursor'], page['next_cursor'])
+
+        rest = self.get('?format=ndjson&cursor=' + page['next_cursor'])
+        self.assertNotIn('X-Next-Cursor', rest.headers)
+        self.assertEqual([json.loads(line) for line in rest.data.decode().splitlines()],
+                         json.loads(self.get().data)['rows'][3:])
+
+    def test_invalid_requests(self):
+        """Unknown measures and malformed parameters are rejected"""
+        self.assertEqual(self.client.get('/measures/Nonexistent').status_code, 404)
+        for query in ('?year=20x9', '?fipscode=4a', '?limit=0', '?cursor=abc', '?format=xml',
+                      '?limit=100000'):
+            self.assertEqual(self.get(query).status_code, 400, query)
+
+    def test_snapshot_and_backends_agree(self):
+        """Snapshot shards, SQL and the memory engine give the same pages"""
+        expected = self.get('?limit=3&typed=true').data
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        for backend in county_data.BACKENDS:
+            with mock.patch.object(county_data, '_db', county_data.load_backend(self.test_dir, backend)):
+                self.assertEqual(self.get('?limit=3&typed=true').data, expected, backend)
+
+class TestRankings(FixtureDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # Davis County outranks Salt Lake and Middlesex, tied at 0.1; the Utah state row is not ranked
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', newline='',
+                  encoding='utf-8') as f:
+            writer = csv.writer(f)
+            for year in ('2019', '2020'):
+                writer.writerow(['UT', 'Davis County', '49', '011', year, 'Adult obesity', '11',
+                                 '3000', '10000', '0.3', '0.28', '0.32', year, '49011'])
+                writer.writerow(['UT', 'Utah', '49', '000', year, 'Adult obesity', '11',
+                                 '', '', '0.9', '', '', year, '49000'])
+
+    def get(self, path):
+        return json.loads(self.client.get('/measures/Adult obesity' + path).data)
+
+    def test_include_rank(self):
+        """include_rank adds each row's national and state standing"""
+        rows = json.loads(self.client.get('/county_data?zip=84102&measure_name=Adult+obesity'
+                                          '&include_rank=true&typed=true').data)
+        self.assertEqual([row.pop('rank') for row in rows], [{
+            'national': {'rank': 2, 'count': 3, 'percentile': 33.33},
+            'state': {'rank': 2, 'count': 2, 'percentile': 25.0},
+        }] * 2)
+        plain = self.client.get('/county_data?zip=84102&measure_name=Adult+obesity&typed=true')
+        self.assertEqual(rows, json.loads(plain.data))
+
+        untyped = json.loads(self.client.get('/county_data?zip=84102&measure_name=Adult+obesity'
+                                             '&include_rank=true').data)
+        self.assertEqual(untyped[0]['rank']['state'], {'rank': '2', 'count': '2', 'percentile': '25.0'})
+        response = self.client.get('/county_data?zip=84102&measure_name=Adult+obesity'
+                                   '&include_rank=true&all_counties=true')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rankings_and_summary(self):
+        """Top and bottom counties, a county's ranks and means and medians per state"""
+        result = self.get('/rankings?typed=true')
+        self.assertEqual((result['data_release_year'], result['count']), (2020, 3))
+        self.assertEqual([(county['fipscode'], county['rank']) for county in result['counties']],
+                         [('49011', 1), ('25017', 2), ('49035', 2)])
+        result = self.get('/rankings?state=UT&order=bottom&limit=1&year=2019&typed=true')
+        self.assertEqual([(county['county'], county['rank'], county['percentile'])
+                          for county in result['counties']], [('Salt Lake County', 2, 25.0)])
+
+        county = self.get('/rankings/49011?typed=true')
+        self.assertEqual([(item['data_release_year'], item['rank']['national']['rank'])
+                          for item in county['rankings']], [(2019, 1), (2020, 1)])
+
+        summary = self.get('/summary?typed=true')
+        self.assertEqual(sorted(summary['states']), ['MA', 'UT'])
+        self.assertAlmostEqual(summary['national']['mean'], 0.5 / 3)
+        self.assertEqual(summary['national']['median'], 0.1)
+        self.assertAlmostEqual(summary['states']['UT']['median'], 0.2)
+        self.assertEqual(list(self.get('/summary?state=MA')['states']), ['MA'])
+
+    def test_invalid_requests(self):
+        """Unknown measures, years, states and counties and bad parameters are rejected"""
+        self.assertEqual(self.client.get('/measures/Nonexistent/rankings').status_code, 404)
+        for path in ('/rankings?year=1999', '/rankings?state=TX', '/summary?state=TX', '/rankings/99999'):
+            self.assertEqual(self.client.get('/measures/Adult obesity' + path).status_code, 404, path)
+        for path in ('/rankings?order=middle', '/rankings?limit=0', '/summary?year=x', '/rankings/4903'):
+            self.assertEqual(self.client.get('/measures/Adult obesity' + path).status_code, 400, path)
+
+class TestTimeSeries(FixtureDataTestCase):
+    def get(self, query=''):
+        return self.client.get('/county_data?zip=84102&measure_name=Adult+obesity&series=true' + query)
+
+    def test_series_mode(self):
+        """series=true returns the county's rows as one record of parallel arrays"""
+        record = json.loads(self.get('&typed=true').data)
+        self.assertEqual((record['county'], record['state']), ('Salt Lake County', 'UT'))
+        self.assertEqual(record['years'], [2019, 2020])
+        self.assertEqual(record['values'], [0.1, 0.1])
+        self.assertEqual(record['ci_lower'], [0.08, 0.08])
+        self.assertEqual(record['deltas'], [None, 0.0])
+        self.assertEqual(record['slope'], 0.0)
+        self.assertEqual(json.loads(self.get().data)['years'], ['2019', '2020'])
+
+        self.assertNotEqual(self.get().headers['ETag'],
+                            self.client.get('/county_data?zip=84102&measure_name=Adult+obesity').headers['ETag'])
+        self.assertEqual(self.get('&include_rank=true').status_code, 400)
+        self.assertEqual(self.client.get('/county_data?zip=99999&measure_name=Adult+obesity'
+                                         '&series=true').status_code, 404)
+
+    def test_snapshot_serves_prebuilt_series(self):
+        """Snapshot series are byte-identical to the ones built from rows, untyped without row lookups"""
+        expected = {typed: self.get('&typed=true' if typed else '').data for typed in (False, True)}
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        county_data.reload_db()
+        with mock.patch('api.backends.SQLiteBackend.health_rows') as health_rows:
+            self.assertEqual(self.get().data, expected[False])
+        health_rows.assert_not_called()
+        self.assertEqual(self.get('&typed=true').data, expected[True])
+
+class TestFipsLookups(FixtureDataTestCase):
+    def setUp(self):
+        super().setUp()
+        # 84101 names Salt Lake County differently from the health rows
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['84101', 'UT', 'Salt Lake', 'Utah', 'UT', '49035', '5000', '1', '1',
+                                    'Salt Lake City'])
+
+    def get(self, query):
+        return self.client.get('/county_data?measure_name=Adult+obesity&' + query)
+
+    def test_fips_parameter(self):
+        """fips=... answers like a zip of that county, and is validated"""
+        by_zip = json.loads(self.get('zip=84102&typed=true').data)
+        self.assertEqual(json.loads(self.get('fips=49035&typed=true').data), by_zip)
+        self.assertEqual(json.loads(self.get('fips=49035&series=true').data)['county'], 'Salt Lake County')
+        self.assertEqual(json.loads(self.get('fips=49035&include_rank=true').data)[0]['rank']['state']['rank'],
+                         '1')
+        self.assertEqual(self.get('fips=49035&stream=true').data.count(b'\n'), 2)
+        self.assertNotEqual(self.get('fips=49035').headers['ETag'], self.get('zip=84102').headers['ETag'])
+
+        missing = self.get('fips=12345')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(json.loads(missing.data)['error'], 'No county found for FIPS code 12345')
+        for query in ('fips=4903', 'fips=49035&zip=84102', 'fips=49035&all_counties=true'):
+            self.assertEqual(self.get(query).status_code, 400, query)
+
+    def test_zips_join_by_fips(self):
+        """A zip whose county is named differently still finds the county's rows"""
+        self.assertEqual(json.loads(self.get('zip=84101').data), json.loads(self.get('zip=84102').data))
+
+    def test_fips_endpoint(self):
+        """/fips/<fipscode> returns the county and every zip it spans, on every backend"""
+        expected = {'fips': '49035', 'county': 'Salt Lake County', 'state': 'UT', 'zips': ['84101', '84102']}
+        self.assertEqual(json.loads(self.client.get('/fips/49035').data), expected)
+        self.assertEqual(self.client.get('/fips/12345').status_code, 404)
+        self.assertEqual(self.client.get('/fips/490').status_code, 400)
+
+        for name in ('sqlite_pool', 'memory', 'sharded'):
+            backend = county_data.load_backend(self.test_dir, name)
+            self.assertEqual(backend.county_for_fips(49035), ('Salt Lake County', 'UT', '49035'))
+            self.assertEqual(backend.zips_for_fips(49035), ['84101', '84102'])
+            self.assertIsNone(backend.county_for_fips(12345))
+            backend.close()
+
+    def test_renamed_county_keeps_every_release(self):
+        """Rows are found by FIPS code, so a county renamed between releases keeps them all"""
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', newline='',
+                  encoding='utf-8') as f:
+            csv.writer(f).writerow(['UT', 'Salt Lake', '49', '035', '2021', 'Adult obesity', '11',
+                                    '1000', '10000', '0.1', '0.08', '0.12', '2021', '49035'])
+        from api.load_data import build_snapshot
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        batch = json.dumps({'zips': ['84102'], 'measure_names': ['Adult obesity']})
+
+        for name in county_data.BACKENDS:
+            with mock.patch.object(county_data, '_db', county_data.load_backend(self.test_dir, name)):
+                county_data.invalidate_caches()
+                for query in ('zip=84102', 'zip=84102&typed=true', 'fips=49035', 'zip=84101&include_rank=true'):
+                    rows = json.loads(self.get(query).data)
+                    self.assertEqual([str(row['data_release_year']) for row in rows], ['2019', '2020', '2021'],
+                                     (name, query))
+                self.assertEqual(json.loads(self.get('fips=49035&series=true&typed=true').data)['years'],
+                                 [2019, 2020, 2021], name)
+                self.assertEqual(self.get('zip=84102&stream=true').data.count(b'\n'), 3, name)
+                county = json.loads(self.get('zip=84102&all_counties=true').data)['counties'][0]
+                self.assertEqual(len(county['rows']), 3, name)
+                results = json.loads(self.client.post('/county_data/batch', data=batch,
+                                                      content_type='application/json').data)['results']
+                self.assertEqual(len(results['84102']['Adult obesity']), 3, name)
+                rankings = json.loads(self.client.get('/measures/Adult obesity/rankings/49035').data)
+                self.assertEqual(len(rankings['rankings']), 3, name)
+
+class TestInstrumentation(FixtureDataTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patches = [
+            mock.patch.object(instrumentation, 'ENABLED', True),
+            mock.patch.object(instrumentation, 'stage_histograms', {}),
+            mock.patch.object(instrumentation, 'request_histograms', {}),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        super().tearDown()
+
+    def post(self, zip_code):
+        return self.client.post('/county_data',
+                                data=json.dumps({'zip': zip_code, 'measure_name': 'Adult obesity'}),
+                                content_type='application/json')
+
+    def test_server_timing(self):
+        """Each stage of a lookup is reported in Server-Timing"""
+        timing = self.post('84102').headers['Server-Timing']
+        stages = [metric.split(';')[0] for metric in timing.split(', ')]
+        self.assertEqual(stages, ['init_db', 'get_county_from_zip', 'get_health_data',
+                                  'serialization', 'total'])
+        self.assertTrue(all(float(metric.split('dur=')[1]) >= 0 for metric in timing.split(', ')))
+
+        # A cached answer skips every lookup stage
+        timing = self.post('84102').headers['Server-Timing']
+        self.assertEqual([metric.split(';')[0] for metric in timing.split(', ')], ['init_db', 'total'])
+
+    def test_disabled_by_default(self):
+        """Without COUNTY_DATA_TIMING there is no header and nothing is recorded"""
+        with mock.patch.object(instrumentation, 'ENABLED', False):
+            self.assertNotIn('Server-Timing', self.post('84102').headers)
+        self.assertEqual(instrumentation.stage_histograms, {})
+
+    def test_metrics(self):
+        """/metrics exposes per-stage histograms in Prometheus text format"""
+        self.post('84102')
+        self.post('02138')
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('# TYPE county_data_stage_seconds histogram', text)
+        self.assertIn('county_data_stage_seconds_count{stage="get_health_data"} 2', text)
+        self.assertIn('county_data_stage_seconds_bucket{stage="serialization",le="+Inf"} 2', text)
+        self.assertIn('county_data_request_seconds_count{endpoint="county_data"} 2', text)
+        self.assertIn('county_data_response_cache_misses_total 2', text)
+
+    def test_slowest_profiles(self):
+        """Sampled requests are profiled and only the slowest N dumps are kept"""
+        profile_dir = os.path.join(self.test_dir, 'profiles')
+        keeper = instrumentation.SlowestProfiles(2, profile_dir)
+        with mock.patch.object(instrumentation, 'PROFILE_SLOWEST', 2), \
+                mock.patch.object(instrumentation, 'PROFILE_RATE', 1.0), \
+                mock.patch.object(instrumentation, 'slowest_profiles', keeper):
+            for zip_code in ('84102', '02138', '84102', '00000'):
+                self.post(zip_code)
+        self.assertEqual(sorted(os.listdir(profile_dir)), sorted(map(os.path.basename, keeper.paths())))
+        self.assertEqual(len(keeper.paths()), 2)
+
+        import pstats
+        stats = pstats.Stats(keeper.paths()[0])
+        self.assertTrue(any(name == 'county_data' for _, _, name in stats.stats))
+
+    def test_one_profile_at_a_time(self):
+        """A request sampled while another is profiled runs unprofiled"""
+        keeper = instrumentation.SlowestProfiles(5, os.path.join(self.test_dir, 'profiles'))
+        with mock.patch.object(instrumentation, 'PROFILE_SLOWEST', 5), \
+                mock.patch.object(instrumentation, 'PROFILE_RATE', 1.0), \
+                mock.patch.object(instrumentation, 'slowest_profiles', keeper):
+            instrumentation.start_request()
+            profiled = threading.Thread(target=lambda: self.post('84102'))
+            profiled.start()
+            profiled.join()
+            self.assertEqual(keeper.paths(), [])
+            instrumentation.finish_request('county_data')
+            self.assertEqual(len(keeper.paths()), 1)
+
+            self.post('02138')
+        self.assertEqual(len(keeper.paths()), 2)
+
+class TestVercelRoutes(unittest.TestCase):
+    def test_every_endpoint_is_routed(self):
+        """vercel.json sends every Flask route to the app"""
+        import re
+        with open(os.path.join(county_data.BASE_DIR, 'vercel.json'), encoding='utf-8') as f:
+            sources = [route['src'] for route in json.load(f)['routes']]
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint == 'static':
+                continue
+            path = re.sub(r'<[^>]+>', 'x', rule.rule)
+            self.assertTrue(any(re.fullmatch(source, path) for source in sources), rule.rule)
+
+class TestLookupIndexes(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def query_plan(self, conn, sql, params):
+        return ' '.join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+    def test_lookups_use_indexes(self):
+        """Both lookups are index searches rather than table scans"""
+        for clustered in (False, True):
+            conn = county_data.load_csv_db(self.test_dir, clustered=clustered)
+            plan = self.query_plan(conn, "SELECT county, state_abbreviation, county_code "
+                                         "FROM zip_county WHERE zip = ?", ('84102',))
+            self.assertIn('SEARCH', plan)
+            self.assertRegex(plan, 'COVERING INDEX|PRIMARY KEY')
+
+            plan = self.query_plan(conn, HEALTH_SQL.format(codes='?, ?'), ('4903', '04903', 'Adult obesity'))
+            self.assertIn('SEARCH', plan)
+            self.assertIn('idx_health_fipscode_measure', plan)
+            conn.close()
+
+    def test_clustered_layout_matches(self):
+        """The clustered layout returns the same rows as the plain one"""
+        plain = county_data.load_csv_db(self.test_dir)
+        clustered = county_data.load_csv_db(self.test_dir, clustered=True)
+        for conn in (plain, clustered):
+            self.assertEqual(county_data.get_county_from_zip('84102', conn),
+                             ('Salt Lake County', 'UT', '49035'))
+        self.assertEqual(county_data.get_health_data(25017, 'Adult obesity', plain),
+                         county_data.get_health_data(25017, 'Adult obesity', clustered))
+        plain.close()
+        clustered.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,161 @@
+"""
+Test suite for the ASGI entry point
+"""
+
+import asyncio
+import json
+import unittest
+from unittest import mock
+import api.asgi as asgi
+import api.county_data as county_data
+from test_api import FixtureDataTestCase
+
+def call(method, path, query='', body=None, headers=None):
+    """Drive asgi.app through one request; return (status, headers, body bytes)"""
+    headers = dict(headers or {})
+    if body is not None:
+        headers.setdefault('Content-Type', 'application/json')
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode('latin-1'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers.items()],
+    }
+    requests = [{'type': 'http.request', 'body': body or b'', 'more_body': False}]
+    messages = []
+
+    async def receive():
+        return requests.pop(0) if requests else {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    start = messages[0]
+    response_headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+class TestASGIApp(FixtureDataTestCase):
+    def post(self, data, headers=None):
+        return call('POST', '/county_data', body=data, headers=headers)
+
+    def test_matches_flask(self):
+        """GET and POST answers are byte-identical to the Flask app's"""
+        for data in ({'zip': '84102', 'measure_name': 'Adult obesity'},
+                     {'zip': '84102', 'measure_name': 'Adult obesity', 'typed': True},
+                     {'zip': '99999', 'measure_name': 'Adult obesity'},
+                     {'zip': '8410', 'measure_name': 'Adult obesity'}):
+            flask = self.client.post('/county_data', data=json.dumps(data), content_type='application/json')
+            status, headers, body = self.post(data)
+            self.assertEqual((status, body), (flask.status_code, flask.data))
+            self.assertEqual(headers.get('etag'), flask.headers.get('ETag'))
+
+        flask = self.client.get('/county_data?zip=84102&measure_name=Adult%20obesity')
+        status, headers, body = call('GET', '/county_data', 'zip=84102&measure_name=Adult%20obesity')
+        self.assertEqual((status, body, headers['etag']), (200, flask.data, flask.headers['ETag']))
+        self.assertEqual(headers['cache-control'], county_data.CACHE_CONTROL)
+
+    def test_request_parsing_matches_flask(self):
+        """Repeated, blank and badly encoded query values and invalid JSON bodies get the Flask app's answers"""
+        for query in ('zip=84102&zip=02138&measure_name=Adult%20obesity',
+                      'zip=02138&measure_name=Adult+obesity&measure_name=Nope',
+                      'zip=&measure_name=Adult%20obesity',
+                      'zip=84102&measure_name=Adult%20obesity%FF'):
+            flask = self.client.get(f'/county_data?{query}')
+            self.assertEqual(call('GET', '/county_data', query)[::2], (flask.status_code, flask.data), query)
+
+        for path in ('/county_data', '/county_data/batch'):
+            for body in (b'{"zip": "84102"', b'', b'\xff'):
+                flask = self.client.post(path, data=body, content_type='application/json')
+                self.assertEqual(call('POST', path, body=body)[::2], (flask.status_code, flask.data), body)
+                self.assertEqual(flask.status_code, 400)
+
+    def test_if_none_match(self):
+        """A matching If-None-Match gets a 304 without a lookup"""
+        etag = self.post({'zip': '84102', 'measure_name': 'Adult obesity'})[1]['etag']
+        with mock.patch.object(asgi, 'county_data_result', side_effect=AssertionError('lookup')):
+            status, headers, body = self.post({'zip': '84102', 'measure_name': 'Adult obesity'},
+                                              headers={'If-None-Match': f'W/{etag}'})
+        self.assertEqual((status, body, headers['etag']), (304, b'', etag))
+
+    def test_cache_hits_stay_on_the_loop(self):
+        """Cached answers are sent without the thread pool; misses use it"""
+        data = {'zip': '84102', 'measure_name': 'Adult obesity'}
+        first = self.post(data)
+        with mock.patch.object(asgi, 'run_blocking', side_effect=AssertionError('thread pool')):
+            self.assertEqual(self.post(data), first)
+        stats = county_data.response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_errors(self):
+        """Validation, routing and content-type errors"""
+        self.assertEqual(self.post({'zip': '84102'})[0], 400)
+        self.assertEqual(self.post({'zip': '84102', 'measure_name': 'Nope'})[0], 400)
+        self.assertEqual(self.post(['84102'])[0], 400)
+        self.assertEqual(self.post({'coffee': 'teapot'})[::2], (418, b"I'm a teapot"))
+        self.assertEqual(call('POST', '/county_data', body={'zip': '84102'},
+                              headers={'Content-Type': 'text/plain'})[0], 400)
+        self.assertEqual(call('GET', '/nowhere')[0], 404)
+        status, headers, _ = call('GET', '/county_data/batch')
+        self.assertEqual((status, headers['allow']), (405, 'POST'))
+
+    def test_batch(self):
+        """Batch answers, plain and streamed, match the Flask app's"""
+        data = {'zips': ['84102', '02138', '99999', 123], 'measure_names': ['Adult obesity', 'Nope']}
+        flask = self.client.post('/county_data/batch', data=json.dumps(data), content_type='application/json')
+        self.assertEqual(call('POST', '/county_data/batch', body=data)[::2], (200, flask.data))
+
+        data['stream'] = True
+        flask = self.client.post('/county_data/batch', data=json.dumps(data), content_type='application/json')
+        status, headers, body = call('POST', '/county_data/batch', body=data)
+        self.assertEqual((status, headers['content-type']), (200, county_data.NDJSON_MIMETYPE))
+        self.assertEqual(body, flask.data)
+
+    def test_streamed_lookup(self):
+        """Accept: application/x-ndjson streams the rows"""
+        status, headers, body = self.post({'zip': '84102', 'measure_name': 'Adult obesity'},
+                                          headers={'Accept': county_data.NDJSON_MIMETYPE})
+        self.assertEqual(status, 200)
+        self.assertEqual([json.loads(line)['year_span'] for line in body.splitlines()], ['2019', '2020'])
+
+    def test_stream_failure_aborts(self):
+        """An error after the headers went out aborts the stream instead of starting a 500"""
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'{"zips": ["84102"], "measure_names": ["Adult obesity"], '
+                                                    b'"stream": true}', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/county_data/batch', 'query_string': b'',
+                 'headers': [(b'content-type', b'application/json')]}
+        with mock.patch.object(asgi, 'next_chunk', side_effect=RuntimeError('disk gone')):
+            with self.assertRaises(RuntimeError):
+                asyncio.run(asgi.app(scope, receive, send))
+        self.assertEqual([(message['type'], message.get('status')) for message in messages],
+                         [('http.response.start', 200)])
+
+    def test_lifespan_loads_data(self):
+        """Startup builds the shared backend"""
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        with mock.patch.object(asgi.executor, 'shutdown'):
+            asyncio.run(asgi.app({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertIsNotNone(county_data._db)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+"""
+Test suite for the storage backends
+"""
+
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+import api.county_data as county_data
+from api.backends import (MemoryBackend, PooledSQLiteBackend, ShardedMemoryBackend, SnapshotReplaced,
+                          SQLiteBackend)
+from api.load_data import build_snapshot
+from test_api import write_test_data
+
+class TestBackends(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        self.sqlite = county_data.load_backend(self.test_dir, 'sqlite')
+        self.memory = county_data.load_backend(self.test_dir, 'memory')
+
+    def tearDown(self):
+        self.sqlite.close()
+        self.memory.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_backend_types(self):
+        """load_backend builds the requested backend"""
+        self.assertIsInstance(self.sqlite, SQLiteBackend)
+        self.assertIsInstance(self.memory, MemoryBackend)
+        with self.assertRaises(ValueError):
+            county_data.load_backend(self.test_dir, 'nonexistent')
+
+    def test_backend_from_environment(self):
+        """COUNTY_DATA_BACKEND selects the backend"""
+        with mock.patch.dict(os.environ, {'COUNTY_DATA_BACKEND': 'memory'}):
+            self.assertIsInstance(county_data.load_backend(self.test_dir), MemoryBackend)
+
+    def test_backends_agree(self):
+        """Both backends return identical answers"""
+        for zip_code in ('84102', '02138', '00000'):
+            self.assertEqual(self.memory.county_for_zip(zip_code),
+                             self.sqlite.county_for_zip(zip_code))
+
+        for fips in (49035, 25017, 99999):
+            for measure in ('Adult obesity', 'Uninsured'):
+                self.assertEqual(self.memory.health_rows(fips, measure),
+                                 self.sqlite.health_rows(fips, measure))
+
+        rows = self.memory.health_rows(49035, 'Adult obesity')
+        self.assertEqual([row['year_span'] for row in rows], ['2019', '2020'])
+
+    def test_batch_lookups_agree(self):
+        """Set-based lookups match per-item lookups on both backends"""
+        zips = ['84102', '02138', '00000']
+        counties = [49035, 99999]
+        measures = ['Adult obesity', 'Uninsured']
+        for backend in (self.sqlite, self.memory):
+            self.assertEqual(backend.counties_for_zips(zips), {
+                '84102': ('Salt Lake County', 'UT', '49035'),
+                '02138': ('Middlesex County', 'MA', '25017'),
+            })
+            health = backend.health_rows_for_counties(counties, measures)
+            self.assertEqual(len(health), 4)
+            for (fips, measure), rows in health.items():
+                self.assertEqual(rows, backend.health_rows(fips, measure))
+
+class TestPooledSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        self.pool = PooledSQLiteBackend(county_data.init_db(self.test_dir), size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_matches_sqlite(self):
+        """The pooled backend answers exactly as a single connection does"""
+        sqlite = county_data.load_backend(self.test_dir, 'sqlite')
+        self.assertEqual(self.pool.county_for_zip('84102'), sqlite.county_for_zip('84102'))
+        self.assertEqual(self.pool.health_rows(49035, 'Adult obesity'),
+                         sqlite.health_rows(49035, 'Adult obesity'))
+        self.assertEqual(self.pool.prebuilt_rows(49035, 'Adult obesity'),
+                         sqlite.prebuilt_rows(49035, 'Adult obesity'))
+        sqlite.close()
+
+    def test_zip_lookups_use_snapshot_index(self):
+        """Zips resolve through the snapshot's ZipIndex, as the SQL queries would"""
+        self.assertIsNotNone(self.pool.zip_index())
+        csv_backend = SQLiteBackend(county_data.load_csv_db(self.test_dir))
+        self.assertIsNone(csv_backend.zip_index())
+        for zip_code in ('84102', '02138', '00000', 'abcde'):
+            self.assertEqual(self.pool.county_for_zip(zip_code), csv_backend.county_for_zip(zip_code))
+            self.assertEqual(self.pool.weighted_counties_for_zip(zip_code),
+                             csv_backend.weighted_counties_for_zip(zip_code))
+        self.assertEqual(self.pool.counties_for_zips(['84102', '00000']),
+                         csv_backend.counties_for_zips(['84102', '00000']))
+        csv_backend.close()
+
+    def test_connections_are_lent_and_returned(self):
+        """Concurrent holders get distinct read-only connections, up to size"""
+        with self.pool.connection() as first, self.pool.connection() as second:
+            self.assertIsNot(first, second)
+            with self.assertRaises(sqlite3.OperationalError):
+                second.execute("CREATE TABLE scratch (x)")
+        self.assertEqual(len(self.pool._connections), 2)
+
+        # A stream reads from its own connection, never a pooled one
+        rows = self.pool.iter_health_rows_for_counties([49035], ['Adult obesity'])
+        next(rows)
+        self.assertEqual(self.pool._idle.qsize(), 2)
+        with self.pool.connection(), self.pool.connection():
+            self.assertEqual(len(list(rows)), 1)
+        self.assertEqual(len(self.pool._connections), 2)
+
+    def test_acquire_times_out(self):
+        """Waiting for a connection of an exhausted pool raises instead of blocking forever"""
+        with mock.patch('api.backends.POOL_TIMEOUT', 0.01):
+            with self.pool.connection(), self.pool.connection():
+                with self.assertRaises(TimeoutError):
+                    self.pool.acquire()
+
+    def test_after_fork_reopens_connections(self):
+        """A forked worker gets its own connection to the same snapshot"""
+        with self.pool.connection(), self.pool.connection():
+            pass
+        inherited = self.pool.conn
+        self.pool.after_fork()
+        self.assertIsNot(self.pool.conn, inherited)
+        self.assertEqual(self.pool._connections, [self.pool.conn])
+        self.assertEqual(self.pool.county_for_zip('84102')[0], 'Salt Lake County')
+        inherited.close()
+
+    def test_replaced_snapshot_is_not_mixed_in(self):
+        """After the snapshot file is replaced, only connections to the old one are used"""
+        self.pool.dataset_version = county_data.read_dataset_version(self.pool.conn)
+        # A snapshot with another release is moved into the old one's place
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', encoding='utf-8') as f:
+            f.write('UT,Salt Lake County,49,035,2021,Adult obesity,11,1000,10000,0.1,0.08,0.12,2021,49035\n')
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+
+        self.assertEqual(len(self.pool.health_rows(49035, 'Adult obesity')), 2)
+        self.assertEqual(len(list(self.pool.iter_health_rows_for_counties([49035], ['Adult obesity']))), 2)
+        with mock.patch('api.backends.POOL_TIMEOUT', 0.01):
+            with self.pool.connection() as conn:
+                self.assertIs(conn, self.pool.conn)
+                with self.assertRaises(TimeoutError):
+                    self.pool.acquire()
+        self.assertEqual(self.pool._connections, [self.pool.conn])
+
+        # A forked worker cannot share the old connection, so it has to reload
+        with self.assertRaises(SnapshotReplaced):
+            self.pool.after_fork()
+
+    def test_in_memory_database_is_a_pool_of_one(self):
+        """Without a file to reopen, every lookup shares the one connection"""
+        pool = PooledSQLiteBackend(county_data.load_csv_db(self.test_dir))
+        self.assertEqual(pool.county_for_zip('84102')[0], 'Salt Lake County')
+        with pool.connection() as conn:
+            self.assertIs(conn, pool.conn)
+        self.assertEqual(len(pool._connections), 1)
+
+        # A paused stream does not keep lookups waiting for the one connection
+        rows = pool.iter_health_rows_for_counties([49035], ['Adult obesity'])
+        next(rows)
+        with mock.patch('api.backends.POOL_TIMEOUT', 0.01):
+            self.assertEqual(len(pool.health_rows(25017, 'Adult obesity')), 2)
+        rows.close()
+        pool.close()
+
+class TestShardedMemoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        self.sharded = county_data.load_backend(self.test_dir, 'sharded')
+        self.sqlite = county_data.load_backend(self.test_dir, 'sqlite')
+
+    def tearDown(self):
+        self.sharded.close()
+        self.sqlite.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_reads_only_relevant_shard(self):
+        """A lookup reads its own state's shard, once, and no other"""
+        self.assertIsInstance(self.sharded, ShardedMemoryBackend)
+        self.assertEqual(self.sharded.shards.stats()['size'], 0)
+
+        statements = []
+        self.sharded.conn.set_trace_callback(statements.append)
+        with mock.patch.object(self.sharded, 'read_shard', wraps=self.sharded.read_shard) as read_shard:
+            fips = int(self.sharded.county_for_zip('84102')[2])
+            for _ in range(2):
+                self.assertEqual(self.sharded.health_rows(fips, 'Adult obesity'),
+                                 self.sqlite.health_rows(fips, 'Adult obesity'))
+        read_shard.assert_called_once_with(49)
+        self.assertEqual(len(statements), 1)
+        # The state's rows are one range of the (fipscode, measure_name) index
+        self.assertIn('fipscode BETWEEN', statements[0])
+        self.assertEqual(list(self.sharded.shards._entries), [49])
+
+    def test_memory_cap(self):
+        """Shards beyond the memory cap are evicted, least recently used first"""
+        sharded = ShardedMemoryBackend.from_connection(county_data.init_db(self.test_dir))
+        sharded.shards.max_bytes = sharded.shard(49).nbytes() + 1
+        sharded.shard(25)
+        self.assertEqual(list(sharded.shards._entries), [25])
+        self.assertEqual(sharded.shards.stats()['evictions'], 1)
+        self.assertEqual(sharded.health_rows(49035, 'Adult obesity'),
+                         self.sqlite.health_rows(49035, 'Adult obesity'))
+        sharded.close()
+
+    def test_without_snapshot(self):
+        """Without a snapshot, shards are read from the health table"""
+        sharded = ShardedMemoryBackend.from_connection(county_data.load_csv_db(self.test_dir))
+        for fips in (25017, 99999):
+            self.assertEqual(sharded.health_rows(fips, 'Adult obesity'),
+                             self.sqlite.health_rows(fips, 'Adult obesity'))
+        self.assertEqual(sharded.county_for_zip('02138'), self.sqlite.county_for_zip('02138'))
+        sharded.close()
+
+if __name__ == '__main__':
+    unittest.main()
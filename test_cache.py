@@ -0,0 +1,67 @@
+"""
+Test suite for the LRU response cache
+"""
+
+import unittest
+from unittest import mock
+from api.cache import LRUCache
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction_order(self):
+        """The least recently used entry is evicted first"""
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']),
+                         (3, 1, 1, 2))
+
+    def test_ttl(self):
+        """Entries expire after the TTL"""
+        cache = LRUCache(10, ttl=5)
+        with mock.patch('api.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('api.cache.time.monotonic', return_value=104):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('api.cache.time.monotonic', return_value=105):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_disabled(self):
+        """A max size of 0 disables caching"""
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_clear_bumps_generation(self):
+        """Values from an older generation are not stored"""
+        cache = LRUCache(10)
+        generation = cache.generation
+        cache.clear()
+        cache.set('a', 1, generation)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1, cache.generation)
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_max_bytes(self):
+        """Entries are evicted past the byte budget, keeping the newest"""
+        cache = LRUCache(10, max_bytes=10, sizeof=len)
+        cache.set('a', 'aaaa')
+        cache.set('b', 'bbbb')
+        cache.set('a', 'aaaa')
+        cache.set('c', 'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('aaaa', 'cccc'))
+        cache.set('d', 'd' * 20)
+        self.assertEqual(cache.get('d'), 'd' * 20)
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['bytes'], stats['evictions']), (1, 20, 3))
+
+if __name__ == '__main__':
+    unittest.main()
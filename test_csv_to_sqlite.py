@@ -7,7 +7,9 @@ import sqlite3
 import os
 import csv
 import tempfile
-from csv_to_sqlite import normalize_column_name, create_table_from_csv
+import threading
+from csv_to_sqlite import (normalize_column_name, create_table_from_csv, load_csvs_parallel,
+                           load_incremental, split_csv)
 
 class TestCSVToSQLite(unittest.TestCase):
     def setUp(self):
@@ -88,6 +90,139 @@ class TestCSVToSQLite(unittest.TestCase):
         self.assertEqual(len(rows), 2)
         self.assertEqual(rows[0], ('Test County', 'NY', 'Test Measure', '10'))
 
+    def test_create_indexes(self):
+        """Lookup indexes are created for known API tables"""
+        zip_county_csv = os.path.join(self.test_dir, 'zip_county.csv')
+        with open(zip_county_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['zip', 'county', 'state_abbreviation', 'county_code'])
+            writer.writerow(['12345', 'Test County', 'NY', '36001'])
+        
+        create_table_from_csv(self.cursor, zip_county_csv)
+        create_table_from_csv(self.cursor, self.test_zip_csv)
+        os.remove(zip_county_csv)
+        
+        self.cursor.execute("PRAGMA index_list(zip_county)")
+        self.assertEqual([row[1] for row in self.cursor.fetchall()], ['idx_zip_county_zip'])
+        self.cursor.execute("PRAGMA index_list(test_zip)")
+        self.assertEqual(self.cursor.fetchall(), [])
+
+    def test_typed_columns(self):
+        """Declared numeric columns are stored as numbers, empty fields as NULL"""
+        health_csv = os.path.join(self.test_dir, 'county_health_rankings.csv')
+        with open(health_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['County', 'State', 'Measure_name', 'Raw_value', 'Numerator',
+                             'Data_Release_Year', 'fipscode'])
+            writer.writerow(['Test County', 'NY', 'Test Measure', '0.25', '', '2020', '01001'])
+            writer.writerow(['Test County', 'NY', 'Test Measure', '0.50', '12.0', '2021', '01001'])
+        
+        create_table_from_csv(self.cursor, health_csv)
+        os.remove(health_csv)
+        
+        self.cursor.execute("SELECT * FROM county_health_rankings")
+        self.assertEqual(self.cursor.fetchall(),
+                         [('Test County', 'NY', 'Test Measure', 0.25, None, 2020, '01001', None),
+                          # Fields str() would not give back keep their CSV text
+                          ('Test County', 'NY', 'Test Measure', 0.5, 12, 2021, '01001',
+                           '{"numerator":"12.0","raw_value":"0.50"}')])
+        self.cursor.execute("SELECT typeof(raw_value), typeof(data_release_year) FROM county_health_rankings")
+        self.assertEqual(self.cursor.fetchall(), [('real', 'integer')] * 2)
+
+    def test_split_csv(self):
+        """Byte ranges cover every data line exactly once"""
+        headers, ranges = split_csv(self.test_health_csv, chunk_bytes=1)
+        self.assertEqual(headers, ['county', 'state', 'measure_name', 'value'])
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(ranges[0][1], ranges[1][0])
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.test_health_csv))
+
+    def test_load_csvs_parallel(self):
+        """The fast path loads the same rows, types and indexes as the sequential one"""
+        health_csv = os.path.join(self.test_dir, 'county_health_rankings.csv')
+        with open(health_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['County', 'State', 'Measure_name', 'Raw_value', 'fipscode'])
+            for i in range(500):
+                writer.writerow([f'County {i}', 'NY', 'Test, Measure', str(i / 4) if i % 7 else '', '36001'])
+        
+        create_table_from_csv(self.cursor, health_csv)
+        self.conn.commit()
+        expected = self.cursor.execute("SELECT * FROM county_health_rankings").fetchall()
+        
+        fast_path = os.path.join(self.test_dir, 'fast.db')
+        fast_conn = sqlite3.connect(fast_path)
+        try:
+            count = load_csvs_parallel(fast_conn, [health_csv, self.test_zip_csv],
+                                       workers=2, batch_size=7, chunk_bytes=256)
+            self.assertEqual(count, 502)
+            self.assertEqual(fast_conn.execute("SELECT * FROM county_health_rankings").fetchall(),
+                             expected)
+            self.assertEqual(fast_conn.execute("SELECT * FROM test_zip").fetchall(),
+                             [('12345', 'Test County', 'NY'), ('67890', 'Another County', 'CA')])
+            index_names = [row[1] for row in fast_conn.execute("PRAGMA index_list(county_health_rankings)")]
+            self.assertEqual(index_names, ['idx_health_fipscode_measure'])
+            self.assertEqual(fast_conn.execute("PRAGMA journal_mode").fetchone(), ('delete',))
+        finally:
+            fast_conn.close()
+            os.remove(fast_path)
+            os.remove(health_csv)
+
+    def write_health_csv(self, path, values, mtime_ns):
+        """Write a keyed health CSV with one row per (fipscode, raw_value)"""
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['County', 'State', 'Measure_name', 'Measure_id', 'Year_span',
+                             'Raw_value', 'fipscode'])
+            for fipscode, raw_value in values:
+                writer.writerow(['Test County', 'NY', 'Test Measure', '11', '2020', raw_value, fipscode])
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_load_incremental(self):
+        """Only changed files are applied, replacing only the changed keys"""
+        health_csv = os.path.join(self.test_dir, 'county_health_rankings.csv')
+        values = [(f'{i:05d}', str(i)) for i in range(200)]
+        self.write_health_csv(health_csv, values, 10 ** 18)
+        self.assertEqual(load_incremental(self.conn, [health_csv, self.test_zip_csv]),
+                         {'county_health_rankings': 200, 'test_zip': 2})
+        self.assertEqual(load_incremental(self.conn, [health_csv, self.test_zip_csv]),
+                         {'county_health_rankings': None, 'test_zip': None})
+        
+        # Change one row, drop one and add one
+        values[0] = ('00000', '0.5')
+        del values[1]
+        values.append(('99999', '7'))
+        self.write_health_csv(health_csv, values, 2 * 10 ** 18)
+        
+        total_before = sum(range(200))
+        totals, errors = set(), []
+        stop = threading.Event()
+        def read():
+            reader = sqlite3.connect(self.db_path)
+            try:
+                while not stop.is_set():
+                    totals.add(reader.execute("SELECT SUM(raw_value) FROM county_health_rankings").fetchone()[0])
+            except sqlite3.Error as e:
+                errors.append(e)
+            finally:
+                reader.close()
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            result = load_incremental(self.conn, [health_csv])
+        finally:
+            stop.set()
+            reader.join()
+        os.remove(health_csv)
+        
+        self.assertEqual(result, {'county_health_rankings': 3})
+        total_after = total_before + 0.5 - 1 + 7
+        self.assertEqual(errors, [])
+        # Readers only ever see the complete old or new table
+        self.assertLessEqual(totals, {total_before, total_after})
+        self.assertEqual(self.cursor.execute("SELECT SUM(raw_value), COUNT(*) FROM county_health_rankings")
+                         .fetchone(), (total_after, 200))
+
     def test_handle_missing_file(self):
         """Test handling of missing CSV file"""
         with self.assertRaises(FileNotFoundError):
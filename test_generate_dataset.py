@@ -0,0 +1,75 @@
+"""
+Test suite for the synthetic dataset generator
+"""
+
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from api.county_data import VALID_MEASURES, is_valid_zip
+from api.zip_index import fips_key
+from benchmarks.generate_dataset import ReplicaCodes, generate
+from test_api import write_test_data
+
+class TestGenerateDataset(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        self.zip_csv = os.path.join(self.test_dir, 'zip_county.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def read(self, name, scale=3, seed=1060, compress=False):
+        out_dir = os.path.join(self.test_dir, f"out_{scale}_{seed}_{compress}")
+        generate(out_dir, scale, seed, releases=4, compress=compress, zip_csv=self.zip_csv)
+        path = os.path.join(out_dir, name)
+        if compress:
+            with gzip.open(path + '.gz', 'rb') as f:
+                return f.read()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_scale_and_coverage(self):
+        """Every replica repeats each zip row and covers every county x measure x release"""
+        zips = list(csv.DictReader(self.read('zip_county.csv').decode('utf-8').splitlines()))
+        self.assertEqual(len(zips), 2 * 3)
+        # Replicas take free zips, and FIPS codes in states the source does not use
+        self.assertEqual(sorted(row['zip'] for row in zips),
+                         ['00001', '00002', '00003', '00004', '02138', '84102'])
+        self.assertIn({'zip': '00004', 'county': 'Salt Lake County 2', 'county_code': '01004'},
+                      [{name: row[name] for name in ('zip', 'county', 'county_code')} for row in zips])
+        self.assertTrue(all(is_valid_zip(row['zip']) and fips_key(row['county_code']) for row in zips))
+
+        health = list(csv.DictReader(self.read('county_health_rankings.csv').decode('utf-8').splitlines()))
+        self.assertEqual(len(health), 2 * 3 * len(VALID_MEASURES) * 4)
+        self.assertEqual({row['Measure_name'] for row in health}, VALID_MEASURES)
+        self.assertEqual({row['fipscode'] for row in health},
+                         {'49035', '25017', '01001', '01002', '01003', '01004'})
+        self.assertIn({'State_code': '01', 'County_code': '004', 'fipscode': '01004'},
+                      [{name: row[name] for name in ('State_code', 'County_code', 'fipscode')} for row in health])
+        self.assertIn('2019-2021', {row['Year_span'] for row in health})
+
+    def test_replica_codes_run_out(self):
+        """Replicas past the free codes get none, and scales past the free FIPS codes are refused"""
+        codes = ReplicaCodes({'84102', '02138'}, ['00001', '00002', '00003'])
+        self.assertEqual(codes.full_replicas(), 1)
+        self.assertEqual([codes.code('02138', replica) for replica in range(3)], ['02138', '00001', '00003'])
+        self.assertEqual([codes.code('84102', replica) for replica in range(3)], ['84102', '00002', None])
+
+        with mock.patch('benchmarks.generate_dataset.free_fips', return_value=['01001', '01002', '01003']):
+            with self.assertRaises(ValueError):
+                generate(os.path.join(self.test_dir, 'out'), 3, zip_csv=self.zip_csv)
+            generate(os.path.join(self.test_dir, 'out'), 2, zip_csv=self.zip_csv)
+
+    def test_deterministic(self):
+        """The same seed gives the same bytes, gzipped or not; another seed does not"""
+        first = self.read('county_health_rankings.csv')
+        self.assertEqual(self.read('county_health_rankings.csv', compress=True), first)
+        self.assertNotEqual(self.read('county_health_rankings.csv', seed=7), first)
+
+if __name__ == '__main__':
+    unittest.main()
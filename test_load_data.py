@@ -0,0 +1,175 @@
+"""
+Test suite for the data snapshot build step
+"""
+
+import unittest
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import mock
+import api.county_data as county_data
+from api.load_data import build_snapshot, join_report, update_snapshot
+from test_api import HEALTH_HEADERS, write_test_data
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        self.snapshot_path = county_data.get_snapshot_path(self.test_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_build_snapshot(self):
+        """Snapshot holds both tables and a matching manifest"""
+        manifest = build_snapshot(self.test_dir, self.snapshot_path)
+        self.assertEqual(manifest['format_version'], county_data.SNAPSHOT_FORMAT_VERSION)
+        self.assertEqual(manifest['sha256'], county_data.file_sha256(self.snapshot_path))
+        self.assertEqual(county_data.read_snapshot_manifest(self.snapshot_path), manifest)
+
+        conn = county_data.open_snapshot(self.snapshot_path, verify=True)
+        self.assertEqual(county_data.get_county_from_zip('84102', conn),
+                         ('Salt Lake County', 'UT', '49035'))
+        self.assertEqual(len(county_data.get_health_data(49035, 'Adult obesity', conn)), 2)
+        # Snapshots are opened read-only
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM zip_county")
+        conn.close()
+
+    def test_malformed_zips_are_skipped(self):
+        """Zips the zip index leaves out do not abort the build"""
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', encoding='utf-8') as f:
+            f.write('ABCDE,UT,Salt Lake County,Utah,UT,49035,1,1,1,Nowhere\n')
+            f.write('1234567890,UT,Salt Lake County,Utah,UT,49035,1,1,1,Nowhere\n')
+        build_snapshot(self.test_dir, self.snapshot_path)
+        backend = county_data.load_backend(self.test_dir, 'sqlite')
+        self.assertIsNone(backend.county_for_zip('ABCDE'))
+        self.assertEqual(backend.county_for_zip('84102')[2], '49035')
+        backend.close()
+
+    def test_dataset_version_tracks_sources(self):
+        """Changing a source CSV changes the dataset version"""
+        first = build_snapshot(self.test_dir, self.snapshot_path)
+        self.assertEqual(build_snapshot(self.test_dir, self.snapshot_path)['dataset_version'],
+                         first['dataset_version'])
+
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', encoding='utf-8') as f:
+            f.write('10001,NY,New York County,New York,NY,36061,21102,1,1,New York\n')
+        self.assertNotEqual(build_snapshot(self.test_dir, self.snapshot_path)['dataset_version'],
+                            first['dataset_version'])
+
+    def test_init_db_prefers_snapshot(self):
+        """init_db opens the snapshot without reading the CSV files"""
+        build_snapshot(self.test_dir, self.snapshot_path)
+        with mock.patch.object(county_data, 'load_csv_data') as load:
+            conn = county_data.init_db(self.test_dir)
+        load.assert_not_called()
+        self.assertEqual(county_data.get_county_from_zip('02138', conn)[0], 'Middlesex County')
+        conn.close()
+
+    def test_invalid_snapshot_falls_back_to_csv(self):
+        """A snapshot that fails its manifest check is ignored"""
+        build_snapshot(self.test_dir, self.snapshot_path)
+        with open(self.snapshot_path, 'ab') as f:
+            f.write(b'garbage')
+
+        with self.assertRaises(ValueError):
+            county_data.open_snapshot(self.snapshot_path)
+        with mock.patch.object(county_data, 'load_csv_data',
+                               wraps=county_data.load_csv_data) as load:
+            conn = county_data.init_db(self.test_dir)
+        self.assertEqual(load.call_count, 2)
+        conn.close()
+
+    def test_join_report(self):
+        """The report lists the rows that fail to join by FIPS code"""
+        with open(os.path.join(self.test_dir, 'zip_county.csv'), 'a', encoding='utf-8') as f:
+            f.write('84101,UT,Salt Lake,Utah,UT,49035,5000,1,1,Salt Lake City\n')
+            f.write('10001,NY,New York County,New York,NY,36061,21102,1,1,New York\n')
+            f.write('99999,ZZ,Nowhere County,Nowhere,ZZ,,1,1,1,Nowhere\n')
+        build_snapshot(self.test_dir, self.snapshot_path)
+        conn = county_data.open_snapshot(self.snapshot_path)
+        report = join_report(conn)
+        conn.close()
+        self.assertEqual({problem: result['count'] for problem, result in report.items()}, {
+            'zip_rows_with_invalid_fips': 1,
+            'zip_rows_without_health_rows': 1,
+            'zip_rows_renamed': 1,
+            'counties_without_zips': 0,
+            'health_rows_with_invalid_fips': 0,
+            'fips_with_conflicting_names': 0,
+        })
+        self.assertEqual(report['zip_rows_renamed']['examples'],
+                         [['84101', 'Salt Lake', 'UT', '49035', 'Salt Lake County', 'UT']])
+
+class TestIncrementalUpdate(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        self.snapshot_path = county_data.get_snapshot_path(self.test_dir)
+        build_snapshot(self.test_dir, self.snapshot_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def edit_health_csv(self):
+        """Change one row, drop one and add one"""
+        health_csv = os.path.join(self.test_dir, 'county_health_rankings.csv')
+        with open(health_csv, 'r', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        rows[1][9] = '0.5'      # Salt Lake County 2019 raw_value
+        del rows[4]             # Middlesex County 2020
+        rows.append(['UT', 'Salt Lake County', '49', '035', '2021', 'Adult obesity', '11',
+                     '1', '10', '0.1', '0.08', '0.12', '2021', '49035'])
+        with open(health_csv, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(rows)
+
+    def snapshot_rows(self, table_name):
+        conn = county_data.open_snapshot(self.snapshot_path, verify=True)
+        rows = sorted(conn.execute(f"SELECT * FROM {table_name}").fetchall(), key=repr)
+        conn.close()
+        return rows
+
+    def test_unchanged_sources_are_skipped(self):
+        """Touching a file without editing it is not a change"""
+        os.utime(os.path.join(self.test_dir, 'zip_county.csv'))
+        manifest, changed = update_snapshot(self.test_dir, self.snapshot_path)
+        self.assertEqual(changed, [])
+        # The new mtime is recorded, so the next check hashes nothing
+        with mock.patch('api.load_data.file_sha256') as sha256:
+            self.assertEqual(update_snapshot(self.test_dir, self.snapshot_path)[1], [])
+        sha256.assert_not_called()
+
+    def test_only_changed_rows_are_replaced(self):
+        """The delta matches a full rebuild and only re-reads the changed file"""
+        old_version = county_data.read_snapshot_manifest(self.snapshot_path)['dataset_version']
+        self.edit_health_csv()
+        with mock.patch('api.load_data.load_csv_data', wraps=county_data.load_csv_data) as load:
+            manifest, changed = update_snapshot(self.test_dir, self.snapshot_path)
+        self.assertEqual(changed, ['county_health_rankings.csv'])
+        self.assertEqual(load.call_count, 1)
+        self.assertNotEqual(manifest['dataset_version'], old_version)
+        incremental = {table_name: self.snapshot_rows(table_name)
+                       for table_name in ('zip_county', 'county_health_rankings', 'snapshot_meta',
+                                         'health_fragments')}
+
+        build_snapshot(self.test_dir, self.snapshot_path)
+        for table_name, rows in incremental.items():
+            self.assertEqual(rows, self.snapshot_rows(table_name))
+
+    def test_changed_columns_rebuild(self):
+        """A file whose columns changed triggers a full rebuild"""
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'w',
+                  newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEALTH_HEADERS + ['Extra'])
+            writer.writerow(['UT', 'Salt Lake County', '49', '035', '2019', 'Adult obesity', '11',
+                             '1', '10', '0.1', '0.08', '0.12', '2019', '49035', 'x'])
+        update_snapshot(self.test_dir, self.snapshot_path)
+        # The new column, then numeric_text
+        self.assertEqual(len(self.snapshot_rows('county_health_rankings')[0]), len(HEALTH_HEADERS) + 2)
+
+if __name__ == '__main__':
+    unittest.main()
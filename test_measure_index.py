@@ -0,0 +1,70 @@
+"""
+Test suite for the per-measure export index
+"""
+
+import unittest
+from api.measure_index import MeasureIndex
+
+COLUMNS = ['state', 'county', 'year_span', 'measure_name', 'raw_value', 'data_release_year', 'fipscode']
+
+ROWS = [
+    ('UT', 'Salt Lake County', '2020', 'Adult obesity', 0.3, 2020, '49035'),
+    ('MA', 'Middlesex County', '2019', 'Adult obesity', 0.1, 2019, '25017'),
+    ('UT', 'Salt Lake County', '2019', 'Adult obesity', None, 2019, '49035'),
+    ('UT', 'Davis County', '2019', 'Adult obesity', 0.25, 2019, '49011'),
+    ('MA', 'Middlesex County', '2019', 'Adult obesity', 0.15, 2019, '25017'),
+    ('ZZ', 'Nowhere County', None, 'Adult obesity', 1, None, None),
+]
+
+class TestMeasureIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = MeasureIndex.from_rows(COLUMNS, ROWS)
+
+    def keys(self, positions):
+        return [self.index.key(position) for position in positions]
+
+    def test_order_and_rows(self):
+        """Rows are in (fipscode, year_span, year) order, NULLs first, ties in input order"""
+        self.assertEqual(self.keys(range(len(self.index))), [
+            ('', '', 0), ('25017', '2019', 2019), ('25017', '2019', 2019),
+            ('49011', '2019', 2019), ('49035', '2019', 2019), ('49035', '2020', 2020),
+        ])
+        rows = self.index.rows(range(len(self.index)))
+        self.assertEqual(rows[0], dict(zip(COLUMNS, ROWS[5])))
+        self.assertEqual([row['raw_value'] for row in rows[1:3]], [0.1, 0.15])
+        self.assertEqual(rows[4], dict(zip(COLUMNS, ROWS[2])))
+        self.assertEqual(list(self.index.value_rows([4], text=True))[0][4:], ('', '2019', '49035'))
+
+        values = [list(column) for column in zip(*(tuple(row.values()) for row in rows))]
+        restored = MeasureIndex.from_columns(COLUMNS, values)
+        self.assertEqual(restored.rows(range(len(restored))), rows)
+
+    def test_filters(self):
+        """fipscode prefixes, states and years select the matching rows"""
+        self.assertEqual(self.keys(self.index.page(fipscode_prefix='49')[0]),
+                         [('49011', '2019', 2019), ('49035', '2019', 2019), ('49035', '2020', 2020)])
+        self.assertEqual(self.index.page(fipscode_prefix='491')[0], [])
+        self.assertEqual(self.keys(self.index.page(state='UT', year=2019)[0]),
+                         [('49011', '2019', 2019), ('49035', '2019', 2019)])
+        self.assertEqual(self.keys(self.index.page(fipscode_prefix='25', year=2019)[0]),
+                         [('25017', '2019', 2019)] * 2)
+        self.assertEqual(self.index.page(state='TX')[0], [])
+
+    def test_keyset_pages(self):
+        """Pages resume after the cursor key and never split rows sharing a key"""
+        positions, next_key = self.index.page(limit=2)
+        self.assertEqual(len(positions), 3)
+        self.assertEqual(next_key, ('25017', '2019', 2019))
+
+        positions, next_key = self.index.page(after=next_key, limit=2)
+        self.assertEqual(self.keys(positions), [('49011', '2019', 2019), ('49035', '2019', 2019)])
+        positions, next_key = self.index.page(after=next_key, limit=2)
+        self.assertEqual(self.keys(positions), [('49035', '2020', 2020)])
+        self.assertIsNone(next_key)
+
+        # A cursor whose row has since gone still resumes in order
+        self.assertEqual(self.keys(self.index.page(after=('49012', '', 0))[0]),
+                         [('49035', '2019', 2019), ('49035', '2020', 2020)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Test suite for the pre-forking launcher
+"""
+
+import http.client
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+import api.county_data as county_data
+from api import prefork
+from api.load_data import build_snapshot
+from benchmarks.bench_workers import free_port, get, process_tree, wait_until_serving
+from test_api import write_test_data
+
+QUERY = 'zip=84102&measure_name=Adult+obesity'
+
+def is_running(pid):
+    """True while pid exists and is not a zombie waiting to be reaped"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+@unittest.skipUnless(os.path.exists(f'/proc/{os.getpid()}/task/{os.getpid()}/children'),
+                     "needs Linux /proc to find the workers")
+class TestPrefork(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        write_test_data(self.test_dir)
+        build_snapshot(self.test_dir, county_data.get_snapshot_path(self.test_dir))
+        self.port = free_port()
+        env = dict(os.environ, PORT=str(self.port), COUNTY_DATA_DIR=self.test_dir,
+                   COUNTY_DATA_WORKERS='2')
+        self.launcher = subprocess.Popen([sys.executable, '-m', 'api.prefork'], env=env,
+                                         cwd=county_data.BASE_DIR, stderr=subprocess.DEVNULL)
+        wait_until_serving(self.port, timeout=30)
+
+    def tearDown(self):
+        if self.launcher.poll() is None:
+            self.launcher.send_signal(signal.SIGTERM)
+            try:
+                self.launcher.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.launcher.kill()
+                self.launcher.wait()
+        shutil.rmtree(self.test_dir)
+
+    def workers(self):
+        return set(process_tree(self.launcher.pid)[1:])
+
+    def test_reload_replaces_workers(self):
+        """SIGHUP forks new workers, retires the old ones, and serving continues"""
+        old = self.workers()
+        self.assertEqual(len(old), 2)
+        self.assertEqual(get(self.port, QUERY), 200)
+
+        self.launcher.send_signal(signal.SIGHUP)
+        deadline = time.monotonic() + 30
+        while self.workers() & old or len(self.workers()) != 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.1)
+        self.assertEqual(get(self.port, QUERY), 200)
+
+        self.launcher.send_signal(signal.SIGTERM)
+        self.assertEqual(self.launcher.wait(timeout=30), 0)
+
+    def test_crashed_worker_is_replaced(self):
+        """A worker that dies unasked is forked again"""
+        crashed = min(self.workers())
+        os.kill(crashed, signal.SIGKILL)
+        deadline = time.monotonic() + 30
+        while crashed in self.workers() or len(self.workers()) != 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.1)
+        self.assertEqual(get(self.port, QUERY), 200)
+
+    def test_worker_forked_after_snapshot_replaced(self):
+        """A worker forked after the snapshot file was replaced serves the new data, under its version"""
+        with open(os.path.join(self.test_dir, 'county_health_rankings.csv'), 'a', encoding='utf-8') as f:
+            f.write('UT,Salt Lake County,49,035,2021,Adult obesity,11,1000,10000,0.1,0.08,0.12,2021,49035\n')
+        snapshot_path = county_data.get_snapshot_path(self.test_dir)
+        build_snapshot(self.test_dir, snapshot_path)
+        with sqlite3.connect(snapshot_path) as conn:
+            version = county_data.read_dataset_version(conn)
+
+        old = self.workers()
+        for pid in old:
+            os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 30
+        while self.workers() & old or len(self.workers()) != 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.1)
+
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            conn.request('GET', '/county_data?' + QUERY)
+            response = conn.getresponse()
+            rows = json.loads(response.read())
+        finally:
+            conn.close()
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(response.getheader('ETag').strip('"').startswith(version + '-'))
+
+    def test_workers_exit_with_parent(self):
+        """Workers of a launcher killed outright stop instead of serving on"""
+        workers = self.workers()
+        self.assertEqual(len(workers), 2)
+        self.launcher.kill()
+        self.launcher.wait()
+        deadline = time.monotonic() + 30
+        while any(is_running(pid) for pid in workers):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.1)
+
+class TestRestartBackoff(unittest.TestCase):
+    def test_crashes_in_a_row_back_off(self):
+        """Replacements wait longer while workers keep crashing, up to the logged cap"""
+        supervisor = prefork.Supervisor(None, size=2)
+        now = [1000.0]
+        with mock.patch.object(prefork.time, 'monotonic', lambda: now[0]), \
+                mock.patch.object(prefork, 'RESTART_DELAY', 1), \
+                mock.patch.object(prefork, 'MAX_RESTART_DELAY', 8), \
+                mock.patch.object(supervisor, 'spawn') as spawn:
+            delays = []
+            for _ in range(4):
+                supervisor.schedule_respawn(now[0] - 0.1)
+                delays.append(supervisor.respawns[-1] - now[0])
+            with self.assertLogs(county_data.app.logger, 'ERROR'):
+                supervisor.schedule_respawn(now[0] - 0.1)
+            delays.append(supervisor.respawns[-1] - now[0])
+            self.assertEqual(delays, [1, 2, 4, 8, 8])
+
+            now[0] += 4
+            supervisor.respawn_due()
+            self.assertEqual((spawn.call_count, len(supervisor.respawns)), (3, 2))
+
+            # A worker that ran for MAX_RESTART_DELAY ends the streak
+            supervisor.schedule_respawn(now[0] - 8)
+            self.assertEqual(supervisor.respawns[-1] - now[0], 1)
+
+if __name__ == '__main__':
+    unittest.main()
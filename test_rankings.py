@@ -0,0 +1,64 @@
+"""
+Test suite for measure rankings and summaries
+"""
+
+import unittest
+from api.measure_index import MeasureIndex
+from api.rankings import MeasureRanking
+
+COLUMNS = ['state', 'county', 'year_span', 'raw_value', 'data_release_year', 'fipscode']
+
+ROWS = [
+    ('UT', 'Salt Lake County', '2019', 0.1, 2020, '49035'),
+    ('UT', 'Davis County', '2019', 0.3, 2020, '49011'),
+    ('UT', 'Utah County', '2019', None, 2020, '49049'),
+    ('UT', None, '2019', 0.9, 2020, '49000'),
+    ('MA', 'Middlesex County', '2019', 0.1, 2020, '25017'),
+    ('MA', 'Suffolk County', '2019', 0.2, 2020, '25025'),
+    ('MA', 'Middlesex County', '2018', 0.4, 2019, '25017'),
+]
+
+class TestMeasureRanking(unittest.TestCase):
+    def setUp(self):
+        self.index = MeasureIndex.from_rows(COLUMNS, ROWS)
+        self.ranking = MeasureRanking(self.index)
+
+    def standing(self, fipscode, year=2020):
+        position = self.index.find((fipscode, str(year - 1), year))
+        return self.ranking.standing(position)
+
+    def counties(self, positions):
+        return [self.index.fipscodes[position] for position in positions]
+
+    def test_standings(self):
+        """Ranks count down from the highest raw_value; ties share a rank and split the percentile"""
+        self.assertEqual(self.standing('49011'), {
+            'national': {'rank': 1, 'count': 4, 'percentile': 87.5},
+            'state': {'rank': 1, 'count': 2, 'percentile': 75.0},
+        })
+        self.assertEqual(self.standing('49035')['national'], {'rank': 3, 'count': 4, 'percentile': 25.0})
+        self.assertEqual(self.standing('25017')['national'], {'rank': 3, 'count': 4, 'percentile': 25.0})
+        self.assertEqual(self.standing('25017')['state'], {'rank': 2, 'count': 2, 'percentile': 25.0})
+        self.assertEqual(self.standing('25017', 2019)['national'], {'rank': 1, 'count': 1, 'percentile': 50.0})
+
+        # Rows without a raw_value and state summary rows are not ranked
+        self.assertIsNone(self.standing('49049'))
+        self.assertIsNone(self.standing('49000'))
+
+    def test_top_and_summaries(self):
+        """Top and bottom lists and summaries per year, nationally and per state"""
+        self.assertEqual(self.counties(self.ranking.top(2020, limit=2)), ['49011', '25025'])
+        self.assertEqual(self.counties(self.ranking.top(2020, 'MA', bottom=True)), ['25017', '25025'])
+        self.assertEqual(self.ranking.top(2021), [])
+        self.assertEqual(self.ranking.years(), [2019, 2020])
+        self.assertEqual(self.ranking.states(2020), ['MA', 'UT'])
+
+        summary = self.ranking.summary(2020)
+        self.assertAlmostEqual(summary.pop('mean'), 0.175)
+        self.assertAlmostEqual(summary.pop('median'), 0.15)
+        self.assertEqual(summary, {'count': 4, 'min': 0.1, 'max': 0.3})
+        self.assertEqual(self.ranking.summary(2020, 'UT')['median'], 0.2)
+        self.assertIsNone(self.ranking.summary(2020, 'TX'))
+
+if __name__ == '__main__':
+    unittest.main()
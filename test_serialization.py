@@ -0,0 +1,46 @@
+"""
+Test suite for the JSON serialization layer
+"""
+
+import json
+import unittest
+import api.county_data as county_data
+from api import serialization
+from api.serialization import Fragment, encode, encode_rows, stdlib_dumps
+
+ROWS = [
+    {'state': 'NM', 'county': 'Doña Ana County', 'measure_name': 'Adult obesity',
+     'raw_value': 0.1, 'numerator': 2150, 'denominator': None, 'year_span': '2019-2021'},
+    {'state': 'NM', 'county': 'Doña Ana County', 'measure_name': 'Adult obesity',
+     'raw_value': 0.325, 'numerator': 12, 'denominator': 40, 'year_span': '2022'},
+]
+
+class TestSerialization(unittest.TestCase):
+    def test_stdlib_format(self):
+        """Sorted keys, compact separators, non-ASCII escaped as jsonify does"""
+        self.assertEqual(stdlib_dumps({'b': [1, None], 'a': 'ñ'}), b'{"a":"\\u00f1","b":[1,null]}')
+        for value in (ROWS, {'ñ': '😀\u2028', 'a': [1e-05, 1e16]}):
+            self.assertEqual(stdlib_dumps(value), county_data.app.json.dumps(value, separators=(',', ':')).encode())
+
+    @unittest.skipIf(serialization.orjson is None, 'orjson is not installed')
+    def test_encoders_agree(self):
+        """orjson and the standard library give the same bytes"""
+        for typed in (True, False):
+            rows = [serialization.render_row(row, typed) for row in ROWS]
+            self.assertEqual(serialization.orjson_dumps(rows), stdlib_dumps(rows))
+        for value in ({"error": "No county found for zip code 99999"}, {'ñ': '😀\u2028', 'é': 'plain'},
+                      [1e-05, 0.0001, 1e16, 1.2345678901234568e+17, 2019, '2019e']):
+            self.assertEqual(serialization.orjson_dumps(value), stdlib_dumps(value))
+
+    def test_fragments_are_spliced(self):
+        """Spliced fragments give the bytes of encoding the whole value"""
+        results = {'84102': {'Adult obesity': ROWS, 'Uninsured': {'error': 'No data found'}},
+                   '02138': {'error': 'Invalid zip code format'}}
+        spliced = {'84102': {'Adult obesity': encode_rows(ROWS, True),
+                             'Uninsured': {'error': 'No data found'}},
+                   '02138': {'error': 'Invalid zip code format'}}
+        self.assertEqual(encode({'results': spliced}), serialization.dumps({'results': results}))
+        self.assertEqual(json.loads(encode([Fragment(b'[]'), 1])), [[], 1])
+
+if __name__ == '__main__':
+    unittest.main()
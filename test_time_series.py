@@ -0,0 +1,44 @@
+"""
+Test suite for time series records
+"""
+
+import json
+import unittest
+from api.time_series import encode_series, time_series
+
+def row(year, raw_value, lower=None, upper=None):
+    return {'data_release_year': year, 'year_span': str(year - 2), 'raw_value': raw_value,
+            'confidence_interval_lower_bound': lower, 'confidence_interval_upper_bound': upper}
+
+ROWS = [row(2021, 0.3, 0.28, 0.32), row(2019, 0.1), row(2020, None), row(2022, 0.35, 0.3, 0.4)]
+
+class TestTimeSeries(unittest.TestCase):
+    def test_parallel_arrays(self):
+        """Rows become arrays ordered by data release year, with deltas and a slope"""
+        record = time_series('Salt Lake County', 'UT', 'Adult obesity', ROWS)
+        self.assertEqual(record['years'], [2019, 2020, 2021, 2022])
+        self.assertEqual(record['year_spans'], ['2017', '2018', '2019', '2020'])
+        self.assertEqual(record['values'], [0.1, None, 0.3, 0.35])
+        self.assertEqual(record['ci_lower'], [None, None, 0.28, 0.3])
+        self.assertEqual(record['ci_upper'], [None, None, 0.32, 0.4])
+        # No delta next to a missing value, and none rounded off by float noise
+        self.assertEqual(record['deltas'], [None, None, None, 0.05])
+        # Least squares over (2019, 0.1), (2021, 0.3), (2022, 0.35)
+        self.assertAlmostEqual(record['slope'], 0.0857142857)
+
+    def test_missing_trend(self):
+        """A single year gives no slope"""
+        record = time_series('Salt Lake County', 'UT', 'Adult obesity', [row(2019, 0.1), row(2020, None)])
+        self.assertEqual(record['deltas'], [None, None])
+        self.assertIsNone(record['slope'])
+
+    def test_untyped(self):
+        """Untyped records render every number as a string, like rows"""
+        record = json.loads(encode_series('Salt Lake County', 'UT', 'Adult obesity', ROWS, False))
+        self.assertEqual(record['values'], ['0.1', '', '0.3', '0.35'])
+        self.assertEqual(record['years'][0], '2019')
+        self.assertEqual(record['county'], 'Salt Lake County')
+        self.assertIsInstance(record['slope'], str)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Test suite for the compact zip code index
+"""
+
+import sqlite3
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from api.backends import WEIGHTED_ZIP_SQL, ZIP_SQL, ZIPS_FOR_FIPS_SQL
+from api.county_data import build_fips_tables
+from api.zip_index import ZipIndex, fips_key, zip_key
+
+ROWS = [
+    ('00601', 'Adjuntas Municipio', 'PR', '72001', 0.99744898),
+    ('00601', 'Ponce Municipio', 'PR', '72113', 0.00255102),
+    ('02138', 'Middlesex County', 'MA', '25017', 1),
+    ('84102', 'Salt Lake County', 'UT', '49035', 1),
+    ('84102', 'Davis County', 'UT', '49011', None),
+    ('99999', 'Alpha County', 'ZZ', '99001', 0.5),
+    ('99999', 'Beta County', 'ZZ', '99002', 0.5),
+    ('1099999', 'Beta County 1', 'ZZ', '199002', 1),
+    ('ABCDE', 'Nowhere County', 'ZZ', '99003', 1),
+    ('36003', 'Autauga County', 'AL', '1001', 1),
+]
+
+# Health rows name Salt Lake County differently and pad Autauga's code
+HEALTH_ROWS = [
+    ('Salt Lake Co.', 'UT', '49035'),
+    ('Autauga County', 'AL', '01001'),
+    ('Utah', 'UT', '49000'),
+]
+
+class TestZipIndex(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("CREATE TABLE zip_county (zip TEXT, county TEXT, state_abbreviation TEXT, "
+                          "county_code TEXT, zip_pop_in_county NUMERIC)")
+        self.conn.executemany("INSERT INTO zip_county VALUES (?, ?, ?, ?, ?)", ROWS)
+        self.conn.execute("CREATE TABLE county_health_rankings (county TEXT, state TEXT, fipscode TEXT)")
+        self.conn.executemany("INSERT INTO county_health_rankings VALUES (?, ?, ?)", HEALTH_ROWS)
+        build_fips_tables(self.conn.cursor())
+        self.index = ZipIndex.from_connection(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_multi_county_zips(self):
+        """Zips with several county rows, each listed once and in zip order"""
+        self.assertEqual(self.index.multi_county_zips(), ['00601', '84102', '99999'])
+        rows = [row for row in ROWS if row[4] is not None] + [('99999', 'Gamma County', 'ZZ', '99004', 0)]
+        self.assertEqual(ZipIndex.from_rows(rows).multi_county_zips(), ['00601', '99999'])
+        self.assertEqual(ZipIndex.from_rows(ROWS[2:4]).multi_county_zips(), [])
+
+    def test_matches_sql(self):
+        """Lookups answer exactly as ZIP_SQL and WEIGHTED_ZIP_SQL do"""
+        for zip_code in ('00601', '02138', '84102', '99999', '1099999', '00000', '2138', '', '0x1f'):
+            self.assertEqual(self.index.county_for_zip(zip_code),
+                             self.conn.execute(ZIP_SQL, (zip_code,)).fetchone())
+            self.assertEqual(self.index.weighted_counties_for_zip(zip_code),
+                             [(county, state, county_code, float(weight)) for county, state, county_code, weight
+                              in self.conn.execute(WEIGHTED_ZIP_SQL, (zip_code,))])
+
+    def test_fips_join(self):
+        """Counties take their health rows' names by FIPS code, and FIPS codes map back to zips"""
+        self.assertEqual(self.index.weighted_counties_for_zip('84102'),
+                         [('Salt Lake Co.', 'UT', '49035', 1.0), ('Davis County', 'UT', '49011', 0.0)])
+        self.assertEqual(self.index.county_for_zip('36003'), ('Autauga County', 'AL', '1001'))
+        self.assertEqual(fips_key('01001'), fips_key('1001'))
+        self.assertIsNone(fips_key('199002'))
+        for fips in (1001, 49035, 99002, 12345):
+            self.assertEqual(self.index.zips_for_fips(fips),
+                             [zip_code for zip_code, in self.conn.execute(ZIPS_FOR_FIPS_SQL, (fips,))])
+        self.assertEqual(self.index.zips_for_fips(99002), ['99999'])
+
+    def test_fips_index_threads(self):
+        """Threads racing to build the FIPS index all see it complete"""
+        start = threading.Barrier(8)
+
+        def lookup(fips):
+            start.wait()
+            return self.index.zips_for_fips(fips)
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lookup, [49035] * 8))
+        self.assertEqual(results, [['84102']] * 8)
+
+    def test_compact(self):
+        """Numeric zips are stored as 4-byte ints; other keys are skipped"""
+        self.assertEqual(len(self.index.zips), len(ROWS) - 1)
+        self.assertEqual(self.index.nbytes(), (len(ROWS) - 1) * 16)
+        self.assertEqual(len(self.index.counties), len(ROWS) - 1)
+        self.assertIsNone(zip_key('ABCDE'))
+        self.assertIsNone(zip_key('١٢٣٤٥'))
+        self.assertIsNone(zip_key(84102))
+        self.assertIsNone(zip_key('1234567890'))
+        self.assertNotEqual(zip_key('02138'), zip_key('2138'))
+
+    def test_round_trip(self):
+        """An index read back from its stored row, in either byte order, is the same"""
+        restored = ZipIndex.from_row(self.index.to_row())
+        self.assertEqual((restored.zips, restored.county_ids, restored.weights, restored.counties),
+                         (self.index.zips, self.index.county_ids, self.index.weights, self.index.counties))
+
+        other = ZipIndex(*(values.__copy__() for values in
+                           (self.index.zips, self.index.county_ids, self.index.weights)), self.index.counties)
+        for values in (other.zips, other.county_ids, other.weights):
+            values.byteswap()
+        row = ('big' if sys.byteorder == 'little' else 'little',) + other.to_row()[1:]
+        self.assertEqual(ZipIndex.from_row(row).weighted_counties_for_zip('00601'),
+                         self.index.weighted_counties_for_zip('00601'))
+
+if __name__ == '__main__':
+    unittest.main()